@@ -1,8 +1,10 @@
 import base64
 import json
+import threading
+import time
 
-from botocore.exceptions import ClientError as BotoClientError
-
+from .constants import *
+from .tracing import count, traced
 from .util import *
 
 # Config directory for Docker
@@ -11,6 +13,15 @@ __docker_config_directory = os.path.join(os.environ['HOME'], '.docker')
 # Docker config file
 __docker_config_file = os.path.join(__docker_config_directory, 'config.json')
 
+# File in the user config directory where ECR authorization data is cached between invocations
+__token_cache_file = os.path.join(os.environ['HOME'], '.autocompose', 'ecr-tokens.json')
+
+# ECR authorization data cached for this process, keyed by profile, region and credentials
+__token_cache = {}
+
+# Guards the token cache so that concurrent callers only make one request to ECR
+__token_cache_lock = threading.Lock()
+
 
 def login_to_ecs(aws_session, docker_client, **kwargs):
     """
@@ -60,13 +71,38 @@ def login_to_ecs(aws_session, docker_client, **kwargs):
     print('Login Succeeded. You can can push to and pull from "' + registry + '".')
 
 
-def get_authorization_data(aws_session):
+@traced('get_authorization_data', 'ecr')
+def get_authorization_data(aws_session, refresh=False):
     """
     Retrieve authorization data for ECR from AWS.
     See http://boto3.readthedocs.io/en/latest/reference/services/ecr.html#ECR.Client.get_authorization_token
+    The authorization data is cached in memory and in the user config directory until shortly before it expires,
+    so that only one request is made to AWS per token lifetime.
+    :param aws_session: The AWS session.
+    :param refresh: If True, ignore any cached authorization data.
+    :return: The first element in the authorizationData array.
+    """
+    with __token_cache_lock:
+        key = __get_token_cache_key(aws_session)
+        if not refresh:
+            authorization_data = __get_cached_authorization_data(key)
+            if authorization_data is not None:
+                count('ecr.token_cache_hits')
+                return authorization_data
+
+        authorization_data = __request_authorization_data(aws_session)
+        __cache_authorization_data(key, authorization_data)
+        return authorization_data
+
+
+def __request_authorization_data(aws_session):
+    """
+    Request authorization data for ECR from AWS.
     :param aws_session: The AWS session.
     :return: The first element in the authorizationData array.
     """
+    from botocore.exceptions import ClientError as BotoClientError
+
     aws_client = aws_session.client('ecr')
     try:
         response = aws_client.get_authorization_token()
@@ -84,6 +120,99 @@ def get_authorization_data(aws_session):
     return authorization_data[0]
 
 
+def __get_token_cache_key(aws_session):
+    """
+    Gets the key under which the ECR authorization data of an AWS session is cached.
+    The access key identifies the account (and user) the credentials belong to.
+    :param aws_session: The AWS session.
+    :return: A string key.
+    """
+    if hasattr(aws_session, 'get_access_key'):
+        access_key = aws_session.get_access_key()
+    else:
+        credentials = aws_session.get_credentials()
+        access_key = None if credentials is None else credentials.access_key
+    access_key = access_key or ''
+    return '|'.join([str(aws_session.profile_name), str(aws_session.region_name), str(access_key)])
+
+
+def __get_cached_authorization_data(key):
+    """
+    Gets unexpired authorization data from the in-memory cache, falling back to the cache file.
+    :param key: The cache key.
+    :return: The authorization data, None if there is no usable cached authorization data.
+    """
+    if key not in __token_cache:
+        __token_cache.update(__read_token_cache_file())
+
+    entry = __token_cache.get(key)
+    if entry is None or entry['expiresAt'] - ECR_TOKEN_EXPIRY_MARGIN_SECONDS <= time.time():
+        return None
+
+    return {
+        'authorizationToken': entry['authorizationToken'],
+        'proxyEndpoint': entry['proxyEndpoint'],
+        'expiresAt': entry['expiresAt']
+    }
+
+
+def __cache_authorization_data(key, authorization_data):
+    """
+    Saves authorization data to the in-memory cache and the cache file.
+    :param key: The cache key.
+    :param authorization_data: The authorization data returned by AWS.
+    :return: None
+    """
+    if 'expiresAt' not in authorization_data:
+        return
+
+    expires_at = authorization_data['expiresAt']
+    if hasattr(expires_at, 'timestamp'):
+        expires_at = expires_at.timestamp()
+
+    __token_cache[key] = {
+        'authorizationToken': authorization_data.get('authorizationToken'),
+        'proxyEndpoint': authorization_data.get('proxyEndpoint'),
+        'expiresAt': expires_at
+    }
+    __write_token_cache_file(__token_cache)
+
+
+def __read_token_cache_file():
+    """
+    Reads the unexpired entries of the token cache file.
+    :return: A dictionary of cache entries. {} if the file does not exist or cannot be read.
+    """
+    try:
+        with open(__token_cache_file, 'r') as fd:
+            entries = json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(entries, dict):
+        return {}
+
+    now = time.time()
+    return {key: entry for key, entry in entries.items()
+            if isinstance(entry, dict) and entry.get('expiresAt', 0) > now}
+
+
+def __write_token_cache_file(entries):
+    """
+    Writes the token cache file. The file is only readable by the current user, as it contains registry passwords.
+    :param entries: The cache entries to write.
+    :return: None
+    """
+    directory = os.path.dirname(__token_cache_file)
+    try:
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+        write_file_atomically(__token_cache_file, json.dumps(entries), mode=0o600)
+    except OSError:
+        # The in-memory cache still works without the file.
+        pass
+
+
 def __save_docker_login(registry, authorization_token):
     """
     Persist authorization for a Docker registry to the Docker config file.
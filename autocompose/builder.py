@@ -1,30 +1,55 @@
-import shutil
+import hashlib
+import json
 import subprocess
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
 
+from compose.utils import json_stream
+from docker.utils import exclude_paths
+
+from .authenticator import get_authorization_data
+from .composer import get_scenario_services
 from .constants import *
-from .pusher import tag_to_ecr
+from .pusher import get_docker_repository_name, tag_to_ecr
 from .util import *
 
+# The media type of the image manifests which reference the image config, where the labels are.
+__docker_manifest_media_type = 'application/vnd.docker.distribution.manifest.v2+json'
+
 
-def build(aws_session, docker_client, image_name=None, tag=None):
+def build(aws_session, docker_client, image_name=None, tag=None, scenario=None, source_root='.', jobs=DEFAULT_JOBS,
+          build_args=None, force=False, ecr_cache=False,
+          cache_tag=DEFAULT_BUILD_CACHE_TAG, **kwargs):
     """
     Builds a docker image from the current directory.
+    The build is skipped if an image built from the same recipe, sources and build args exists locally or in ECR.
     :param aws_session: The AWS session.
     :param docker_client: The Docker client
     :param image_name The name of the image.
     :param tag: The tag to apply to the Docker image. Default is latest.
+    :param scenario: If given, build the images of every service of this scenario instead, see build_scenario.
+    :param source_root: The directory containing a directory for every service of the scenario.
+    :param jobs: The number of images of the scenario to build concurrently.
+    :param build_args: A list of "KEY=VALUE" build-time variables.
+    :param force: If True, always build, even if an image with the same fingerprint exists.
+    :param ecr_cache: If True, use the cache tag of the service's ECR repository as a layer cache, see build_scenario.
+    :param cache_tag: The tag of the service's ECR repository to use as a layer cache.
     :return:
     """
+    build_args = parse_build_args(build_args)
+    if not ecr_cache:
+        cache_tag = None
+
+    if scenario is not None:
+        return build_scenario(aws_session, docker_client, scenario, source_root=source_root, tag=tag, jobs=jobs,
+                              build_args=build_args, force=force, cache_tag=cache_tag)
 
     service_name = get_service_name()
     print('Looking for the location of the service "' + service_name + '" in the AUTOCOMPOSE_PATH...')
-    autocompose_config_file = get_first_from_paths(os.path.join('services', service_name), AUTOCOMPOSE_SERVICE_FILE)
-    autocompose_config = yaml.load(open(autocompose_config_file, 'r'))
-
-    # Get the name of the image
-    if AUTOCOMPOSE_IMAGE_KEY not in autocompose_config:
-        raise Exception('No Autocompose image specified')
-    image = autocompose_config[AUTOCOMPOSE_IMAGE_KEY]
+    image = __get_service_image(service_name)
     print('The service "' + service_name + '" wants to use the image "' + image + '".')
 
     # Find the directory where the image recipe resides
@@ -34,49 +59,189 @@ def build(aws_session, docker_client, image_name=None, tag=None):
         raise Exception('Could not find the image ' + image)
     print('Using the path "' + image_path + '"')
 
-    # Copy files from the recipe to the current directory
-    print('Copying files from "' + image_path + '" to your current directory...')
-    copied_files = __copy_files(image_path)
-
     # If the Dockerfile.sh file exists, execute it
-    if os.path.exists(DOCKERFILE_SH):
+    dockerfile_sh = __get_dockerfile_sh('.', image_path)
+    if dockerfile_sh is not None:
         print(DOCKERFILE_SH + ' exists. Executing...')
-        try:
-            subprocess.call(['bash', DOCKERFILE_SH])
-        except BaseException as e:
-            print(e)
-            __fail(copied_files)
-            raise Exception('An error occurred while executing Dockerfile.sh')
-    print('Dockerfile.sh executed successfully.')
+        __execute_dockerfile_sh(dockerfile_sh, '.', image_path)
+        print('Dockerfile.sh executed successfully.')
 
-    # Execute 'docker build .'
+    # Execute 'docker build' with the current directory, overlaid with the recipe, as the build context
     if image_name is None:
         image_name = service_name
 
     if tag is None:
-        repo_tag = image_name
-    else:
-        repo_tag = image_name + ':' + tag
+        tag = 'latest'
+    repo_tag = image_name + ':' + tag
 
-    print('Calling "docker build ." (and tagging image with "' + repo_tag + '")')
+    print('Assembling the build context from your current directory and "' + image_path + '"...')
+    context, context_digest = __create_build_context(os.getcwd(), image_path)
+    fingerprint = get_build_fingerprint(context_digest, build_args)
+
+    print('Calling "docker build" (and tagging image with "' + repo_tag + '")')
     try:
-        __build_docker_image(docker_client, path='.', tag=repo_tag)
+        result = __build_or_reuse_image(aws_session, docker_client, context, fingerprint, service_name, repo_tag,
+                                        build_args=build_args, force=force, cache_tag=cache_tag)
     except BaseException as e:
         print(e)
-        __fail(copied_files)
-        raise Exception('An error occurred when running "docker build .". Make sure the Dockerfile is correct.')
-
-    print('Image built successfully.')
+        raise Exception('An error occurred when running "docker build". Make sure the Dockerfile is correct.')
+    finally:
+        context.close()
 
-    # Cleanup copied files
-    print('Cleaning up copied files...')
-    __cleanup(copied_files)
+    if result == 'built':
+        print('Image built successfully.')
+    else:
+        print('Nothing changed since the last build. Image ' + result + '.')
 
     print('Tagging image with ECR repository...')
     tag_to_ecr(aws_session, docker_client, tag)
     print('Image tagged.')
 
 
+def build_scenario(aws_session, docker_client, scenario, source_root='.', tag=None, jobs=DEFAULT_JOBS,
+                   build_args=None, force=False, cache_tag=None):
+    """
+    Builds the images of every service of a scenario, and tags them for ECR.
+    Each service is built from its directory in the source root, overlaid with its image recipe. A service without a
+    directory in the source root is built from its image recipe alone. Services whose build contexts are identical
+    (e.g. services sharing an image recipe, without sources of their own) are built once, and services whose
+    fingerprint matches an existing image are not built at all. Independent builds run concurrently.
+    With a cache tag, the layers of that tag of each service's ECR repository are used as a build cache, and the tag is
+    updated after each successful build, so that builds on fresh machines do not start from scratch.
+    A table with the timings of every service is printed at the end.
+    :param aws_session: The AWS session.
+    :param docker_client: The Docker client
+    :param scenario: The name of the scenario.
+    :param source_root: The directory containing a directory for every service of the scenario.
+    :param tag: The tag to apply to every image. Default is the version of each service in the scenario.
+    :param jobs: The number of images to build concurrently.
+    :param build_args: A dictionary of build-time variables.
+    :param force: If True, always build, even if an image with the same fingerprint exists.
+    :param cache_tag: The tag of each service's ECR repository to use as a layer cache. None to use no cache.
+    :return: None
+    """
+
+    services = get_scenario_services(scenario)
+    print('Building the images of ' + str(len(services)) + ' services of the scenario "' + scenario + '"...')
+
+    results = {}
+    builds = {}
+    for service_name, version in services:
+        result = {'image': '-', 'context': '-', 'seconds': 0.0, 'result': 'failed'}
+        results[service_name] = result
+        start = time.time()
+        try:
+            result['image'] = __get_service_image(service_name)
+            image_path = __get_image_path(result['image'])
+            if image_path is None:
+                raise Exception('Could not find the image ' + result['image'])
+
+            service_path = os.path.join(source_root, service_name)
+            if not os.path.isdir(service_path):
+                service_path = None
+            else:
+                dockerfile_sh = __get_dockerfile_sh(service_path, image_path)
+                if dockerfile_sh is not None:
+                    __execute_dockerfile_sh(dockerfile_sh, service_path, image_path)
+
+            context, context_digest = __create_build_context(service_path, image_path)
+            fingerprint = get_build_fingerprint(context_digest, build_args)
+            result['context'] = fingerprint[:12]
+            repo_tag = service_name + ':' + (tag or version)
+            if fingerprint in builds:
+                context.close()
+                builds[fingerprint]['repo_tags'].append((service_name, repo_tag))
+            else:
+                builds[fingerprint] = {'context': context, 'fingerprint': fingerprint,
+                                       'repo_tags': [(service_name, repo_tag)]}
+        except BaseException as e:
+            result['result'] = 'failed: ' + str(e)
+        result['seconds'] += time.time() - start
+
+    def build_context(context_build):
+        repo_tags = context_build['repo_tags']
+        start = time.time()
+        try:
+            first_service_name, first_repo_tag = repo_tags[0]
+            first_result = __build_or_reuse_image(aws_session, docker_client, context_build['context'],
+                                                  context_build['fingerprint'], first_service_name, first_repo_tag,
+                                                  build_args=build_args, force=force, cache_tag=cache_tag,
+                                                  output=False)
+            for service_name, repo_tag in repo_tags:
+                repository, _, image_tag = repo_tag.rpartition(':')
+                if repo_tag != first_repo_tag:
+                    docker_client.tag(image=first_repo_tag, repository=repository, tag=image_tag)
+                tag_to_ecr(aws_session, docker_client, image_tag, service_name=service_name)
+                results[service_name]['result'] = first_result if service_name == first_service_name \
+                    else 'shared with ' + first_service_name
+        except BaseException as e:
+            for service_name, _ in repo_tags:
+                results[service_name]['result'] = 'failed: ' + str(e)
+        finally:
+            context_build['context'].close()
+        for service_name, _ in repo_tags:
+            results[service_name]['seconds'] += time.time() - start
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        list(executor.map(build_context, builds.values()))
+
+    rows = [('SERVICE', 'IMAGE', 'FINGERPRINT', 'TIME', 'RESULT')]
+    for service_name, _ in services:
+        result = results[service_name]
+        rows.append((service_name, result['image'], result['context'], '%.1fs' % result['seconds'], result['result']))
+    print_table(rows)
+
+    failures = len([result for result in results.values() if result['result'].startswith('failed')])
+    if failures > 0:
+        raise Exception(str(failures) + ' of ' + str(len(results)) + ' images could not be built.')
+
+
+def parse_build_args(build_args):
+    """
+    Parses build-time variables given as "KEY=VALUE".
+    :param build_args: A list of "KEY=VALUE" strings, or a dictionary, which is returned as is.
+    :return: A dictionary of build-time variables.
+    """
+    if build_args is None or isinstance(build_args, dict):
+        return build_args or {}
+    parsed = {}
+    for build_arg in build_args:
+        if '=' not in build_arg:
+            raise Exception('The build arg "' + build_arg + '" must be given as KEY=VALUE')
+        name, _, value = build_arg.partition('=')
+        parsed[name] = value
+    return parsed
+
+
+def get_build_fingerprint(context_digest, build_args):
+    """
+    Gets the fingerprint of a build: what goes into an image, so that two builds with the same fingerprint produce the
+    same image. The build context covers the recipe, the service's sources and whatever Dockerfile.sh generated.
+    :param context_digest: The SHA-256 digest of the build context.
+    :param build_args: A dictionary of build-time variables.
+    :return: The fingerprint, as a hex digest.
+    """
+    fingerprint = hashlib.sha256(context_digest.encode('utf-8'))
+    for name in sorted(build_args or {}):
+        fingerprint.update(('\0' + name + '=' + str(build_args[name])).encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+def __get_service_image(service_name):
+    """
+    Gets the name of the image recipe a service uses, from its service.yml in the AUTOCOMPOSE_PATH.
+    :param service_name: The name of the service.
+    :return: The name of the image recipe.
+    """
+    autocompose_config_file = get_first_from_paths(os.path.join('services', service_name), AUTOCOMPOSE_SERVICE_FILE)
+    autocompose_config = load_yaml_file(autocompose_config_file)
+
+    # Get the name of the image
+    if autocompose_config is None or AUTOCOMPOSE_IMAGE_KEY not in autocompose_config:
+        raise Exception('No Autocompose image specified')
+    return autocompose_config[AUTOCOMPOSE_IMAGE_KEY]
+
+
 def __get_image_path(image_name):
     """
     Search for docker image recipes in the autocompose path directories.
@@ -90,52 +255,208 @@ def __get_image_path(image_name):
     return images[0]
 
 
-def __copy_files(image_path):
+def __get_dockerfile_sh(service_path, image_path):
     """
-    Copies files from a docker image recipe path to the current path.
+    Gets the Dockerfile.sh to execute before building: the service's, or else the recipe's.
+    :param service_path: The service's directory.
     :param image_path: The docker image recipe path.
-    :return: A list of the files which were copied. (Absolute file names)
+    :return: The path of the Dockerfile.sh. None if there is none.
     """
-    files = os.listdir(path=image_path)
-    copied_files = []
-    for file in files:
-        if os.path.exists(file):
-            print(' - Did not copy "' + file + '" because a file of the same name already exists')
-        else:
-            print(' - "' + file + '"')
-            copied_files.append(file)
-            shutil.copy(os.path.join(image_path, file), file)
-    return copied_files
+    for path in [os.path.join(service_path, DOCKERFILE_SH), os.path.join(image_path, DOCKERFILE_SH)]:
+        if os.path.exists(path):
+            return path
+    return None
 
 
-def __cleanup(copied_files):
+def __execute_dockerfile_sh(dockerfile_sh, service_path, image_path):
     """
-    Clean up any copied files.
-    :param copied_files: A list of copied files to be deleted.
-    :return: Nothing.
+    Executes a Dockerfile.sh in the service's directory.
+    The recipe's path is passed in the AUTOCOMPOSE_IMAGE_PATH variable.
+    :param dockerfile_sh: The path of the Dockerfile.sh.
+    :param service_path: The service's directory.
+    :param image_path: The docker image recipe path.
+    :return: None
+    """
+    try:
+        subprocess.call(['bash', os.path.abspath(dockerfile_sh)], cwd=service_path,
+                        env=dict(os.environ, AUTOCOMPOSE_IMAGE_PATH=os.path.abspath(image_path)))
+    except BaseException as e:
+        print(e)
+        raise Exception('An error occurred while executing Dockerfile.sh')
+
+
+def __get_dockerignore_patterns(service_path, image_path):
+    """
+    Gets the .dockerignore patterns of the build context: the current directory's, or else the recipe's.
+    :param service_path: The service's (current) directory.
+    :param image_path: The docker image recipe path.
+    :return: A list of patterns.
+    """
+    for directory in [service_path, image_path]:
+        if directory is None:
+            continue
+        dockerignore = os.path.join(directory, '.dockerignore')
+        if os.path.exists(dockerignore):
+            with open(dockerignore, 'r') as file:
+                return [line.strip() for line in file if line.strip() and not line.startswith('#')]
+    return []
+
+
+def __create_build_context(service_path, image_path):
+    """
+    Assembles a build context from the service's directory, overlaid on the docker image recipe.
+    Files in the service's directory take precedence over the recipe's files of the same name, and files matching
+    the .dockerignore patterns are left out. Neither directory is modified.
+    Entries are added in sorted order with fixed timestamps and owners, so the same files always produce the same
+    context, and the same digest.
+    :param service_path: The service's (current) directory. None to use the recipe alone.
+    :param image_path: The docker image recipe path.
+    :return: A tuple of (the build context as a tar file, the SHA-256 digest of the build context).
+    """
+    patterns = __get_dockerignore_patterns(service_path, image_path)
+    files = {}
+    for root in [image_path, service_path]:
+        if root is None:
+            continue
+        for path in exclude_paths(os.path.abspath(root), patterns):
+            files[path.replace(os.path.sep, '/')] = os.path.join(root, path)
+
+    context = tempfile.TemporaryFile()
+    writer = HashingWriter(context)
+    with tarfile.open(fileobj=writer, mode='w') as tar:
+        for name in sorted(files):
+            info = tar.gettarinfo(files[name], arcname=name)
+            info.mtime = 0
+            info.uid = info.gid = 0
+            info.uname = info.gname = ''
+            if info.isfile():
+                with open(files[name], 'rb') as file:
+                    tar.addfile(info, file)
+            else:
+                tar.addfile(info)
+    context.seek(0)
+    return context, writer.hexdigest()
+
+
+def __build_or_reuse_image(aws_session, docker_client, context, fingerprint, service_name, repo_tag,
+                           build_args=None, force=False, cache_tag=None, output=True):
+    """
+    Builds an image, labelled with its fingerprint, unless an image with the same fingerprint exists locally or in the
+    service's ECR repository, in which case that image is (pulled and) tagged instead.
+    With a cache tag, that tag of the service's ECR repository is pulled and used as a layer cache, and then updated
+    with the newly built image. Failing to pull or push the cache tag does not fail the build.
+    :param aws_session: The AWS session.
+    :param docker_client: The docker client.
+    :param context: The build context, as a tar file.
+    :param fingerprint: The fingerprint of the build, see get_build_fingerprint.
+    :param service_name: The name of the service, which is also the name of its ECR repository.
+    :param repo_tag: The tag to give the image, as "repository:tag".
+    :param build_args: A dictionary of build-time variables.
+    :param force: If True, always build.
+    :param cache_tag: The tag of the service's ECR repository to use as a layer cache. None to use no cache.
+    :param output: If False, the build output is only printed if the build fails.
+    :return: How the image was obtained, e.g. 'built'.
+    """
+    repository, _, tag = repo_tag.rpartition(':')
+    if not force:
+        images = docker_client.images(filters={'label': AUTOCOMPOSE_FINGERPRINT_LABEL + '=' + fingerprint})
+        if len(images) > 0:
+            docker_client.tag(image=images[0]['Id'], repository=repository, tag=tag)
+            return 'reused'
+
+        ecr_tag = __find_ecr_image(aws_session, service_name, [tag, cache_tag or 'latest'], fingerprint)
+        if ecr_tag is not None:
+            __drain_docker_output(docker_client.pull(ecr_tag, stream=True), output)
+            docker_client.tag(image=ecr_tag, repository=repository, tag=tag)
+            return 'pulled from ECR'
+
+    cache_from = None
+    if cache_tag is not None:
+        cache_repository = get_docker_repository_name(aws_session, service_name)
+        cache_from = [cache_repository + ':' + cache_tag]
+        try:
+            __drain_docker_output(docker_client.pull(cache_from[0], stream=True), False, cache_from[0])
+        except BaseException as e:
+            print('Building "' + repo_tag + '" without a layer cache, "' + cache_from[0] + '" could not be pulled: ' +
+                  str(e))
+
+    __build_docker_image(docker_client, context, tag=repo_tag, output=output, buildargs=build_args,
+                         labels={AUTOCOMPOSE_FINGERPRINT_LABEL: fingerprint}, cache_from=cache_from)
+
+    if cache_tag is not None:
+        try:
+            docker_client.tag(image=repo_tag, repository=cache_repository, tag=cache_tag)
+            __drain_docker_output(docker_client.push(repository=cache_repository, tag=cache_tag, stream=True), False,
+                                  cache_from[0])
+        except BaseException as e:
+            print('The layer cache "' + cache_from[0] + '" could not be updated: ' + str(e))
+    return 'built'
+
+
+def __find_ecr_image(aws_session, service_name, tags, fingerprint):
+    """
+    Looks for an image with the given fingerprint among some tags of a service's ECR repository.
+    The fingerprint label is read from the image config, which is downloaded from ECR without pulling the image.
+    :param aws_session: The AWS session.
+    :param service_name: The name of the service, which is also the name of its ECR repository.
+    :param tags: The tags to look at.
+    :param fingerprint: The fingerprint of the build.
+    :return: The matching image, as "registry/repository:tag". None if there is none.
     """
-    for file in copied_files:
-        print(' - "' + file + '"')
-        os.remove(file)
+    try:
+        registry = get_authorization_data(aws_session)['proxyEndpoint'].replace('https://', '')
+        registry_id = registry.split('.')[0]
+        ecr_client = aws_session.client('ecr')
+        response = ecr_client.batch_get_image(registryId=registry_id, repositoryName=service_name,
+                                              imageIds=[{'imageTag': tag} for tag in unique(tags)],
+                                              acceptedMediaTypes=[__docker_manifest_media_type])
+        for image in response.get('images', []):
+            config_digest = (json.loads(image['imageManifest']).get('config') or {}).get('digest')
+            if config_digest is None:
+                continue
+            url = ecr_client.get_download_url_for_layer(registryId=registry_id, repositoryName=service_name,
+                                                        layerDigest=config_digest)['downloadUrl']
+            with urlopen(url) as config_file:
+                config = json.loads(config_file.read().decode('utf-8'))
+            labels = (config.get('config') or {}).get('Labels') or {}
+            if labels.get(AUTOCOMPOSE_FINGERPRINT_LABEL) == fingerprint:
+                return registry + '/' + service_name + ':' + image['imageId']['imageTag']
+    except BaseException as e:
+        print('Could not look for an unchanged image of "' + service_name + '" in ECR: ' + str(e))
+    return None
 
 
-def __build_docker_image(docker_client, path, tag):
+def __build_docker_image(docker_client, context, tag, output=True, buildargs=None, labels=None, cache_from=None):
     """
-    Calls 'docker build' with the given path and tag.
+    Calls 'docker build' with the given build context and tag.
     :param docker_client: The docker client.
-    :param path: The path to build.
+    :param context: The build context, as a tar file.
     :param tag: The tag to give the built docker image.
+    :param output: If False, the build output is only printed if the build fails.
+    :param buildargs: A dictionary of build-time variables.
+    :param labels: A dictionary of labels to give the built docker image.
+    :param cache_from: A list of images to use as a layer cache.
     :return: Nothing.
     """
-    print_docker_output(docker_client.build(path=path, tag=tag, stream=True))
+    __drain_docker_output(docker_client.build(fileobj=context, custom_context=True, tag=tag, stream=True,
+                                              buildargs=buildargs, labels=labels, cache_from=cache_from), output, tag)
 
 
-def __fail(copied_files):
+def __drain_docker_output(stream, output=True, name=None):
     """
-    Prints a fail message and calls cleanup.
-    :param copied_files:
-    :return:
+    Reads a docker output stream until it ends.
+    :param stream: The docker output stream.
+    :param output: If False, the output is only printed if it ends with an error.
+    :param name: What the output is about, e.g. the tag being built.
+    :return: Nothing.
     """
-    print('An error has occurred.')
-    print('Cleaning up copied files...')
-    __cleanup(copied_files)
+    if output:
+        print_docker_output(stream)
+        return
+
+    log = []
+    for event in json_stream(stream):
+        if 'error' in event:
+            print('Output of "docker" for "' + (name or '') + '":\n' + ''.join(log) + event['error'])
+            raise Exception(event['error'].strip())
+        log.append(event.get('stream', '') or event.get('status', '') + '\n')
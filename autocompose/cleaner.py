@@ -1,57 +1,390 @@
-import docker
+import shutil
+import time
+
 from docker import errors
 
+from .authenticator import get_authorization_data
+from .constants import *
+from .engine import run_on_engine
+from .util import format_bytes, parse_duration, parse_size, print_table
+
+# Networks which Docker creates itself, and which cannot be removed.
+__default_networks = ['bridge', 'host', 'none']
+
+# The tag Docker lists for untagged images.
+__untagged = '<none>:<none>'
 
-def clean_containers(docker_client, **kwargs):
+
+def clean_containers(docker_client, jobs=DEFAULT_JOBS, older_than=None, label=None, dry_run=False, **kwargs):
     """
-    Removes all containers from the local machine.
+    Removes all containers from the local machine, or only those matching the given filters.
     :param docker_client: The Docker client
+    :param jobs: The number of containers to remove concurrently.
+    :param older_than: Only remove containers created longer ago than this duration, e.g. '7d'.
+    :param label: Only remove containers with all of these labels, given as 'key' or 'key=value'.
+    :param dry_run: If True, only print the containers which would be removed.
     :return: None.
     """
 
-    images = docker_client.containers(all=True)
-    print('Killing and removing all Docker containers...')
-    for image in images:
-        try:
-            docker_client.remove_container(image, force=True)
-        except docker.errors.NotFound:
-            pass
+    containers = [container for container in docker_client.containers(all=True, size=dry_run)
+                  if __matches(container, older_than, label)]
+
+    if dry_run:
+        __print_dry_run('containers', [(container['Id'][:12] + ' ' + ','.join(container.get('Names') or []),
+                                        container.get('SizeRw') or 0) for container in containers])
+        return
+
+    print('Killing and removing ' + ('all' if older_than is None and label is None else 'matching') +
+          ' Docker containers...')
+    failures = __run_concurrently(lambda engine, container: engine.remove_container(container['Id'], force=True),
+                                  containers, jobs)
+    for container, error in failures:
+        print('Could not remove container "' + container['Id'] + '": ' + str(error))
+    print('Removed ' + str(len(containers) - len(failures)) + ' containers.')
     print('Done.')
 
 
-def clean_images(docker_client, **kwargs):
+def clean_images(docker_client, aws_session=None, jobs=DEFAULT_JOBS, older_than=None, label=None,
+                 registry_prefix=None, exclude_registry_prefix=None, exclude_ecr=False, dangling=False,
+                 keep_recent=None, free_until=None, dry_run=False, **kwargs):
     """
-    Removes all docker images from the local machine.
+    Removes all docker images from the local machine, or only those matching the given filters.
+    Images are removed in waves, children before their parents, so every removal can succeed the first time.
+    Images used by running containers, and their parents, are kept.
     :param docker_client: The Docker client
+    :param aws_session: The AWS session. Only needed with exclude_ecr.
+    :param jobs: The number of images to remove concurrently.
+    :param older_than: Only remove images created longer ago than this duration, e.g. '7d'.
+    :param label: Only remove images with all of these labels, given as 'key' or 'key=value'.
+    :param registry_prefix: Only remove tags starting with one of these prefixes. Images which keep other tags are
+                            only untagged.
+    :param exclude_registry_prefix: Keep images with a tag starting with one of these prefixes.
+    :param exclude_ecr: Keep images tagged for the ECR registry.
+    :param dangling: Only remove untagged images which no other image is built on.
+    :param keep_recent: Keep this many of the most recently created images of every repository. Images which are
+                        only recent in some of their repositories are untagged from the others.
+    :param free_until: Only remove images (oldest first) until this much disk space is available, e.g. '20GB'.
+                       Nothing is untagged, since untagging frees no disk space.
+    :param dry_run: If True, only print the images which would be removed.
     :return: None.
     """
 
-    print('Removing all Docker images...')
-    empty = False
-    while not empty:
-        empty = True
-        for image in docker_client.images(all=True):
-            try:
-                docker_client.remove_image(image, force=True)
-            except docker.errors.NotFound:
-                pass
-            except docker.errors.APIError:
-                print('Could not remove image "' + image['Id'] + '"')
+    all_images = docker_client.images(all=True)
+    images = __get_image_graph(all_images)
+    in_use = __get_images_in_use(images, docker_client.containers(all=True))
+
+    excluded_prefixes = list(exclude_registry_prefix or [])
+    if exclude_ecr:
+        excluded_prefixes.append(get_authorization_data(aws_session)['proxyEndpoint'].replace('https://', '') + '/')
+
+    candidates = [image for image in all_images
+                  if image['Id'] not in in_use and __matches(image, older_than, label) and
+                  __matches_registry(image, registry_prefix, excluded_prefixes) and
+                  (not dangling or __is_dangling(image, images))]
+    untags, candidates = __split_removals(candidates, all_images, registry_prefix, keep_recent)
+    if free_until is not None:
+        # Untagging frees no disk space.
+        untags = []
+        candidates = __select_until_free(docker_client, candidates, images, parse_size(free_until))
+
+    if dry_run:
+        removable, _, skipped = __remove_images(docker_client, images, set(image['Id'] for image in candidates),
+                                                jobs, dry_run=True)
+        tags = {image['Id']: ','.join(tag for tag in image.get('RepoTags') or [] if tag != __untagged)
+                for image in all_images}
+        __print_dry_run('images', [(image_id[:19] + ' ' + tags[image_id], images[image_id]['size'])
+                                   for image_id in removable], untags,
+                        [image_id[:19] + ' ' + tags[image_id] for image_id in skipped])
+        return
+
+    print('Removing ' + str(len(candidates)) + ' Docker images...')
+    if len(in_use) > 0:
+        print('Keeping ' + str(len(in_use)) + ' images used by running containers.')
+
+    if len(untags) > 0:
+        print('Untagging ' + str(len(untags)) + ' tags of images which keep other tags...')
+        for tag, error in __run_concurrently(lambda engine, tag: engine.remove_image(tag), untags, jobs):
+            print('Could not untag "' + tag + '": ' + str(error))
+
+    removed, failed, skipped = __remove_images(docker_client, images, set(image['Id'] for image in candidates), jobs)
+
+    for image_id, error in failed:
+        print('Could not remove image "' + image_id + '": ' + str(error))
+    for image_id in skipped:
+        print('Skipped image "' + image_id + '": images which are kept are built on it.')
+    print('Removed ' + str(len(removed)) + ' images, reclaiming ' +
+          format_bytes(sum(images[image_id]['size'] for image_id in removed)) + '.')
     print('Done.')
 
 
-def clean_networks(docker_client, **kwargs):
+def clean_networks(docker_client, jobs=DEFAULT_JOBS, label=None, dry_run=False, **kwargs):
     """
-    Remove all docker networks from the local machine.
+    Remove all docker networks from the local machine, or only those matching the given filters.
     :param docker_client: The Docker client
+    :param jobs: The number of networks to remove concurrently.
+    :param label: Only remove networks with all of these labels, given as 'key' or 'key=value'.
+    :param dry_run: If True, only print the networks which would be removed.
     :return:
     """
 
+    networks = [network for network in docker_client.networks()
+                if network['Name'] not in __default_networks and __matches(network, None, label)]
+
+    if dry_run:
+        __print_dry_run('networks', [(network['Id'][:12] + ' ' + network['Name'], 0) for network in networks])
+        return
+
     print('Removing all non-default Docker networks...')
-    for network in docker_client.networks():
-        if network['Name'] not in ['bridge', 'host', 'none']:
-            try:
-                docker_client.remove_network(net_id=network['Id'])
-            except docker.errors.APIError:
-                print('Could not remove network "' + network['Name'] + '"')
+    failures = __run_concurrently(lambda engine, network: engine.remove_network(network['Id']), networks, jobs)
+    for network, error in failures:
+        print('Could not remove network "' + network['Name'] + '"')
     print('Done.')
+
+
+def __matches(resource, older_than, labels):
+    """
+    Checks whether a container, image or network matches the age and label filters.
+    :param resource: The container, image or network, as listed by the Docker client.
+    :param older_than: A duration, e.g. '7d'. None matches any age.
+    :param labels: A list of labels, given as 'key' or 'key=value'. None matches any labels.
+    :return: True if the resource matches.
+    """
+    if older_than is not None and resource.get('Created', 0) > time.time() - parse_duration(older_than):
+        return False
+    resource_labels = resource.get('Labels') or {}
+    for label in labels or []:
+        key, has_value, value = label.partition('=')
+        if key not in resource_labels or has_value and resource_labels[key] != value:
+            return False
+    return True
+
+
+def __matches_registry(image, prefixes, excluded_prefixes):
+    """
+    Checks whether an image matches the registry prefix filters.
+    :param image: The image, as listed by the Docker client.
+    :param prefixes: A list of prefixes, one of which a tag of the image must start with. None matches any image.
+    :param excluded_prefixes: A list of prefixes no tag of the image may start with.
+    :return: True if the image matches.
+    """
+    tags = image.get('RepoTags') or []
+    if prefixes and not any(tag.startswith(prefix) for tag in tags for prefix in prefixes):
+        return False
+    return not any(tag.startswith(prefix) for tag in tags for prefix in excluded_prefixes)
+
+
+def __is_dangling(image, images):
+    """
+    Checks whether an image is dangling: untagged, with no other image built on it.
+    :param image: The image, as listed by the Docker client.
+    :param images: The image graph.
+    :return: True if the image is dangling.
+    """
+    tags = [tag for tag in image.get('RepoTags') or [] if tag != __untagged]
+    return len(tags) == 0 and len(images[image['Id']]['children']) == 0
+
+
+def __split_removals(candidates, all_images, prefixes, keep_recent):
+    """
+    Works out which tags of the candidates for removal to remove. A tag is removed if it starts with one of the
+    prefixes, and its image is not one of the most recently created images of its repository.
+    A candidate whose tags are all removed is removed entirely. Otherwise only the removed tags are untagged, and the
+    image is kept for its other tags.
+    :param candidates: The images which may be removed.
+    :param all_images: All images, as listed by the Docker client.
+    :param prefixes: A list of prefixes. None matches any tag.
+    :param keep_recent: The number of images to keep per repository. None keeps none.
+    :return: A tuple of (a list of tags to untag, a list of the images to remove).
+    """
+    recent_tags = __get_recent_tags(all_images, keep_recent)
+    untags = []
+    removals = []
+    for image in candidates:
+        tags = [tag for tag in image.get('RepoTags') or [] if tag != __untagged]
+        removed_tags = [tag for tag in tags if tag not in recent_tags and
+                        (not prefixes or any(tag.startswith(prefix) for prefix in prefixes))]
+        if len(removed_tags) == len(tags):
+            removals.append(image)
+        else:
+            untags.extend(removed_tags)
+    return untags, removals
+
+
+def __get_recent_tags(all_images, keep_recent):
+    """
+    Gets the tags of the most recently created images of every repository.
+    :param all_images: All images, as listed by the Docker client.
+    :param keep_recent: The number of images to keep per repository. None keeps none.
+    :return: A set of tags.
+    """
+    if keep_recent is None:
+        return set()
+
+    repositories = {}
+    for image in all_images:
+        for tag in image.get('RepoTags') or []:
+            if tag != __untagged:
+                repositories.setdefault(tag.rpartition(':')[0], {}).setdefault(image['Id'], (image, []))[1].append(tag)
+
+    recent_tags = set()
+    for repository_images in repositories.values():
+        by_age = sorted(repository_images.values(), key=lambda entry: entry[0].get('Created', 0), reverse=True)
+        for _, tags in by_age[:keep_recent]:
+            recent_tags.update(tags)
+    return recent_tags
+
+
+def __select_until_free(docker_client, candidates, images, target):
+    """
+    Selects the oldest candidates until removing them would leave at least the target amount of disk space available
+    to Docker. Only candidates which would actually be removed count, not those kept for a child which is kept.
+    Image sizes are estimates, since images can share layers.
+    :param docker_client: The Docker client
+    :param candidates: The images which may be removed.
+    :param images: The image graph.
+    :param target: The number of bytes which should be available.
+    :return: The selected candidates.
+    """
+    root_directory = docker_client.info().get('DockerRootDir', '/')
+    try:
+        available = shutil.disk_usage(root_directory).free
+    except OSError:
+        raise Exception('Cannot measure the disk space available to Docker at "' + root_directory + '".')
+
+    selected = []
+    selected_ids = set()
+    removable_ids = set()
+    for image in sorted(candidates, key=lambda image: image.get('Created', 0)):
+        if available >= target:
+            break
+        selected.append(image)
+        selected_ids.add(image['Id'])
+
+        # Images are only removed once all their children are, see __remove_images, so an image frees space when its
+        # last child is removed, which may in turn free its parent.
+        image_id = image['Id']
+        while image_id in selected_ids and image_id not in removable_ids and \
+                images[image_id]['children'].issubset(removable_ids):
+            removable_ids.add(image_id)
+            available += images[image_id]['size']
+            image_id = images[image_id]['parent']
+    return selected
+
+
+def __print_dry_run(kind, removals, untags=(), skipped=()):
+    """
+    Prints what would be removed, and how many bytes each removal would reclaim.
+    :param kind: What is removed, e.g. 'images'.
+    :param removals: A list of (description, bytes) tuples.
+    :param untags: A list of the tags which would be untagged from images which are kept.
+    :param skipped: A list of the descriptions of candidates which would be skipped, since kept images are built on
+                    them.
+    :return: None
+    """
+    rows = [(kind.upper(), 'RECLAIMED')]
+    rows.extend((description, format_bytes(size)) for description, size in removals)
+    rows.extend(('untag ' + tag, '-') for tag in untags)
+    rows.extend(('skip ' + description, '-') for description in skipped)
+    print_table(rows)
+    print('Would remove ' + str(len(removals)) + ' ' + kind + ', reclaiming ' +
+          format_bytes(sum(size for _, size in removals)) + '.')
+    if len(untags) > 0:
+        print('Would untag ' + str(len(untags)) + ' tags of ' + kind + ' which keep other tags.')
+    if len(skipped) > 0:
+        print('Would skip ' + str(len(skipped)) + ' ' + kind + ' which kept ' + kind + ' are built on.')
+
+
+def __get_image_graph(images):
+    """
+    Builds the parent/child graph of images.
+    :param images: The images, as returned by docker_client.images(all=True).
+    :return: A dictionary of image ids to dictionaries with the image's 'parent' id, the ids of its 'children',
+             and its own 'size' (excluding its parent's size).
+    """
+    graph = {image['Id']: {'parent': image.get('ParentId') or None, 'children': set(), 'size': image.get('Size', 0)}
+             for image in images}
+    for image_id, node in graph.items():
+        if node['parent'] in graph:
+            graph[node['parent']]['children'].add(image_id)
+
+    # An image's size includes its parents' layers
+    sizes = {image['Id']: image.get('Size', 0) for image in images}
+    for node in graph.values():
+        if node['parent'] in sizes:
+            node['size'] = max(0, node['size'] - sizes[node['parent']])
+    return graph
+
+
+def __get_images_in_use(images, containers):
+    """
+    Gets the images which cannot be removed because running containers use them: their images and the parents of
+    those images.
+    :param images: The image graph.
+    :param containers: The containers, as returned by docker_client.containers(all=True).
+    :return: A set of image ids.
+    """
+    in_use = set()
+    for container in containers:
+        if container.get('State') != 'running':
+            continue
+        image_id = container.get('ImageID')
+        while image_id in images and image_id not in in_use:
+            in_use.add(image_id)
+            image_id = images[image_id]['parent']
+    return in_use
+
+
+def __remove_images(docker_client, images, image_ids, jobs, dry_run=False):
+    """
+    Removes images in waves. Each wave concurrently removes the images none of whose children are left.
+    Images which fail to be removed are not retried, and keep their parents, so the removal always ends. Images which
+    kept images are built on are skipped.
+    :param docker_client: The Docker client
+    :param images: The image graph.
+    :param image_ids: The ids of the images to remove.
+    :param jobs: The number of images to remove concurrently.
+    :param dry_run: If True, nothing is removed, and every removal is assumed to succeed.
+    :return: A tuple of (a list of the ids of the removed images, a list of (image id, error) of failed images, a
+             list of the ids of the skipped images).
+    """
+    remaining = set(image_ids)
+    present = set(images)
+    removed = []
+    failed = []
+    while True:
+        wave = [image_id for image_id in remaining if images[image_id]['children'].isdisjoint(present)]
+        if len(wave) == 0:
+            break
+
+        if dry_run:
+            failures = []
+        else:
+            failures = __run_concurrently(lambda engine, image_id: engine.remove_image(image_id, force=True), wave,
+                                          jobs)
+        failed_ids = set(image_id for image_id, _ in failures)
+        for image_id in wave:
+            if image_id not in failed_ids:
+                removed.append(image_id)
+                present.discard(image_id)
+        failed.extend(failures)
+        remaining.difference_update(wave)
+    return removed, failed, sorted(remaining)
+
+
+def __run_concurrently(operation, items, jobs):
+    """
+    Runs an operation of the asyncio Docker Engine client with every item, up to the given number at a time.
+    Items which are not found (e.g. already removed) count as successes.
+    :param operation: A function taking the AsyncEngineClient and an item, and returning a coroutine.
+    :param items: The items.
+    :param jobs: The number of concurrent operations.
+    :return: A list of (item, error) tuples for the operations which failed.
+    """
+
+    async def call(engine, item):
+        try:
+            await operation(engine, item)
+        except errors.NotFound:
+            pass
+
+    return run_on_engine(call, items, jobs)
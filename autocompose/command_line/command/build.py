@@ -1,10 +1,31 @@
 import argparse
 
 from autocompose.builder import build
+from autocompose.constants import DEFAULT_BUILD_CACHE_TAG, DEFAULT_JOBS
 from .command import Command
 
 __parser = argparse.ArgumentParser(prog="autocompose build",
                                    description='Build a Docker image for the current directory.')
 __parser.add_argument('--image-name', default=None, help='Image name. Default is the current directory.')
-__parser.add_argument('--tag', default='latest', help='Tag to add to the image.')
+__parser.add_argument('--tag', default=None,
+                      help='Tag to add to the image. Default is latest, or the version of each service in the '
+                           'scenario.')
+__parser.add_argument('--scenario', default=None,
+                      help='Build the images of every service of this scenario instead of the current directory.')
+__parser.add_argument('--source-root', default='.',
+                      help='With --scenario, the directory containing a directory for every service. Services without '
+                           'a directory are built from their image recipe alone. Default is the current directory.')
+__parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                      help='With --scenario, the number of images to build concurrently.')
+__parser.add_argument('--build-arg', dest='build_args', action='append', default=[], metavar='KEY=VALUE',
+                      help='A build-time variable. Can be given several times.')
+__parser.add_argument('--force', action='store_true',
+                      help='Build even if an image built from the same recipe, sources and build args already exists '
+                           'locally or in ECR.')
+__parser.add_argument('--ecr-cache', action='store_true',
+                      help='Use the cache tag of the ECR repository as a layer cache, and update it after the build.')
+__parser.add_argument('--cache-tag', default=DEFAULT_BUILD_CACHE_TAG,
+                      help='The tag of each service\'s ECR repository which --ecr-cache pulls and pushes the layer '
+                           'cache as. Default is ' + DEFAULT_BUILD_CACHE_TAG + '. Do not use a tag which compose '
+                           'resolves, such as latest.')
 build_command = Command(__parser, build)
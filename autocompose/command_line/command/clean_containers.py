@@ -1,8 +1,18 @@
 import argparse
 
 from autocompose.cleaner import clean_containers
+from autocompose.constants import DEFAULT_JOBS
 from .command import Command
 
-__parser = argparse.ArgumentParser(prog="autocompose clean-containers", description='Remove all Docker containers.')
+__parser = argparse.ArgumentParser(prog="autocompose clean-containers",
+                                   description='Remove all Docker containers, or only those matching the filters.')
+__parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                      help='The number of containers to remove concurrently. Default is ' + str(DEFAULT_JOBS) + '.')
+__parser.add_argument('--older-than', default=None,
+                      help='Only remove containers created longer ago than this, e.g. "12h" or "7d".')
+__parser.add_argument('--label', action='append', default=None,
+                      help='Only remove containers with this label, given as "key" or "key=value". Repeatable.')
+__parser.add_argument('--dry-run', action='store_true',
+                      help='Print the containers which would be removed, and the disk space they use.')
 
 clean_containers_command = Command(__parser, clean_containers)
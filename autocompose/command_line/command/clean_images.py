@@ -1,8 +1,30 @@
 import argparse
 
 from autocompose.cleaner import clean_images
+from autocompose.constants import DEFAULT_JOBS
 from .command import Command
 
-__parser = argparse.ArgumentParser(prog="autocompose clean-images", description='Remove all Docker images.')
+__parser = argparse.ArgumentParser(prog="autocompose clean-images",
+                                   description='Remove all Docker images, or only those matching the filters.')
+__parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                      help='The number of images to remove concurrently. Default is ' + str(DEFAULT_JOBS) + '.')
+__parser.add_argument('--older-than', default=None,
+                      help='Only remove images created longer ago than this, e.g. "12h" or "7d".')
+__parser.add_argument('--label', action='append', default=None,
+                      help='Only remove images with this label, given as "key" or "key=value". Repeatable.')
+__parser.add_argument('--registry-prefix', action='append', default=None,
+                      help='Only remove tags starting with this prefix. Images which keep other tags are only '
+                           'untagged. Repeatable.')
+__parser.add_argument('--exclude-registry-prefix', action='append', default=None,
+                      help='Keep images with a tag starting with this prefix. Repeatable.')
+__parser.add_argument('--exclude-ecr', action='store_true', help='Keep images tagged for the ECR registry.')
+__parser.add_argument('--dangling', action='store_true',
+                      help='Only remove untagged images which no other image is built on.')
+__parser.add_argument('--keep-recent', type=int, default=None,
+                      help='Keep this many of the most recently created images of every repository.')
+__parser.add_argument('--free-until', default=None,
+                      help='Remove the oldest images only until this much disk space is available, e.g. "20GB".')
+__parser.add_argument('--dry-run', action='store_true',
+                      help='Print the images which would be removed, and the disk space each would reclaim.')
 
 clean_images_command = Command(__parser, clean_images)
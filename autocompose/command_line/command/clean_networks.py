@@ -1,8 +1,15 @@
 import argparse
 
 from autocompose.cleaner import clean_networks
+from autocompose.constants import DEFAULT_JOBS
 from .command import Command
 
-__parser = argparse.ArgumentParser(prog="autocompose clean-networks", description='Remove all Docker networks.')
+__parser = argparse.ArgumentParser(prog="autocompose clean-networks",
+                                   description='Remove all Docker networks, or only those matching the filters.')
+__parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                      help='The number of networks to remove concurrently. Default is ' + str(DEFAULT_JOBS) + '.')
+__parser.add_argument('--label', action='append', default=None,
+                      help='Only remove networks with this label, given as "key" or "key=value". Repeatable.')
+__parser.add_argument('--dry-run', action='store_true', help='Print the networks which would be removed.')
 
 clean_networks_command = Command(__parser, clean_networks)
@@ -0,0 +1,14 @@
+import argparse
+
+from autocompose.completer import complete
+from .command import Command
+
+__parser = argparse.ArgumentParser(prog="autocompose complete",
+                                   description='Print the shell completions of a partial autocompose command line.')
+__parser.add_argument(dest='line', nargs='?', default='',
+                      help='The command line up to the cursor, e.g. "autocompose compose my-s".')
+__parser.add_argument('--kind', default=None,
+                      help='Complete the line as a name of this kind instead: services, scenarios, templates, images '
+                           'or tags (as "service:tag").')
+
+complete_command = Command(__parser, complete)
@@ -1,9 +1,27 @@
 import argparse
 
 from autocompose.composer import print_compose_file
+from autocompose.constants import DEFAULT_JOBS
 from .command import Command
 
 __parser = argparse.ArgumentParser(prog="autocompose compose", description='Create a docker-compose.yml file.')
 __parser.add_argument(dest='scenarios', nargs='*', help='Scenarios and/or services.')
+__parser.add_argument('--no-cache', action='store_true',
+                      help='Do not use or update the cache of previously generated docker-compose files.')
+__parser.add_argument('--explain-cache', action='store_true',
+                      help='Print to stderr why a cached docker-compose file was or was not used.')
+__parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                      help='The number of services to load concurrently. Default is ' + str(DEFAULT_JOBS) + '.')
+__parser.add_argument('-o', '--output', default=None,
+                      help='Write the docker-compose file to this file instead of stdout. The file is replaced '
+                           'atomically, and only if its content changed.')
+__parser.add_argument('--format', dest='output_format', choices=['yaml', 'json'], default='yaml',
+                      help='The format of the docker-compose file. docker-compose parses JSON faster. Default is yaml.')
+__parser.add_argument('--watch', action='store_true',
+                      help='Keep the output file up to date, recomposing the services whose inputs change, until '
+                           'interrupted. Requires --output.')
+__parser.add_argument('--poll-interval', type=float, default=1.0,
+                      help='With --watch, the number of seconds between two checks of the inputs, if inotify is not '
+                           'available.')
 
 compose_command = Command(__parser, print_compose_file)
@@ -0,0 +1,16 @@
+import argparse
+
+from autocompose.constants import DEFAULT_JOBS
+from autocompose.updater import prefetch_images
+from .command import Command
+
+__parser = argparse.ArgumentParser(prog="autocompose prefetch",
+                                   description='Pull the images of the services of some scenarios concurrently, '
+                                               'skipping the images which are up to date.')
+__parser.add_argument(dest='scenarios', nargs='+', help='Scenarios and/or services.')
+__parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                      help='The number of images to pull concurrently. Default is ' + str(DEFAULT_JOBS) + '.')
+__parser.add_argument('--limit-rate', default=None,
+                      help='Only start new pulls while the images download slower than this per second, e.g. "20MB".')
+
+prefetch_command = Command(__parser, prefetch_images)
@@ -1,10 +1,17 @@
 import argparse
 
-from autocompose.pusher import push_to_ecs
+from autocompose.constants import DEFAULT_JOBS
+from autocompose.pusher import push_images
 from .command import Command
 
-__parser = argparse.ArgumentParser(prog="autocompose push", description='Push a Docker image to ECR.')
+__parser = argparse.ArgumentParser(prog="autocompose push", description='Push Docker images to ECR.')
+__parser.add_argument(dest='images', nargs='*',
+                      help='Images to push, as "name" or "name:tag". Default is the image of the current directory.')
+__parser.add_argument('--scenario', default=None,
+                      help='Push the images of every service of a scenario, with the versions given in the scenario.')
 __parser.add_argument('--image-name', default=None, help='Image name. Default is the current directory.')
-__parser.add_argument('--tag', default='latest', help='Tag to add to the image.')
+__parser.add_argument('--tag', default=None, help='Tag to add to the image. Default is latest.')
+__parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                      help='The number of images to push concurrently. Default is ' + str(DEFAULT_JOBS) + '.')
 
-push_command = Command(__parser, push_to_ecs)
+push_command = Command(__parser, push_images)
@@ -0,0 +1,14 @@
+import argparse
+
+from autocompose.daemon import serve
+from .command import Command
+
+__parser = argparse.ArgumentParser(prog="autocompose serve",
+                                   description='Run the autocompose daemon, which keeps the AUTOCOMPOSE_PATH, the ECR '
+                                               'login and the Docker client loaded, and runs complete, compose and '
+                                               'path commands for the command line. Set AUTOCOMPOSE_NO_DAEMON to '
+                                               'bypass it.')
+__parser.add_argument('--poll-interval', type=float, default=1.0,
+                      help='The number of seconds between two checks of the AUTOCOMPOSE_PATH for changes.')
+
+serve_command = Command(__parser, serve)
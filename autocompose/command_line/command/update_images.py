@@ -1,8 +1,12 @@
 import argparse
 
+from autocompose.constants import DEFAULT_JOBS
 from autocompose.updater import update_images
 from .command import Command
 
-__parser = argparse.ArgumentParser(prog="autocompose update-images", description='Update images.')
+__parser = argparse.ArgumentParser(prog="autocompose update-images",
+                                   description='Update ECR images whose digest in ECR has changed.')
+__parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                      help='The number of images to pull concurrently. Default is ' + str(DEFAULT_JOBS) + '.')
 
 update_images_command = Command(__parser, update_images)
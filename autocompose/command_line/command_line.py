@@ -1,33 +1,30 @@
 #!/usr/bin/env python3
 
 import argparse
+import importlib
 import os
 import sys
 
-import boto3
-import docker
-
-from .command.build import build_command
-from .command.clean_containers import clean_containers_command
-from .command.clean_images import clean_images_command
-from .command.clean_networks import clean_networks_command
-from .command.compose import compose_command
-from .command.login import login_command
-from .command.path import path_command
-from .command.push import push_command
-from .command.update_images import update_images_command
+from .lazy import LazyAwsSession, LazyDockerClient
+from ..daemon import execute_in_daemon
+from ..tracing import enable_tracing, print_timings, span, write_metrics, write_trace
 from ..util import set_service_name
 
+# The module in autocompose.command_line.command defining each command, as "<module>_command".
+# Command modules are only imported when their command runs, since some of them import boto3 and docker.
 commands = {
-    'build': build_command,
-    'clean-containers': clean_containers_command,
-    'clean-images': clean_images_command,
-    'clean-networks': clean_networks_command,
-    'compose': compose_command,
-    'login': login_command,
-    'path': path_command,
-    'push': push_command,
-    'update-images': update_images_command
+    'build': 'build',
+    'clean-containers': 'clean_containers',
+    'clean-images': 'clean_images',
+    'clean-networks': 'clean_networks',
+    'complete': 'complete',
+    'compose': 'compose',
+    'login': 'login',
+    'path': 'path',
+    'prefetch': 'prefetch',
+    'push': 'push',
+    'serve': 'serve',
+    'update-images': 'update_images'
 }
 
 parser = argparse.ArgumentParser(description='Dynamically create docker-compose files.')
@@ -41,9 +38,46 @@ parser.add_argument('--aws-secret-access-key', help='The AWS secret key.')
 parser.add_argument('--aws-session-token', help='The AWS session token.')
 parser.add_argument('--aws-profile', help='The AWS profile.')
 parser.add_argument('--region', default='us-east-1', help='The AWS region.')
+parser.add_argument('--timings', action='store_true',
+                    help='Print to stderr how long each stage of the command took (e.g. reading YAML files, merging, '
+                         'ECR and Docker API calls), and counters such as the number of files read.')
+parser.add_argument('--trace', default=None, metavar='FILE',
+                    help='Write the stages of the command to a file in the Chrome trace event format, which '
+                         'chrome://tracing and https://ui.perfetto.dev can open.')
+parser.add_argument('--metrics-file', default=os.environ.get('AUTOCOMPOSE_METRICS_FILE'), metavar='FILE',
+                    help='Write the stage timings and counters to a file in the Prometheus text format, e.g. for the '
+                         'node exporter\'s textfile collector. Defaults to $AUTOCOMPOSE_METRICS_FILE. Like --timings '
+                         'and --trace, this runs the command in this process rather than in the daemon (see '
+                         '\'autocompose serve\'), so setting the variable stops the daemon from being used.')
 parser.add_argument(dest='ARGUMENTS', nargs=argparse.REMAINDER)
 
 
+def get_command(command):
+    """
+    Imports the module of a command.
+    :param command: The name of the command, e.g. 'update-images'.
+    :return: The Command.
+    """
+    module_name = commands[command]
+    module = importlib.import_module('.command.' + module_name, __package__)
+    return getattr(module, module_name + '_command')
+
+
+def execute(command, arguments, aws_session, docker_client):
+    """
+    Runs a command, printing any error.
+    :param command: The name of the command.
+    :param arguments: The arguments of the command.
+    :param aws_session: The AWS session.
+    :param docker_client: The Docker client.
+    :return: None
+    """
+    try:
+        get_command(command).parse_and_execute(args=arguments, aws_session=aws_session, docker_client=docker_client)
+    except Exception as e:
+        print("Unexpected error:", sys.exc_info()[1])
+
+
 def __setup_config_directory():
     # Check that the user config folder exists.
     user_config_directory = os.path.join(os.environ['HOME'], '.autocompose')
@@ -60,11 +94,11 @@ def __setup_config_directory():
 
 
 def __require_python_version():
-    req_version = (3, 4)
+    req_version = (3, 5)
     cur_version = sys.version_info
 
     if cur_version < req_version:
-        print("Your Python interpreter is too old. Autocompose requires Python 3.4 or higher.")
+        print("Your Python interpreter is too old. Autocompose requires Python 3.5 or higher.")
         exit(1)
 
 
@@ -85,18 +119,37 @@ def main():
         set_service_name(args.service_name)
         print('service-name set to ' + args.service_name)
 
-    aws_session = boto3.Session(aws_access_key_id=args.aws_access_key_id,
-                                aws_secret_access_key=args.aws_secret_access_key,
-                                aws_session_token=args.aws_session_token,
-                                region_name=args.region,
-                                profile_name=args.aws_profile)
-
-    docker_client = docker.APIClient()
-
+    # The AWS session and the Docker client are only created when a command first uses them.
+    aws_session = LazyAwsSession(aws_access_key_id=args.aws_access_key_id,
+                                 aws_secret_access_key=args.aws_secret_access_key,
+                                 aws_session_token=args.aws_session_token,
+                                 region_name=args.region,
+                                 profile_name=args.aws_profile)
+
+    # Let the daemon run the command, if it is running. See 'autocompose serve'.
+    # Commands are traced in this process, since the daemon's work could not be told apart from other clients'. This
+    # includes a metrics file set by $AUTOCOMPOSE_METRICS_FILE.
+    tracing = args.timings or args.trace is not None or args.metrics_file is not None
+    if not tracing:
+        status = execute_in_daemon(command, args.ARGUMENTS, args.service_name, aws_session.get_arguments())
+        if status is not None:
+            exit(status)
+    else:
+        enable_tracing()
+
+    docker_client = LazyDockerClient()
+
+    # Write what was recorded even if the command exits early, e.g. on invalid arguments.
     try:
-        commands[command].parse_and_execute(args=args.ARGUMENTS, aws_session=aws_session, docker_client=docker_client)
-    except Exception as e:
-        print("Unexpected error:", sys.exc_info()[1])
+        with span(command, 'command'):
+            execute(command, args.ARGUMENTS, aws_session, docker_client)
+    finally:
+        if args.timings:
+            print_timings()
+        if args.trace is not None:
+            write_trace(args.trace)
+        if args.metrics_file is not None:
+            write_metrics(args.metrics_file, command)
 
 
 if __name__ == "__main__":
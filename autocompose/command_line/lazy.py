@@ -0,0 +1,128 @@
+import configparser
+import os
+import threading
+
+from ..tracing import TracedClient, is_tracing_enabled
+
+
+class LazyAwsSession(object):
+    """
+    An AWS session which only imports boto3 and creates the underlying boto3.Session when it is first used.
+    The profile, the region and the access key are worked out without boto3 where possible, so that commands which
+    only need them (e.g. to find cached ECR authorization data) start quickly.
+    """
+
+    def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None, region_name=None,
+                 profile_name=None):
+        self.__arguments = {
+            'aws_access_key_id': aws_access_key_id,
+            'aws_secret_access_key': aws_secret_access_key,
+            'aws_session_token': aws_session_token,
+            'region_name': region_name,
+            'profile_name': profile_name
+        }
+        self.__session = None
+        self.__lock = threading.Lock()
+
+    def get_arguments(self):
+        """
+        Gets the arguments the session was created with.
+        :return: A dictionary of the arguments of boto3.Session.
+        """
+        return dict(self.__arguments)
+
+    @property
+    def profile_name(self):
+        if self.__session is not None:
+            return self.__session.profile_name
+        return self.__arguments['profile_name'] or os.environ.get('AWS_PROFILE') or \
+            os.environ.get('AWS_DEFAULT_PROFILE') or 'default'
+
+    @property
+    def region_name(self):
+        if self.__session is not None or self.__arguments['region_name'] is None:
+            return self.get_session().region_name
+        return self.__arguments['region_name']
+
+    def get_access_key(self):
+        """
+        Gets the access key of the session's credentials.
+        Explicit access keys and access keys in the shared credentials file are read without creating the session.
+        :return: The access key. None if there are no credentials.
+        """
+        if self.__session is None:
+            if self.__arguments['aws_access_key_id'] is not None:
+                return self.__arguments['aws_access_key_id']
+            if self.__arguments['profile_name'] is None and 'AWS_ACCESS_KEY_ID' in os.environ:
+                return os.environ['AWS_ACCESS_KEY_ID']
+            access_key = self.__read_shared_credentials_access_key()
+            if access_key is not None:
+                return access_key
+
+        credentials = self.get_credentials()
+        return None if credentials is None else credentials.access_key
+
+    def __read_shared_credentials_access_key(self):
+        """
+        Reads the access key of the session's profile from the shared credentials file.
+        :return: The access key. None if the file or the profile does not have one.
+        """
+        credentials_file = os.environ.get('AWS_SHARED_CREDENTIALS_FILE',
+                                          os.path.join(os.path.expanduser('~'), '.aws', 'credentials'))
+        parser = configparser.ConfigParser()
+        try:
+            parser.read(os.path.expanduser(credentials_file))
+        except configparser.Error:
+            return None
+        if not parser.has_option(self.profile_name, 'aws_access_key_id'):
+            return None
+        return parser.get(self.profile_name, 'aws_access_key_id')
+
+    def get_session(self):
+        """
+        Gets the underlying boto3.Session, creating it on first use.
+        :return: The boto3.Session.
+        """
+        with self.__lock:
+            if self.__session is None:
+                import boto3
+                self.__session = boto3.Session(**self.__arguments)
+            return self.__session
+
+    def client(self, service_name, **kwargs):
+        """
+        Creates a boto3 client. Its calls are traced if tracing is enabled.
+        :param service_name: The name of the AWS service, e.g. 'ecr'.
+        :return: The client.
+        """
+        client = self.get_session().client(service_name, **kwargs)
+        return TracedClient(client, service_name) if is_tracing_enabled() else client
+
+    def __getattr__(self, name):
+        return getattr(self.get_session(), name)
+
+
+class LazyDockerClient(object):
+    """
+    A Docker client which only imports docker and connects to the Docker daemon when it is first used.
+    """
+
+    def __init__(self):
+        self.__client = None
+        self.__lock = threading.Lock()
+
+    def get_client(self):
+        """
+        Gets the underlying docker.APIClient, creating it on first use.
+        :return: The docker.APIClient.
+        """
+        with self.__lock:
+            if self.__client is None:
+                import docker
+                self.__client = docker.APIClient()
+                if is_tracing_enabled():
+                    self.__client = TracedClient(self.__client, 'docker')
+            return self.__client
+
+    def __getattr__(self, name):
+        return getattr(self.get_client(), name)
@@ -0,0 +1,198 @@
+import json
+import time
+
+from .constants import *
+from .util import *
+
+# File in the cache directory where the names found in the AUTOCOMPOSE_PATH and ECR are kept between invocations
+__completion_cache_file = os.path.join(os.environ['HOME'], '.autocompose', 'cache', 'completion.json')
+
+# The directories of the AUTOCOMPOSE_PATH whose sub-directories can be completed, by kind.
+COMPLETION_KINDS = {
+    'services': 'services',
+    'scenarios': 'scenarios',
+    'templates': 'templates',
+    'images': 'images'
+}
+
+# What to complete after an option of a command, by command and option. The default is no completion.
+__option_completions = {
+    'build': {'--scenario': ['scenarios'], '--image-name': ['services']},
+    'push': {'--scenario': ['scenarios'], '--image-name': ['services']},
+}
+
+# What to complete for the positional arguments of a command. Service arguments can also be completed with tags.
+__argument_completions = {
+    'compose': ['services', 'scenarios'],
+    'prefetch': ['services', 'scenarios'],
+    'push': ['services']
+}
+
+
+def complete(aws_session, line='', kind=None, **kwargs):
+    """
+    Prints the completions of a partial command line, one per line.
+    :param aws_session: The AWS session, used to list ECR tags.
+    :param line: The command line up to the cursor, e.g. "autocompose compose my-s".
+    :param kind: If given, complete line as a name of this kind (e.g. 'services') instead.
+    :return: None
+    """
+    if kind is not None:
+        completions = get_names(aws_session, kind, line)
+    else:
+        completions = get_completions(aws_session, line)
+    for completion in completions:
+        print(completion)
+
+
+def get_completions(aws_session, line):
+    """
+    Gets the completions of the last word of a partial command line.
+    :param aws_session: The AWS session, used to list ECR tags.
+    :param line: The command line up to the cursor.
+    :return: A sorted list of completions.
+    """
+    # Imported here, as the command line imports the commands.
+    from .command_line.command_line import commands
+
+    words = line.split()
+    if line == '' or line[-1].isspace():
+        words.append('')
+    current = words[-1]
+
+    if len(words) <= 2:
+        return sorted(command for command in commands if command.startswith(current))
+
+    command = words[1]
+    previous = words[-2]
+    if current.startswith('-'):
+        return sorted(option for option in __get_command_options(command) if option.startswith(current))
+    if previous.startswith('-'):
+        kinds = __option_completions.get(command, {}).get(previous, [])
+    else:
+        kinds = __argument_completions.get(command, [])
+
+    if 'services' in kinds and ':' in current:
+        return get_names(aws_session, 'tags', current)
+    completions = set()
+    for kind in kinds:
+        completions.update(get_names(aws_session, kind, current))
+    return sorted(completions)
+
+
+def get_names(aws_session, kind, prefix=''):
+    """
+    Gets the names of a kind which start with a prefix.
+    :param aws_session: The AWS session, used to list ECR tags.
+    :param kind: One of COMPLETION_KINDS, or 'tags' for "service:tag" names of the ECR tags of a service.
+    :param prefix: The prefix. For tags, the prefix must include the service, e.g. "my-service:1.".
+    :return: A sorted list of names.
+    """
+    cache = __read_completion_cache()
+    if kind == 'tags':
+        service_name, _, tag_prefix = prefix.partition(':')
+        names = [service_name + ':' + tag for tag in __get_ecr_tags(aws_session, cache, service_name)
+                 if tag.startswith(tag_prefix)]
+    elif kind in COMPLETION_KINDS:
+        names = set()
+        for path in get_autocompose_paths():
+            names.update(__get_sub_directories(cache, os.path.join(path, COMPLETION_KINDS[kind])))
+        names = [name for name in names if name.startswith(prefix)]
+    else:
+        raise Exception('Cannot complete "' + kind + '". Choose from: ' + ', '.join(sorted(COMPLETION_KINDS)) +
+                        ', tags')
+
+    if cache.get('changed'):
+        cache.pop('changed')
+        __write_completion_cache(cache)
+    return sorted(names)
+
+
+def __get_sub_directories(cache, directory):
+    """
+    Gets the names of the sub-directories of a directory, which are cached until the directory is modified.
+    :param cache: The completion cache.
+    :param directory: The directory.
+    :return: A list of names. [] if the directory does not exist.
+    """
+    try:
+        modification_time = os.stat(directory).st_mtime
+    except OSError:
+        return []
+
+    entry = cache['directories'].get(directory)
+    if entry is not None and entry['mtime'] == modification_time:
+        return entry['names']
+
+    names = [child.name for child in os.scandir(directory) if child.is_dir() and not child.name.startswith('.')]
+    cache['directories'][directory] = {'mtime': modification_time, 'names': names}
+    cache['changed'] = True
+    return names
+
+
+def __get_ecr_tags(aws_session, cache, service_name):
+    """
+    Gets the tags of a service's ECR repository, which are cached for COMPLETION_ECR_TAGS_TTL_SECONDS.
+    :param aws_session: The AWS session.
+    :param cache: The completion cache.
+    :param service_name: The name of the service, which is also the name of its ECR repository.
+    :return: A list of tags. [] if they cannot be listed.
+    """
+    key = '|'.join([str(aws_session.profile_name), str(aws_session.region_name), service_name])
+    entry = cache['tags'].get(key)
+    if entry is not None and entry['time'] + COMPLETION_ECR_TAGS_TTL_SECONDS > time.time():
+        return entry['tags']
+
+    tags = []
+    try:
+        paginator = aws_session.client('ecr').get_paginator('list_images')
+        for page in paginator.paginate(repositoryName=service_name, filter={'tagStatus': 'TAGGED'}):
+            tags.extend(image_id['imageTag'] for image_id in page['imageIds'] if 'imageTag' in image_id)
+    except Exception:
+        return []
+
+    cache['tags'][key] = {'time': time.time(), 'tags': tags}
+    cache['changed'] = True
+    return tags
+
+
+def __read_completion_cache():
+    """
+    Reads the completion cache file.
+    :return: The completion cache. An empty cache if the file does not exist or cannot be read.
+    """
+    try:
+        with open(__completion_cache_file, 'r') as file:
+            cache = json.load(file)
+        if isinstance(cache.get('directories'), dict) and isinstance(cache.get('tags'), dict):
+            return cache
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {'directories': {}, 'tags': {}}
+
+
+def __write_completion_cache(cache):
+    """
+    Writes the completion cache file. Failing to write it is not an error.
+    :param cache: The completion cache.
+    :return: None
+    """
+    try:
+        os.makedirs(os.path.dirname(__completion_cache_file), exist_ok=True)
+        write_file_atomically(__completion_cache_file, json.dumps(cache))
+    except OSError:
+        pass
+
+
+def __get_command_options(command):
+    """
+    Gets the options of a command.
+    :param command: The name of the command.
+    :return: A list of options, e.g. ['--jobs']. [] if the command does not exist.
+    """
+    from .command_line.command_line import commands, get_command
+
+    if command not in commands:
+        return []
+    return [option for option in get_command(command).argument_parser._option_string_actions
+            if option.startswith('--')]
@@ -1,31 +1,180 @@
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from .authenticator import get_authorization_data
 from .constants import *
+from .tracing import count, span, traced
 from .util import *
+from .watcher import wait_for_changes
+
+# Directory where generated docker-compose configs are cached between invocations
+__compose_cache_directory = os.path.join(os.environ['HOME'], '.autocompose', 'cache', 'compose')
 
+# How lists in docker-compose configs are merged, by key. Lists under any other key are merged with MERGE_UNION.
+# Commands are argument lists, which must not be de-duplicated, and volumes mounted to the same target replace
+# each other.
+COMPOSE_MERGE_STRATEGIES = {
+    'command': MERGE_REPLACE,
+    'entrypoint': MERGE_REPLACE,
+    'test': MERGE_REPLACE,
+    'volumes': UnionByKey('target')
+}
 
-def print_compose_file(aws_session, scenarios, **kwargs):
+
+def print_compose_file(aws_session, scenarios, no_cache=False, explain_cache=False, jobs=DEFAULT_JOBS, output=None,
+                       output_format='yaml', watch=False, poll_interval=1.0, **kwargs):
     """
-    Prints a generated docker-compose file out to stdout.
+    Prints a generated docker-compose file out to stdout, or writes it to a file.
     :param aws_session: The AWS session.
     :param scenarios: The scenarios and/or services.
+    :param no_cache: If True, the compose cache is neither read nor written.
+    :param explain_cache: If True, print to stderr why a cached docker-compose config was or was not used.
+    :param jobs: The number of services to load concurrently.
+    :param output: The file to write the docker-compose file to, instead of stdout.
+    :param output_format: The format of the docker-compose file: 'yaml' or 'json'.
+    :param watch: If True, keep the output file up to date until interrupted, see watch_compose_file.
+    :param poll_interval: With watch, the number of seconds between two checks of the inputs, if inotify is not
+                          available.
     :return: None
     """
+    if watch:
+        if output is None:
+            raise Exception('Watching requires an output file.')
+        return watch_compose_file(aws_session, scenarios, output, output_format=output_format, jobs=jobs,
+                                  poll_interval=poll_interval)
 
-    docker_compose_file = build_compose_file(aws_session, scenarios=scenarios)
+    docker_compose_file = build_compose_file(aws_session, scenarios=scenarios, use_cache=not no_cache,
+                                             explain_cache=explain_cache, jobs=jobs)
 
-    # Setting default_flow_style = False prints out multi-line arrays.
-    output = yaml.dump(docker_compose_file, default_flow_style=False, Dumper=ExplicitYamlDumper)
+    if output is None:
+        dump_compose_file(docker_compose_file, sys.stdout, output_format)
+        sys.stdout.flush()
+    else:
+        write_compose_file(output, docker_compose_file, output_format)
 
-    # Fix the array formatting.
-    output = output.replace('- ', ' - ')
-    print(output)
+
+@traced('dump_compose_file', 'compose')
+def dump_compose_file(docker_compose_config, stream, output_format='yaml'):
+    """
+    Writes a docker-compose config to a stream, without building the whole document in memory first.
+    YAML is emitted by libyaml where it is available, in block style and without aliases.
+    :param docker_compose_config: The docker-compose config.
+    :param stream: The stream, e.g. a file.
+    :param output_format: 'yaml' or 'json'. docker-compose reads either, and parses JSON faster.
+    :return: None
+    """
+    if output_format == 'json':
+        json.dump(docker_compose_config, stream, indent=2, sort_keys=True, default=str)
+        stream.write('\n')
+    elif output_format == 'yaml':
+        yaml.dump(docker_compose_config, stream, Dumper=YamlDumper, default_flow_style=False)
+    else:
+        raise Exception('Unknown output format "' + output_format + '". Use yaml or json.')
+
+
+def write_compose_file(file_name, docker_compose_config, output_format='yaml'):
+    """
+    Writes a docker-compose file atomically, unless it already has the same content, so that its modification time
+    only changes when its content does.
+    :param file_name: The file.
+    :param docker_compose_config: The docker-compose config.
+    :param output_format: 'yaml' or 'json'.
+    :return: True if the file was written.
+    """
+    return write_file_atomically(file_name, lambda file: dump_compose_file(docker_compose_config, file, output_format),
+                                 only_if_changed=True)
 
 
-def build_compose_file(aws_session, scenarios):
+def watch_compose_file(aws_session, scenarios, output, output_format='yaml', jobs=DEFAULT_JOBS, poll_interval=1.0):
+    """
+    Writes a docker-compose file, then rewrites it whenever any of its inputs changes, until interrupted.
+    The inputs each service was loaded from are recorded. When inputs change, only the services (and their templates)
+    using them are loaded again, and merged with the services loaded before. The file is only rewritten if its content
+    changed, so that docker-compose only recreates the containers of the services which changed.
+    :param aws_session: The AWS session.
+    :param scenarios: The scenarios and/or services.
+    :param output: The file to write the docker-compose file to.
+    :param output_format: 'yaml' or 'json'.
+    :param jobs: The number of services to load concurrently.
+    :param poll_interval: The number of seconds between two checks of the inputs, if inotify is not available.
+    :return: None
+    """
+    # Loaded services, by name as given in the scenarios, along with the inputs they were loaded from.
+    services = {}
+    # The watched files and directories, and their state when they were last read.
+    watched_states = {}
+    changed_paths = {}
+    while True:
+        invalidate_path_index()
+        stale_services = [service_name for service_name, service in services.items()
+                          if not changed_paths.keys().isdisjoint(service['inputs']['files']) or
+                          not changed_paths.keys().isdisjoint(service['inputs']['directories'])]
+        for service_name in stale_services:
+            del services[service_name]
+
+        start = time.time()
+        with record_inputs() as inputs:
+            try:
+                docker_compose_config = __build_compose_config(aws_session, scenarios, jobs, services)
+                written = write_compose_file(output, docker_compose_config, output_format)
+                print(('Wrote' if written else 'No changes to') + ' "' + output + '" (' +
+                      ('reloaded ' + str(len(stale_services)) + ' services, ' if changed_paths else '') +
+                      '%.2fs).' % (time.time() - start))
+            except Exception as e:
+                print('Could not compose "' + output + '": ' + str(e), file=sys.stderr)
+
+        # Keep watching the inputs of the last successful composition too, in case the composition failed part way.
+        # Inputs are compared with their state when they were read, so that changes made while composing are not
+        # missed, and trigger another composition straight away.
+        if changed_paths:
+            watched_states.update(changed_paths)
+        else:
+            watched_states = {}
+        watched_states.update(inputs['states'])
+        print('Watching ' + str(len(watched_states)) + ' files and directories for changes...')
+        try:
+            changed_paths = wait_for_changes(watched_states, poll_interval)
+        except KeyboardInterrupt:
+            return
+
+
+@traced('build_compose_file', 'compose')
+def build_compose_file(aws_session, scenarios, use_cache=False, explain_cache=False, jobs=DEFAULT_JOBS):
     """
     Builds a docker-compose configuration dictionary, given a list of scenarios.
     :param aws_session: The aws_session.
     :param scenarios: a list of autocompose scenarios.
+    :param use_cache: If True, return the cached configuration if none of its inputs have changed,
+                      and cache the configuration otherwise.
+    :param explain_cache: If True, print to stderr why a cached configuration was or was not used.
+    :param jobs: The number of services to load concurrently.
+    :return: A docker-compose configuration as a dictionary.
+    """
+
+    if not use_cache:
+        return __build_compose_config(aws_session, scenarios, jobs)
+
+    cache_file = __get_compose_cache_file(scenarios)
+    docker_compose_config = __get_cached_compose_config(aws_session, cache_file, explain_cache)
+    if docker_compose_config is not None:
+        count('compose.cache_hits')
+        return docker_compose_config
+
+    with record_inputs() as inputs:
+        docker_compose_config = __build_compose_config(aws_session, scenarios, jobs)
+    __cache_compose_config(cache_file, scenarios, inputs, docker_compose_config)
+    return docker_compose_config
+
+
+def __build_compose_config(aws_session, scenarios, jobs, services=None):
+    """
+    Builds a docker-compose configuration dictionary from the AUTOCOMPOSE_PATH, given a list of scenarios.
+    :param aws_session: The aws_session.
+    :param scenarios: a list of autocompose scenarios.
+    :param jobs: The number of services to load concurrently.
+    :param services: If given, a dictionary of services loaded before, see __load_services.
     :return: A docker-compose configuration as a dictionary.
     """
 
@@ -34,10 +183,12 @@ def build_compose_file(aws_session, scenarios):
     # Start with an empty configuration.
     docker_compose_config = {}
     template_variables = {}
+    merger = DeepMerger(COMPOSE_MERGE_STRATEGIES)
 
     # Merge every scenario into the configuration
     for scenario_name in scenarios:
-        __merge_scenario(aws_session, docker_compose_config, scenario_name, template_variables)
+        __merge_scenario(aws_session, merger, docker_compose_config, scenario_name, template_variables, jobs,
+                         services)
 
     # Look for template variables in the user config
     __add_user_config_template_variables(user_config, template_variables)
@@ -51,26 +202,43 @@ def build_compose_file(aws_session, scenarios):
     return docker_compose_config
 
 
-def __merge_scenario(aws_session, docker_compose_config, scenario_name, template_variables):
+def __merge_scenario(aws_session, merger, docker_compose_config, scenario_name, template_variables, jobs,
+                     services=None):
     """
     Merge the contents of a scenario into the docker-compose config.
     :param aws_session: The aws_session.
+    :param merger: The DeepMerger used to build the docker-compose config.
     :param docker_compose_config: The docker-compose config being currently built.
     :param scenario_name: The name of the scenario to merge.
     :param template_variables: The template variables to add to.
+    :param jobs: The number of services to load concurrently.
+    :param services: If given, a dictionary of services loaded before, see __load_services.
     :return:
     """
     scenario_config = __get_scenario_config(scenario_name)
     service_names = __get_service_names(scenario_config)
     deep_merge(template_variables, __get_scenario_template_variables(scenario_config))
 
-    # Merge the configs of all services of the scenario
-    for service_name in service_names:
-        __merge_service(aws_session, service_name, docker_compose_config)
+    # Load all services of the scenario concurrently, then merge them in order,
+    # so the result is the same as loading them one after another.
+    for service in __load_services(aws_session, service_names, jobs, services):
+        __merge_service(merger, service, docker_compose_config)
 
     # Merge the scenario's docker-compose.yml config
     scenario_compose_config = __get_scenario_compose_config(scenario_name)
-    deep_merge(docker_compose_config, scenario_compose_config)
+    with span('deep_merge', 'merge'):
+        merger.merge(docker_compose_config, scenario_compose_config)
+
+
+def get_scenario_services(scenario_name):
+    """
+    Gets the services of a scenario (or a single service) from the AUTOCOMPOSE_PATH.
+    :param scenario_name: The name of the scenario or service.
+    :return: A list of (service name, version) tuples.
+    """
+    scenario_config = __get_scenario_config(scenario_name)
+    return [tuple(__parse_version_from_service_name(service_name))
+            for service_name in __get_service_names(scenario_config)]
 
 
 def __get_scenario_config(scenario_name):
@@ -89,7 +257,7 @@ def __get_scenario_config(scenario_name):
         scenario_config = {'services': [scenario_name]}
 
     else:
-        scenario_config = yaml.load(open(os.path.join(all_scenarios[0], AUTOCOMPOSE_SCENARIO_FILE)))
+        scenario_config = load_yaml_file(os.path.join(all_scenarios[0], AUTOCOMPOSE_SCENARIO_FILE))
 
     if scenario_config is None:
         scenario_config = {}
@@ -115,13 +283,63 @@ def __get_service_names(scenario_config):
     return service_names
 
 
-def __merge_service(aws_session, service_name, docker_compose_config):
+def __load_services(aws_session, service_names, jobs, services=None):
     """
-    Merge the contents of a service into the docker-compose config.
+    Loads services from the AUTOCOMPOSE_PATH, using up to the given number of threads.
     :param aws_session: The aws_session.
-    :param service_name: The name of the service to merge.
-    :param docker_compose_config: The docker-compose config being currently built.
-    :return:
+    :param service_names: The names of the services to load, as given in the "services" list of a scenario.
+    :param jobs: The number of services to load concurrently.
+    :param services: If given, a dictionary of services loaded before, by name. Only services which are not in it are
+                     loaded, and added to it along with the inputs they were loaded from, see record_inputs.
+    :return: A list of the loaded services, in the same order as the service names. See __load_service.
+    """
+    if services is None:
+        return __run_concurrently(functools.partial(__load_service, aws_session), service_names, jobs)
+
+    def load_service(service_name):
+        with record_inputs(current_thread_only=True) as inputs:
+            services[service_name] = {'service': __load_service(aws_session, service_name), 'inputs': inputs}
+
+    __run_concurrently(load_service, [service_name for service_name in unique(service_names)
+                                      if service_name not in services], jobs)
+
+    # Merging modifies the configs, so the services loaded before are copied.
+    return [__copy_service(services[service_name]['service']) for service_name in service_names]
+
+
+def __run_concurrently(function, arguments, jobs):
+    """
+    Calls a function with every argument, using up to the given number of threads.
+    :param function: The function.
+    :param arguments: The arguments.
+    :param jobs: The number of threads.
+    :return: A list of the results, in the same order as the arguments.
+    """
+    if jobs is None or jobs <= 1 or len(arguments) <= 1:
+        return [function(argument) for argument in arguments]
+
+    with ThreadPoolExecutor(max_workers=min(jobs, len(arguments))) as executor:
+        return list(executor.map(function, arguments))
+
+
+def __copy_service(service):
+    """
+    Copies a service loaded by __load_service.
+    :param service: The service.
+    :return: The copy.
+    """
+    service_name, service_compose_config, templates = service
+    return service_name, copy_document(service_compose_config), \
+        [(copy_document(global_config), copy_document(service_config)) for global_config, service_config in templates]
+
+
+def __load_service(aws_session, service_name):
+    """
+    Loads everything needed to merge a service into a docker-compose config:
+    the service's docker-compose config (including its image), and the configs of its templates.
+    :param aws_session: The aws_session.
+    :param service_name: The name of the service to load, as given in the "services" list of a scenario.
+    :return: A tuple of (service name, docker-compose config, list of (global config, service config) templates).
     """
     service_name, version = __parse_version_from_service_name(service_name)
 
@@ -131,10 +349,29 @@ def __merge_service(aws_session, service_name, docker_compose_config):
     __add_service(service_compose_config, service_name)
     __add_docker_image(aws_session, service_compose_config, service_name, version)
 
-    deep_merge(docker_compose_config, service_compose_config)
+    templates = []
     if AUTOCOMPOSE_TEMPLATES_KEY in service_config:
         for template in service_config[AUTOCOMPOSE_TEMPLATES_KEY]:
-            __apply_template(docker_compose_config, service_name, template)
+            templates.append((__get_global_template_config(template), __get_service_template_config(template)))
+
+    return service_name, service_compose_config, templates
+
+
+@traced('deep_merge', 'merge')
+def __merge_service(merger, service, docker_compose_config):
+    """
+    Merge the contents of a service into the docker-compose config.
+    :param merger: The DeepMerger used to build the docker-compose config.
+    :param service: The service to merge, as loaded by __load_service.
+    :param docker_compose_config: The docker-compose config being currently built.
+    :return:
+    """
+    service_name, service_compose_config, templates = service
+
+    merger.merge(docker_compose_config, service_compose_config)
+    for template_global_config, template_service_config in templates:
+        __apply_template(merger, docker_compose_config, service_name, template_global_config,
+                         template_service_config)
 
 
 def __parse_version_from_service_name(service_name):
@@ -174,6 +411,7 @@ def __get_docker_image(aws_session, service_name, tag):
     :return: The complete docker image string.
     """
     url = get_authorization_data(aws_session)['proxyEndpoint']
+    record_input('registry', url)
     return url.replace('https://', '') + '/' + service_name + ':' + tag
 
 
@@ -203,8 +441,7 @@ def __get_scenario_template_variables(scenario_config):
     if TEMPLATE_VARIABLES_KEY in scenario_config:
         if isinstance(scenario_config[TEMPLATE_VARIABLES_KEY], dict):
             for key in scenario_config[TEMPLATE_VARIABLES_KEY]:
-                template_variables["${" + key + "}"] = scenario_config[TEMPLATE_VARIABLES_KEY][key]
-                template_variables["$" + key] = scenario_config[TEMPLATE_VARIABLES_KEY][key]
+                template_variables[key] = scenario_config[TEMPLATE_VARIABLES_KEY][key]
     return template_variables
 
 
@@ -235,25 +472,24 @@ def __get_service_config(service_name):
     return get_config('services', service_name, AUTOCOMPOSE_SERVICE_FILE)
 
 
-def __apply_template(docker_compose_config, service_name, template):
+def __apply_template(merger, docker_compose_config, service_name, template_global_config, template_service_config):
     """
     Applies a template to a given service in a given docker-compose config.
+    :param merger: The DeepMerger used to build the docker-compose config.
     :param docker_compose_config: The docker-compose config being currently built.
     :param service_name: The name of the service.
-    :param template: The template to add to the service in the docker-compose config.
+    :param template_global_config: The global docker-compose config of the template.
+    :param template_service_config: The per-service docker-compose config of the template.
     :return:
     """
 
-    template_global_config = __get_global_template_config(template)
-    template_service_config = __get_service_template_config(template)
-
     __add_service(docker_compose_config, service_name)
 
     template_config = {'services': {}}
     template_config['services'][service_name] = template_service_config
 
-    deep_merge(docker_compose_config, template_global_config)
-    deep_merge(docker_compose_config, template_config)
+    merger.merge(docker_compose_config, template_global_config)
+    merger.merge(docker_compose_config, template_config)
 
 
 def __get_global_template_config(template_name):
@@ -274,18 +510,161 @@ def __get_service_template_config(template_name):
     return get_config('templates', template_name, DOCKER_COMPOSE_SERVICES_FILE)
 
 
+@traced('replace_template_variables', 'template')
 def __apply_template_variables(docker_compose_config, template_variables):
     """
     Apply the given template variables to the given docker-compose config.
     :param docker_compose_config: The docker-compose config being currently built.
-    :param template_variables: Key-value pairs to replace keys and values in the docker-compose config.
+    :param template_variables: Names and values of the variables to replace in keys and values of the
+                               docker-compose config.
     :return:
     """
-    return replace_template_variables(docker_compose_config, template_variables)
+    return compile_template_variables(template_variables).substitute(docker_compose_config)
 
 
 def __add_user_config_template_variables(user_config, template_variables):
     if 'template-variables' in user_config:
         for key, value in user_config['template-variables'].items():
-            template_variables["${" + key + "}"] = value
-            template_variables["$" + key] = value
+            template_variables[key] = value
+
+
+def __get_compose_cache_file(scenarios):
+    """
+    Gets the cache file for the docker-compose config of a list of scenarios.
+    :param scenarios: a list of autocompose scenarios.
+    :return: The cache file name.
+    """
+    key = json.dumps({'version': COMPOSE_CACHE_VERSION, 'scenarios': scenarios, 'paths': get_autocompose_paths()})
+    return os.path.join(__compose_cache_directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def __get_cached_compose_config(aws_session, cache_file, explain_cache):
+    """
+    Gets a cached docker-compose config, if none of the inputs it was built from have changed.
+    :param aws_session: The AWS session.
+    :param cache_file: The cache file.
+    :param explain_cache: If True, print to stderr why the cached config was or was not used.
+    :return: The cached docker-compose config. None if there is no valid cached config.
+    """
+    try:
+        with open(cache_file, 'r') as file:
+            entry = json.load(file)
+    except FileNotFoundError:
+        __explain_cache(explain_cache, 'No cached docker-compose config for these scenarios.')
+        return None
+    except (OSError, ValueError):
+        __explain_cache(explain_cache, 'The cache file "' + cache_file + '" could not be read.')
+        return None
+
+    reason = __get_compose_cache_invalidation_reason(aws_session, entry)
+    if reason is not None:
+        __explain_cache(explain_cache, 'The cached docker-compose config is out of date: ' + reason)
+        return None
+
+    __explain_cache(explain_cache, 'Using the cached docker-compose config "' + cache_file + '".')
+    return entry['config']
+
+
+def __get_compose_cache_invalidation_reason(aws_session, entry):
+    """
+    Checks whether any input of a cached docker-compose config has changed.
+    :param aws_session: The AWS session.
+    :param entry: The cache entry.
+    :return: A description of the first changed input. None if no input has changed.
+    """
+    for file_name, fingerprint in entry['files'].items():
+        current = __get_current_file_fingerprint(file_name, fingerprint)
+        if current is None or current['sha256'] != fingerprint['sha256']:
+            return 'the file "' + file_name + '" has changed.'
+
+    for directory, fingerprint in entry['directories'].items():
+        current = __get_current_directory_fingerprint(directory, fingerprint)
+        if (current is None) != (fingerprint is None) or (current is not None and
+                                                          current['sha256'] != fingerprint['sha256']):
+            return 'files were added to or removed from "' + directory + '".'
+
+    if 'registry' in entry['values']:
+        registry = get_authorization_data(aws_session)['proxyEndpoint']
+        if registry != entry['values']['registry']:
+            return 'the registry changed from "' + entry['values']['registry'] + '" to "' + registry + '".'
+
+    return None
+
+
+def __get_current_file_fingerprint(file_name, fingerprint):
+    """
+    Gets the current fingerprint of a file, only hashing the file if its modification time or size changed.
+    :param file_name: The file.
+    :param fingerprint: The cached fingerprint of the file.
+    :return: The current fingerprint. None if the file no longer exists.
+    """
+    try:
+        stat = os.stat(file_name)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if stat.st_mtime_ns == fingerprint['mtime'] and stat.st_size == fingerprint['size']:
+        return fingerprint
+    return get_file_fingerprint(file_name)
+
+
+def __get_current_directory_fingerprint(directory, fingerprint):
+    """
+    Gets the current fingerprint of a directory, only listing the directory if its modification time changed.
+    :param directory: The directory.
+    :param fingerprint: The cached fingerprint of the directory. None if it did not exist.
+    :return: The current fingerprint. None if the directory does not exist.
+    """
+    if fingerprint is not None:
+        try:
+            if os.stat(directory).st_mtime_ns == fingerprint['mtime']:
+                return fingerprint
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+    return get_directory_fingerprint(directory)
+
+
+def __cache_compose_config(cache_file, scenarios, inputs, docker_compose_config):
+    """
+    Saves a docker-compose config to the compose cache, along with fingerprints of the inputs it was built from.
+    Configs which cannot be represented in JSON (e.g. YAML dates, or non-string keys) are not cached.
+    :param cache_file: The cache file.
+    :param scenarios: The scenarios the config was built from.
+    :param inputs: The inputs recorded while building the config.
+    :param docker_compose_config: The docker-compose config.
+    :return: None
+    """
+    try:
+        config = json.dumps(docker_compose_config)
+    except (TypeError, ValueError):
+        return
+    if json.loads(config) != docker_compose_config:
+        return
+
+    files = {file_name: get_file_fingerprint(file_name) for file_name in inputs['files']}
+    if None in files.values():
+        return
+
+    entry = {
+        'scenarios': scenarios,
+        'files': files,
+        'directories': {directory: get_directory_fingerprint(directory) for directory in inputs['directories']},
+        'values': inputs['values'],
+        'config': docker_compose_config
+    }
+    try:
+        if not os.path.exists(__compose_cache_directory):
+            os.makedirs(__compose_cache_directory)
+        write_file_atomically(cache_file, json.dumps(entry))
+    except OSError as e:
+        print('Could not write the compose cache file "' + cache_file + '": ' + str(e), file=sys.stderr)
+
+
+def __explain_cache(explain_cache, message):
+    """
+    Prints a message about the compose cache to stderr, if requested.
+    :param explain_cache: If True, print the message.
+    :param message: The message.
+    :return: None
+    """
+    if explain_cache:
+        print(message, file=sys.stderr)
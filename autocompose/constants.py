@@ -12,3 +12,25 @@ DOCKER_COMPOSE_FILE = 'docker-compose.yml'
 DOCKER_COMPOSE_SERVICES_FILE = 'docker-compose-service.yml'
 DOCKERFILE_SH = 'Dockerfile.sh'
 TEMPLATE_VARIABLES_KEY = 'template-variables'
+
+# Cached ECR authorization tokens are refreshed this long before they expire.
+ECR_TOKEN_EXPIRY_MARGIN_SECONDS = 15 * 60
+
+# Bump this whenever the way docker-compose configs are generated changes, to invalidate the compose cache.
+COMPOSE_CACHE_VERSION = 3
+
+# Default number of concurrent jobs, e.g. services loaded at once by 'autocompose compose'.
+DEFAULT_JOBS = 8
+
+# The label holding the fingerprint of an image built by 'autocompose build'.
+AUTOCOMPOSE_FINGERPRINT_LABEL = 'autocompose.fingerprint'
+
+# The tag of a service's ECR repository which 'autocompose build --ecr-cache' pushes its layer cache to.
+# It must not be a tag which compose resolves (e.g. latest), or deployments would pick up unreleased builds.
+DEFAULT_BUILD_CACHE_TAG = 'buildcache'
+
+# How long the ECR tags listed for shell completion are cached.
+COMPLETION_ECR_TAGS_TTL_SECONDS = 5 * 60
+
+# The Unix socket of the Docker Engine, which docker.APIClient connects to by default.
+DOCKER_SOCKET = '/var/run/docker.sock'
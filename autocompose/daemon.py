@@ -0,0 +1,193 @@
+import contextlib
+import hashlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+from .util import invalidate_path_index, set_service_name
+
+# The Unix socket the daemon listens on.
+__socket_file = os.path.join(os.environ['HOME'], '.autocompose', 'daemon.sock')
+
+# Set this environment variable to never use the daemon.
+NO_DAEMON_VARIABLE = 'AUTOCOMPOSE_NO_DAEMON'
+
+# The commands the daemon runs on behalf of the command line. Other commands always run in their own process.
+DAEMON_COMMANDS = ['complete', 'compose', 'path']
+
+# Options which make a command run until interrupted, e.g. compose --watch. Such commands would hold the daemon, which
+# runs one command at a time, forever, so they always run in their own process.
+LONG_RUNNING_OPTIONS = ['--watch']
+
+
+def serve(aws_session, docker_client, poll_interval=1.0, **kwargs):
+    """
+    Runs the autocompose daemon until interrupted.
+    The daemon answers the commands in DAEMON_COMMANDS over a Unix socket, keeping the AUTOCOMPOSE_PATH index, the
+    parsed YAML files, the ECR authorization data and the Docker client in memory between commands. The path index is
+    checked for changes every poll interval.
+    Commands run one at a time, in the daemon's own environment, so the command line only uses the daemon if it was
+    started with the same AWS options and AUTOCOMPOSE_PATH, see execute_in_daemon.
+    :param aws_session: The AWS session.
+    :param docker_client: The Docker client.
+    :param poll_interval: The number of seconds between two checks of the AUTOCOMPOSE_PATH for changes.
+    :return: None
+    """
+    # Imported here, as the command line imports this module.
+    from .command_line.command_line import execute
+
+    identity = get_identity(aws_session.get_arguments())
+    lock = threading.Lock()
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            if request.get('identity') != identity or request.get('command') not in DAEMON_COMMANDS:
+                response = {'fallback': True}
+            else:
+                with lock:
+                    response = run(request)
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+    def run(request):
+        # Called from here, as private names are mangled inside the RequestHandler class.
+        return __run_request(request, execute, aws_session, docker_client)
+
+    def poll():
+        while not stopped.wait(poll_interval):
+            with lock:
+                invalidate_path_index()
+
+    __remove_stale_socket_file()
+    server = socketserver.ThreadingUnixStreamServer(__socket_file, RequestHandler)
+    server.daemon_threads = True
+    os.chmod(__socket_file, 0o600)
+    stopped = threading.Event()
+    threading.Thread(target=poll, daemon=True).start()
+
+    print('Serving ' + ', '.join(DAEMON_COMMANDS) + ' on "' + __socket_file + '". Press Ctrl+C to stop.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        server.server_close()
+        os.remove(__socket_file)
+
+
+def __run_request(request, execute, aws_session, docker_client):
+    """
+    Runs a command requested by the command line, capturing its output.
+    Errors are reported to the command line like any other output, rather than dropping the connection, which would
+    make the command line run the command again itself.
+    :param request: The request, see execute_in_daemon.
+    :param execute: The function running a command, see command_line.execute.
+    :param aws_session: The AWS session.
+    :param docker_client: The Docker client.
+    :return: The response, with the command's 'stdout', 'stderr' and exit 'status'.
+    """
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    working_directory = os.getcwd()
+    status = 0
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                os.chdir(request['cwd'])
+                set_service_name(request.get('service_name'))
+                execute(request['command'], request['arguments'], aws_session, docker_client)
+            except SystemExit as e:
+                # argparse exits on invalid arguments and --help
+                status = e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                print(str(e), file=sys.stderr)
+                status = 1
+    finally:
+        set_service_name(None)
+        os.chdir(working_directory)
+    return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'status': status}
+
+
+def execute_in_daemon(command, arguments, service_name, aws_arguments):
+    """
+    Runs a command in the daemon, if it is running, and prints its output.
+    :param command: The name of the command.
+    :param arguments: The arguments of the command.
+    :param service_name: The service name given on the command line, if any.
+    :param aws_arguments: The AWS options of the command line, see LazyAwsSession.get_arguments.
+    :return: The exit status of the command. None if the command was not run by the daemon.
+    """
+    if command not in DAEMON_COMMANDS or os.environ.get(NO_DAEMON_VARIABLE) or not os.path.exists(__socket_file):
+        return None
+    if any(__is_option(argument, option) for argument in arguments for option in LONG_RUNNING_OPTIONS):
+        return None
+
+    request = {
+        'command': command,
+        'arguments': arguments,
+        'cwd': os.getcwd(),
+        'service_name': service_name,
+        'identity': get_identity(aws_arguments)
+    }
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(__socket_file)
+            client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+            with client.makefile('rb') as response_file:
+                response = json.loads(response_file.readline().decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+
+    if response.get('fallback'):
+        return None
+    print(response['stdout'], end='')
+    if response['stderr']:
+        print(response['stderr'], end='', file=sys.stderr)
+    return response['status']
+
+
+def __is_option(argument, option):
+    """
+    Checks whether a command line argument is an option, or an abbreviation of it as accepted by argparse.
+    :param argument: The argument, e.g. '--wat'.
+    :param option: The option, e.g. '--watch'.
+    :return: True if the argument is the option.
+    """
+    name = argument.partition('=')[0]
+    return len(name) > 2 and name.startswith('--') and option.startswith(name)
+
+
+def get_identity(aws_arguments):
+    """
+    Gets what the output of a command depends on, besides its arguments: the AWS options and environment variables,
+    and the AUTOCOMPOSE_PATH.
+    :param aws_arguments: The AWS options of the command line.
+    :return: A digest of the AWS options and environment variables, and the AUTOCOMPOSE_PATH.
+    """
+    identity = {
+        'aws': aws_arguments,
+        'aws_environment': {name: value for name, value in os.environ.items() if name.startswith('AWS_')},
+        'autocompose_path': os.environ.get('AUTOCOMPOSE_PATH')
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def __remove_stale_socket_file():
+    """
+    Removes the socket file of a daemon which is no longer running.
+    :return: None
+    """
+    if not os.path.exists(__socket_file):
+        return
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(__socket_file)
+    except OSError:
+        os.remove(__socket_file)
+        return
+    raise Exception('The autocompose daemon is already running on "' + __socket_file + '".')
@@ -0,0 +1,411 @@
+import asyncio
+import codecs
+import json
+import re
+from urllib.parse import quote, urlencode
+
+from docker import auth, errors, utils
+from docker.constants import DEFAULT_DOCKER_API_VERSION
+
+from .constants import *
+from .tracing import count, span
+
+
+class JsonStreamDecoder(object):
+    """
+    Decodes a stream of concatenated JSON documents, such as the progress output of a Docker pull or push, as it
+    arrives. Chunks may end in the middle of a document, or of a UTF-8 character.
+    """
+
+    # Whitespace between the documents.
+    __whitespace = re.compile(r'\s*')
+
+    def __init__(self):
+        self.__text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.__json_decoder = json.JSONDecoder()
+        self.__buffer = ''
+
+    def feed(self, data):
+        """
+        Decodes a chunk of the stream.
+        :param data: The chunk, as bytes.
+        :return: A list of the documents completed by the chunk.
+        """
+        self.__buffer += self.__text_decoder.decode(data)
+        documents = []
+        position = self.__whitespace.match(self.__buffer).end()
+        while position < len(self.__buffer):
+            try:
+                document, end = self.__json_decoder.raw_decode(self.__buffer, position)
+            except ValueError:
+                # The rest of the document is in the next chunks.
+                break
+            documents.append(document)
+            position = self.__whitespace.match(self.__buffer, end).end()
+        self.__buffer = self.__buffer[position:]
+        return documents
+
+    def close(self):
+        """
+        Checks that the stream did not end in the middle of a document.
+        :return: None
+        """
+        self.__buffer += self.__text_decoder.decode(b'', final=True)
+        if self.__buffer.strip() != '':
+            raise Exception('The Docker Engine output ended in the middle of a JSON document: ' + self.__buffer[:100])
+
+
+class AsyncEngineClient(object):
+    """
+    A Docker Engine API client for asyncio, which talks HTTP/1.1 to the Engine over its Unix socket.
+    Requests share a pool of keep-alive connections. Once every connection is busy, further requests wait for one to
+    be free, so any number of operations can be started at once.
+    Streamed responses (e.g. pull progress) are read a chunk at a time, and only as fast as their events are handled:
+    while a handler is busy nothing more is read, and the Engine waits rather than the output piling up in memory.
+    Create the client and use it on the same event loop, see run_on_engine.
+    """
+
+    def __init__(self, socket_path=DOCKER_SOCKET, connections=DEFAULT_JOBS, api_version=DEFAULT_DOCKER_API_VERSION,
+                 read_size=64 * 1024):
+        """
+        :param socket_path: The Unix socket of the Docker Engine.
+        :param connections: The maximum number of connections, i.e. of requests running at once.
+        :param api_version: The version of the Engine API, e.g. '1.26'.
+        :param read_size: The maximum number of bytes read from a connection at once.
+        """
+        self.socket_path = socket_path
+        self.api_version = api_version
+        self.read_size = read_size
+        self.__connections = asyncio.Semaphore(max(1, connections))
+        self.__idle_connections = []
+        self.__auth_configs = None
+
+    def close(self):
+        """
+        Closes the idle connections.
+        :return: None
+        """
+        while len(self.__idle_connections) > 0:
+            _, writer = self.__idle_connections.pop()
+            writer.close()
+
+    async def inspect_image(self, image):
+        """
+        Inspects an image.
+        :param image: The id or tag of the image.
+        :return: The image, as returned by docker_client.inspect_image.
+        """
+        _, body = await self.__request('inspect_image', 'GET', '/images/' + self.__quote(image) + '/json')
+        return json.loads(body.decode('utf-8'))
+
+    async def tag(self, image, repository, tag=None):
+        """
+        Tags an image.
+        :param image: The id or tag of the image.
+        :param repository: The repository to tag the image in.
+        :param tag: The tag. Default is latest.
+        :return: None
+        """
+        params = {'repo': repository, 'tag': tag or 'latest'}
+        await self.__request('tag', 'POST', '/images/' + self.__quote(image) + '/tag', params)
+
+    async def remove_container(self, container, force=False, volumes=False):
+        """
+        Removes a container.
+        :param container: The id or name of the container.
+        :param force: If True, kill the container if it is running.
+        :param volumes: If True, remove the container's anonymous volumes too.
+        :return: None
+        """
+        params = {'force': self.__flag(force), 'v': self.__flag(volumes)}
+        await self.__request('remove_container', 'DELETE', '/containers/' + self.__quote(container), params)
+
+    async def remove_image(self, image, force=False, noprune=False):
+        """
+        Removes an image.
+        :param image: The id or tag of the image.
+        :param force: If True, remove the image even if it is tagged in several repositories.
+        :param noprune: If True, keep the image's untagged parents.
+        :return: None
+        """
+        params = {'force': self.__flag(force), 'noprune': self.__flag(noprune)}
+        await self.__request('remove_image', 'DELETE', '/images/' + self.__quote(image), params)
+
+    async def remove_network(self, network):
+        """
+        Removes a network.
+        :param network: The id or name of the network.
+        :return: None
+        """
+        await self.__request('remove_network', 'DELETE', '/networks/' + self.__quote(network))
+
+    async def pull(self, repository, tag=None, on_event=None):
+        """
+        Pulls an image, authenticating with the credentials Docker stores for its registry.
+        :param repository: The repository, optionally with the tag, e.g. "redis:4".
+        :param tag: The tag. Default is the tag in the repository, or latest.
+        :param on_event: Called with every decoded progress event as it arrives. May be a coroutine function.
+        :return: None
+        """
+        if not tag:
+            repository, tag = utils.parse_repository_tag(repository)
+        params = {'fromImage': repository, 'tag': tag or 'latest'}
+        await self.__request('pull', 'POST', '/images/create', params, self.__get_auth_headers(repository),
+                             self.__decode_events(on_event))
+
+    async def push(self, repository, tag=None, on_event=None):
+        """
+        Pushes an image, authenticating with the credentials Docker stores for its registry.
+        :param repository: The repository, optionally with the tag.
+        :param tag: The tag. Default is the tag in the repository, or latest.
+        :param on_event: Called with every decoded progress event as it arrives. May be a coroutine function.
+        :return: None
+        """
+        if not tag:
+            repository, tag = utils.parse_repository_tag(repository)
+        params = {'tag': tag or 'latest'}
+        await self.__request('push', 'POST', '/images/' + self.__quote(repository) + '/push', params,
+                             self.__get_auth_headers(repository), self.__decode_events(on_event))
+
+    def __decode_events(self, on_event):
+        """
+        Creates a handler of response chunks which decodes them into events.
+        :param on_event: Called with every event. May be a coroutine function. None ignores the events.
+        :return: A coroutine function taking a chunk, or None at the end of the response.
+        """
+        decoder = JsonStreamDecoder()
+
+        async def on_data(data):
+            if data is None:
+                decoder.close()
+                return
+            for event in decoder.feed(data):
+                result = None if on_event is None else on_event(event)
+                if asyncio.iscoroutine(result):
+                    await result
+
+        return on_data
+
+    def __get_auth_headers(self, repository):
+        """
+        Gets the headers authenticating with the registry of a repository, the same way docker.APIClient does.
+        :param repository: The repository.
+        :return: A dictionary of headers. Empty if Docker has no credentials for the registry.
+        """
+        if self.__auth_configs is None:
+            self.__auth_configs = auth.load_config()
+        registry, _ = auth.resolve_repository_name(repository)
+        auth_config = auth.resolve_authconfig(self.__auth_configs, registry)
+        if not auth_config:
+            return {}
+        header = auth.encode_header(auth_config)
+        return {'X-Registry-Auth': header.decode('ascii') if isinstance(header, bytes) else header}
+
+    async def __request(self, name, method, path, params=None, headers=None, on_data=None):
+        """
+        Sends a request to the Engine on a connection from the pool, and reads the response.
+        :param name: The name of the operation, for tracing.
+        :param method: The HTTP method.
+        :param path: The path, without the API version.
+        :param params: A dictionary of query parameters.
+        :param headers: A dictionary of extra headers.
+        :param on_data: If given, a coroutine function called with every chunk of the response body as it arrives,
+                        then with None. Otherwise the body is returned.
+        :return: A tuple of (the status code, the body, or None if on_data is given).
+        """
+        url = '/v' + self.api_version + path + ('?' + urlencode(params) if params else '')
+        lines = [method + ' ' + url + ' HTTP/1.1', 'Host: docker', 'Content-Length: 0']
+        lines.extend(key + ': ' + value for key, value in (headers or {}).items())
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        async with self.__connections:
+            count('docker.api_calls')
+            with span('docker.' + name, 'docker', path=path):
+                return await self.__exchange(request, on_data)
+
+    async def __exchange(self, request, on_data):
+        """
+        Sends a request and reads its response. A request sent on an idle connection which the Engine closed
+        meanwhile is sent again on a new connection.
+        :param request: The request, as bytes.
+        :param on_data: See __request.
+        :return: See __request.
+        """
+        while True:
+            reused = len(self.__idle_connections) > 0
+            reader, writer = self.__idle_connections.pop() if reused else await asyncio.open_unix_connection(
+                self.socket_path, limit=self.read_size)
+            reusable = False
+            try:
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    status_line = await reader.readline()
+                except ConnectionError:
+                    if not reused:
+                        raise
+                    status_line = b''
+                if status_line == b'' and reused:
+                    continue
+                status, response_headers = await self.__read_head(reader, status_line)
+                if status >= 400:
+                    body = []
+                    reusable = await self.__read_body(reader, status, response_headers, self.__collect(body))
+                    self.__raise_for_status(status, b''.join(body))
+                if on_data is None:
+                    body = []
+                    reusable = await self.__read_body(reader, status, response_headers, self.__collect(body))
+                    return status, b''.join(body)
+                reusable = await self.__read_body(reader, status, response_headers, on_data)
+                await on_data(None)
+                return status, None
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                raise Exception('Lost the connection to the Docker Engine: ' + str(e))
+            finally:
+                if reusable:
+                    self.__idle_connections.append((reader, writer))
+                else:
+                    writer.close()
+
+    async def __read_head(self, reader, status_line):
+        """
+        Reads the status and the headers of a response.
+        :param reader: The connection's reader.
+        :param status_line: The status line, read already.
+        :return: A tuple of (the status code, a dictionary of headers with lower case names).
+        """
+        parts = status_line.decode('latin-1').split(' ', 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise Exception('Unexpected response from the Docker Engine: ' + status_line.decode('latin-1'))
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if parts[0] == 'HTTP/1.0' and headers.get('connection', '').lower() != 'keep-alive':
+            headers['connection'] = 'close'
+        return int(parts[1]), headers
+
+    async def __read_body(self, reader, status, headers, on_data):
+        """
+        Reads the body of a response, a chunk at a time.
+        :param reader: The connection's reader.
+        :param status: The status code.
+        :param headers: The headers.
+        :param on_data: A coroutine function called with every chunk.
+        :return: True if the connection can be reused for another request.
+        """
+        reusable = headers.get('connection', '').lower() != 'close'
+        if status in (204, 304) or 100 <= status < 200:
+            return reusable
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Skip the trailers.
+                    while (await reader.readline()).strip() != b'':
+                        pass
+                    return reusable
+                while size > 0:
+                    data = await reader.readexactly(min(size, self.read_size))
+                    size -= len(data)
+                    await on_data(data)
+                await reader.readexactly(2)
+
+        if 'content-length' in headers:
+            remaining = int(headers['content-length'])
+            while remaining > 0:
+                data = await reader.readexactly(min(remaining, self.read_size))
+                remaining -= len(data)
+                await on_data(data)
+            return reusable
+
+        # Without a length, the body ends when the Engine closes the connection.
+        while True:
+            data = await reader.read(self.read_size)
+            if data == b'':
+                return False
+            await on_data(data)
+
+    @staticmethod
+    def __collect(chunks):
+        """
+        Creates a handler of response chunks which collects them.
+        :param chunks: The list to add the chunks to.
+        :return: A coroutine function taking a chunk.
+        """
+
+        async def on_data(data):
+            chunks.append(data)
+
+        return on_data
+
+    @staticmethod
+    def __raise_for_status(status, body):
+        """
+        Raises the docker.errors exception docker.APIClient would raise for an error response.
+        :param status: The status code.
+        :param body: The body of the response.
+        :return: None
+        """
+        message = body.decode('utf-8', 'replace').strip()
+        try:
+            message = json.loads(message).get('message', message)
+        except (ValueError, AttributeError):
+            pass
+        message = str(status) + ' ' + ('Client' if status < 500 else 'Server') + ' Error: ' + message
+        if status == 404:
+            raise errors.NotFound(message)
+        raise errors.APIError(message)
+
+    @staticmethod
+    def __quote(name):
+        return quote(name, safe='/:')
+
+    @staticmethod
+    def __flag(value):
+        return '1' if value else '0'
+
+
+def run_on_engine(operation, items, jobs=DEFAULT_JOBS, socket_path=DOCKER_SOCKET):
+    """
+    Runs an operation for every item on an AsyncEngineClient, up to jobs operations at a time, in a new event loop.
+    The operations are coroutines rather than threads, so hundreds of them at a time stay cheap.
+    :param operation: A coroutine function taking the AsyncEngineClient and an item.
+    :param items: The items.
+    :param jobs: The number of operations to run at once, which is also the number of connections to the Engine.
+    :param socket_path: The Unix socket of the Docker Engine.
+    :return: A list of (item, error) tuples for the operations which failed.
+    """
+
+    async def run_all():
+        engine = AsyncEngineClient(socket_path, connections=jobs)
+        slots = asyncio.Semaphore(max(1, jobs))
+
+        async def run(item):
+            async with slots:
+                try:
+                    await operation(engine, item)
+                except Exception as e:
+                    return item, e
+            return None
+
+        try:
+            results = await asyncio.gather(*[run(item) for item in items])
+        finally:
+            engine.close()
+        return [result for result in results if result is not None]
+
+    if len(items) == 0:
+        return []
+    loop = asyncio.new_event_loop()
+    try:
+        # Before Python 3.10, asyncio primitives use the current event loop when they are created.
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(run_all())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -0,0 +1,178 @@
+import collections
+import sys
+import threading
+import time
+
+from .util import format_bytes, print_table
+
+
+class ProgressAggregator(object):
+    """
+    Aggregates the output of several concurrent Docker pushes or pulls into a single progress display,
+    and keeps a summary (bytes transferred, duration, errors) per image.
+    Progress is tracked per layer, so a layer shared by several images is only counted once in the totals.
+    Docker itself makes sure a layer shared by concurrent pushes or pulls is only transferred once.
+    """
+
+    # Layer statuses in Docker push and pull output which mean the layer does not need to be transferred (again).
+    __finished_statuses = ('Pushed', 'Layer already exists', 'Mounted from', 'Pull complete', 'Already exists',
+                           'Download complete')
+
+    # Layer statuses in Docker push and pull output which report the layer's transfer progress.
+    __transfer_statuses = ('Pushing', 'Downloading')
+
+    # The number of seconds over which the transfer rate is measured.
+    __rate_window = 2.0
+
+    def __init__(self, action, output=None, interval=0.5):
+        """
+        :param action: What is being done to the images, e.g. 'Pushing'.
+        :param output: The stream to print progress to. Default is stdout.
+        :param interval: The minimum number of seconds between two updates of the progress display.
+        """
+        output = sys.stdout if output is None else output
+        self.action = action
+        self.output = output
+        self.interval = interval
+        self.is_terminal = hasattr(output, 'isatty') and output.isatty()
+        self.images = {}
+        self.layers = {}
+        self.__lock = threading.Lock()
+        self.__last_display = 0
+        self.__transferred = 0
+        self.__samples = collections.deque([(time.time(), 0)])
+
+    def add(self, image):
+        """
+        Registers an image, so it is included in the progress display and the summary.
+        :param image: The name of the image.
+        :return: None
+        """
+        with self.__lock:
+            self.images[image] = {'bytes': 0, 'layers': {}, 'start': None, 'end': None, 'error': None}
+
+    def start(self, image):
+        """
+        Marks the push or pull of an image as started.
+        :param image: The name of the image.
+        :return: None
+        """
+        self.images[image]['start'] = time.time()
+
+    def update(self, image, event):
+        """
+        Updates the progress of an image with an event from the output of its push or pull.
+        :param image: The name of the image.
+        :param event: The decoded event.
+        :return: None
+        """
+        if 'error' in event:
+            raise Exception(event['error'])
+        self.__update(image, event)
+
+    def finish(self, image):
+        """
+        Marks the push or pull of an image as done.
+        :param image: The name of the image.
+        :return: None
+        """
+        self.images[image]['end'] = time.time()
+        self.__display()
+
+    def fail(self, image, error):
+        """
+        Marks an image as failed.
+        :param image: The name of the image.
+        :param error: The error.
+        :return: None
+        """
+        result = self.images[image]
+        if result['start'] is None:
+            result['start'] = time.time()
+        result['end'] = time.time()
+        result['error'] = str(error)
+        self.__display()
+
+    def __update(self, image, event):
+        """
+        Updates the progress of an image and its layers with an event from a push or pull output stream.
+        :param image: The name of the image.
+        :param event: The decoded event.
+        :return: None
+        """
+        layer_id = event.get('id')
+        status = event.get('status', '')
+        if layer_id is None or status.startswith('Pulling from'):
+            return
+
+        with self.__lock:
+            layer = self.layers.setdefault(layer_id, {'current': 0, 'total': 0, 'finished': False})
+            image_layers = self.images[image]['layers']
+            detail = event.get('progressDetail') or {}
+            if status.startswith(self.__transfer_statuses) and 'current' in detail:
+                self.__add_transferred(detail['current'] - layer['current'])
+                layer['current'] = max(layer['current'], detail['current'])
+                layer['total'] = max(layer['total'], detail.get('total') or 0)
+                image_layers[layer_id] = max(image_layers.get(layer_id, 0), detail['current'])
+                self.images[image]['bytes'] = sum(image_layers.values())
+            elif status.startswith(self.__finished_statuses):
+                layer['finished'] = True
+                layer['current'] = max(layer['current'], layer['total'])
+        self.__display()
+
+    def get_transfer_rate(self):
+        """
+        Gets the rate at which all images together have been transferring over the last few seconds.
+        :return: The rate, in bytes per second.
+        """
+        with self.__lock:
+            self.__add_transferred(0)
+            start, transferred = self.__samples[0]
+            return (self.__transferred - transferred) / max(time.time() - start, self.__rate_window / 2)
+
+    def __add_transferred(self, size):
+        """
+        Records bytes transferred, for measuring the transfer rate. Must be called with the lock held.
+        :param size: The number of bytes. Nothing is recorded if it is not positive.
+        :return: None
+        """
+        now = time.time()
+        self.__transferred += max(size, 0)
+        self.__samples.append((now, self.__transferred))
+        while len(self.__samples) > 1 and self.__samples[1][0] < now - self.__rate_window:
+            self.__samples.popleft()
+
+    def __display(self):
+        """
+        Prints the aggregated progress, at most once per interval, if the output is a terminal.
+        :return: None
+        """
+        if not self.is_terminal or time.time() - self.__last_display < self.interval:
+            return
+        self.__last_display = time.time()
+        with self.__lock:
+            images_done = len([result for result in self.images.values() if result['end'] is not None])
+            layers_done = len([layer for layer in self.layers.values() if layer['finished']])
+            current = sum(layer['current'] for layer in self.layers.values())
+            total = sum(layer['total'] for layer in self.layers.values())
+        self.output.write('\r\033[K' + self.action + ' ' + str(images_done) + '/' + str(len(self.images)) +
+                          ' images, ' + str(layers_done) + '/' + str(len(self.layers)) + ' layers, ' +
+                          format_bytes(current) + ' / ' + format_bytes(total))
+        self.output.flush()
+
+    def print_summary(self):
+        """
+        Prints a summary of every image: the bytes transferred, the duration and the error, if any.
+        :return: The number of images which failed.
+        """
+        if self.is_terminal:
+            self.output.write('\r\033[K')
+        rows = [('IMAGE', 'BYTES', 'DURATION', 'RESULT')]
+        for image in sorted(self.images):
+            result = self.images[image]
+            duration = '-' if result['start'] is None else '%.1fs' % ((result['end'] or time.time()) - result['start'])
+            rows.append((image, format_bytes(result['bytes']), duration,
+                         'done' if result['error'] is None else 'failed: ' + result['error']))
+        print_table(rows, self.output)
+        return len([result for result in self.images.values() if result['error'] is not None])
+
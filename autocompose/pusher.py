@@ -1,13 +1,20 @@
+from docker import errors
+
 from .authenticator import get_authorization_data
+from .composer import get_scenario_services
+from .constants import *
+from .engine import run_on_engine
+from .progress import ProgressAggregator
 from .util import *
 
 
-def tag_to_ecr(aws_session, docker_client, tag):
-    if tag is None or tag is '':
+def tag_to_ecr(aws_session, docker_client, tag, service_name=None):
+    if tag is None or tag == '':
         tag = 'latest'
 
-    service_name = get_service_name()
-    repo = __get_docker_repository_name(aws_session, service_name)
+    if service_name is None:
+        service_name = get_service_name()
+    repo = get_docker_repository_name(aws_session, service_name)
     full_tag = service_name + ':' + tag
     image = __get_docker_image(docker_client, full_tag)
 
@@ -36,7 +43,7 @@ def push_to_ecs(aws_session, docker_client, image_name=None, tag=None):
     if tag is None:
         tag = 'latest'
 
-    repo = __get_docker_repository_name(aws_session, image_name)
+    repo = get_docker_repository_name(aws_session, image_name)
     full_tag = image_name + ':' + tag
     image = __get_docker_image(docker_client, full_tag)
 
@@ -55,16 +62,122 @@ def push_to_ecs(aws_session, docker_client, image_name=None, tag=None):
     print('The image "' + full_tag + '" has now been pushed up to "' + repo + '".')
 
 
-def __get_docker_image(docker_client, repo_tag):
-    images = docker_client.images()
-    for image in images:
-        tags = image['RepoTags']
-        if tags is not None and repo_tag in tags:
+def push_images(aws_session, docker_client, images=None, scenario=None, image_name=None, tag=None,
+                jobs=DEFAULT_JOBS, **kwargs):
+    """
+    Pushes several Docker images up to AWS's ECR concurrently, showing their aggregated progress and a summary.
+    If neither images nor a scenario are given, the image represented by the current directory is pushed.
+    :param aws_session: The AWS session.
+    :param docker_client: The Docker client
+    :param images: A list of images to push, as "name" or "name:tag".
+    :param scenario: A scenario whose services' images to push, each with the version given in the scenario.
+    :param image_name: The name of the image to push, if neither images nor a scenario are given.
+    :param tag: The tag to push for images without a tag of their own. Default is latest.
+    :param jobs: The number of images to push concurrently.
+    :return: None
+    """
+
+    if not images and scenario is None:
+        return push_to_ecs(aws_session, docker_client, image_name=image_name, tag=tag)
+
+    if tag is None:
+        tag = 'latest'
+
+    image_tags = []
+    for image in images or []:
+        name, _, image_tag = image.partition(':')
+        image_tags.append((name, image_tag or tag))
+    if scenario is not None:
+        image_tags.extend(get_scenario_services(scenario))
+    image_tags = list(unique(image_tags))
+
+    progress = ProgressAggregator('Pushing')
+    for name, image_tag in image_tags:
+        progress.add(name + ':' + image_tag)
+
+    # Look up the images and their ECR repositories up front, so the event loop only talks to the Docker Engine.
+    image_index = get_image_index(docker_client)
+    pushes = []
+    for name, image_tag in image_tags:
+        try:
+            image = __get_docker_image(docker_client, name + ':' + image_tag, image_index)
+            pushes.append((name, image_tag, image['Id'], get_docker_repository_name(aws_session, name)))
+        except Exception as e:
+            progress.fail(name + ':' + image_tag, e)
+
+    print('Pushing ' + str(len(pushes)) + ' images up to ECR...')
+    for (name, image_tag, _, _), error in run_on_engine(
+            lambda engine, push: __push_image(engine, push[0], push[1], push[2], push[3], progress), pushes, jobs):
+        progress.fail(name + ':' + image_tag, error)
+
+    failures = progress.print_summary()
+    if failures > 0:
+        raise Exception(str(failures) + ' of ' + str(len(image_tags)) + ' images could not be pushed to ECR.')
+
+
+async def __push_image(engine, image_name, tag, image_id, repo, progress):
+    """
+    Tags an image with its ECR repository and pushes it, reporting its progress to a ProgressAggregator.
+    :param engine: The AsyncEngineClient.
+    :param image_name: The name of the image.
+    :param tag: The tag of the image.
+    :param image_id: The id of the local image.
+    :param repo: The ECR repository to push to, see get_docker_repository_name.
+    :param progress: The ProgressAggregator.
+    :return: None
+    """
+    full_tag = image_name + ':' + tag
+    await engine.tag(image_id, repository=repo, tag=tag)
+    progress.start(full_tag)
+    await engine.push(repo, tag, on_event=lambda event: progress.update(full_tag, event))
+    progress.finish(full_tag)
+
+
+def get_image_index(docker_client):
+    """
+    Lists the local images once, for looking up many images by tag.
+    :param docker_client: The Docker client
+    :return: A dictionary of tags ("repository:tag") to images.
+    """
+    image_index = {}
+    for image in docker_client.images():
+        for tag in image['RepoTags'] or []:
+            image_index[tag] = image
+    return image_index
+
+
+def __get_docker_image(docker_client, repo_tag, image_index=None):
+    """
+    Finds a local image by tag.
+    Without an image index, the image is inspected directly, falling back to listing the images of its repository.
+    :param docker_client: The Docker client
+    :param repo_tag: The tag of the image, as "repository:tag".
+    :param image_index: The local images, see get_image_index.
+    :return: The image.
+    """
+    if image_index is not None:
+        if repo_tag in image_index:
+            return image_index[repo_tag]
+        raise Exception('Could not find image "' + repo_tag + '"')
+
+    try:
+        return docker_client.inspect_image(repo_tag)
+    except errors.APIError:
+        pass
+
+    for image in docker_client.images(name=repo_tag.rpartition(':')[0]):
+        if repo_tag in (image['RepoTags'] or []):
             return image
 
-    raise Exception('Could not find image')
+    raise Exception('Could not find image "' + repo_tag + '"')
 
 
-def __get_docker_repository_name(aws_session, service_name):
+def get_docker_repository_name(aws_session, service_name):
+    """
+    Gets the ECR repository of a service.
+    :param aws_session: The AWS session.
+    :param service_name: The name of the service.
+    :return: The repository, as "registry/service_name".
+    """
     url = get_authorization_data(aws_session)['proxyEndpoint']
     return url.replace('https://', '') + '/' + service_name
@@ -0,0 +1,273 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Whether spans and counters are recorded. Tracing is off unless enable_tracing is called, and then costs one check
+# per traced call.
+__enabled = False
+
+# The time tracing was enabled, which trace events are relative to.
+__start_time = 0
+
+# Finished spans, as (name, category, thread id, start time, duration, attributes) tuples.
+__spans = []
+
+# Counter values, keyed by name.
+__counters = {}
+
+# Guards the counters.
+__lock = threading.Lock()
+
+
+class Span(object):
+    """
+    Times a stage of work, e.g. parsing a YAML file. Use as a context manager, see span.
+    """
+
+    def __init__(self, name, category, attributes, spans):
+        """
+        :param name: The name of the span.
+        :param category: The category of the span.
+        :param attributes: Details of the span.
+        :param spans: The list to add the span to when it finishes.
+        """
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+        self.start = None
+        self.__spans = spans
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.time() - self.start
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.__spans.append((self.name, self.category, threading.get_ident(), self.start, duration, self.attributes))
+        return False
+
+
+class NullSpan(object):
+    """
+    The span used while tracing is off, which records nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+__null_span = NullSpan()
+
+
+class TracedClient(object):
+    """
+    Wraps an API client (e.g. a docker.APIClient or a boto3 ECR client) so that every method call is recorded as a
+    span named after the method, and counted. Calls returning streams are only timed until the stream is returned.
+    """
+
+    def __init__(self, client, category):
+        """
+        :param client: The client.
+        :param category: The category of the spans and the prefix of their names, e.g. 'docker'.
+        """
+        self.__client = client
+        self.__category = category
+
+    def __getattr__(self, name):
+        attribute = getattr(self.__client, name)
+        if not callable(attribute) or name.startswith('_'):
+            return attribute
+        return traced(self.__category + '.' + name, self.__category, counter=self.__category + '.api_calls')(attribute)
+
+
+def enable_tracing():
+    """
+    Starts recording spans and counters, discarding any recorded before.
+    :return: None
+    """
+    global __enabled, __start_time
+    with __lock:
+        __spans.clear()
+        __counters.clear()
+        __start_time = time.time()
+        __enabled = True
+
+
+def is_tracing_enabled():
+    return __enabled
+
+
+def span(name, category='autocompose', **attributes):
+    """
+    Records how long a block of code takes:
+
+        with span('yaml.parse', 'yaml', file=file_name):
+            ...
+
+    :param name: The name of the span, e.g. 'get_config'. Spans with the same name are summed up in the timings.
+    :param category: The category of the span, e.g. 'yaml'.
+    :param attributes: Details of this particular span, e.g. the file parsed. Only written to traces.
+    :return: A context manager.
+    """
+    if not __enabled:
+        return __null_span
+    return Span(name, category, attributes, __spans)
+
+
+def traced(name, category='autocompose', counter=None):
+    """
+    Decorates a function so that every call is recorded as a span.
+    :param name: The name of the span.
+    :param category: The category of the span.
+    :param counter: If given, the name of a counter to increment on every call.
+    :return: The decorator.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not __enabled:
+                return function(*args, **kwargs)
+            if counter is not None:
+                count(counter)
+            with Span(name, category, {}, __spans):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, value=1):
+    """
+    Increments a counter, e.g. the number of files read or bytes parsed.
+    :param name: The name of the counter, e.g. 'yaml.files_read'.
+    :param value: The value to add.
+    :return: None
+    """
+    if not __enabled:
+        return
+    with __lock:
+        __counters[name] = __counters.get(name, 0) + value
+
+
+def get_span_totals():
+    """
+    Gets the totals of the recorded spans, by name.
+    Nested spans and spans in concurrent threads each count fully, so totals can add up to more than the run time.
+    :return: A dictionary of span names to dictionaries of their 'calls', 'total', 'max' and 'category'.
+    """
+    totals = {}
+    for name, category, _, _, duration, _ in list(__spans):
+        entry = totals.setdefault(name, {'calls': 0, 'total': 0.0, 'max': 0.0, 'category': category})
+        entry['calls'] += 1
+        entry['total'] += duration
+        entry['max'] = max(entry['max'], duration)
+    return totals
+
+
+def get_counters():
+    """
+    Gets the values of the counters.
+    :return: A dictionary of counter names to values.
+    """
+    with __lock:
+        return dict(__counters)
+
+
+def print_timings(output=None):
+    """
+    Prints the totals of the recorded spans, slowest first, and the counters.
+    :param output: The stream to print to. Default is stderr, so that the output of commands such as compose is not
+                   mixed with the timings.
+    :return: None
+    """
+    from .util import print_table
+
+    output = sys.stderr if output is None else output
+    rows = [('SPAN', 'CALLS', 'TOTAL', 'MEAN', 'MAX')]
+    for name, entry in sorted(get_span_totals().items(), key=lambda item: -item[1]['total']):
+        rows.append((name, str(entry['calls']), '%.1fms' % (entry['total'] * 1000),
+                     '%.2fms' % (entry['total'] * 1000 / entry['calls']), '%.1fms' % (entry['max'] * 1000)))
+    print_table(rows, output)
+
+    counters = get_counters()
+    if len(counters) > 0:
+        output.write('\n')
+        print_table([('COUNTER', 'VALUE')] + [(name, str(counters[name])) for name in sorted(counters)], output)
+
+
+def write_trace(file_name):
+    """
+    Writes the recorded spans in the Chrome trace event format, which chrome://tracing and Perfetto can open.
+    The counters are written under "otherData".
+    :param file_name: The file to write.
+    :return: None
+    """
+    pid = os.getpid()
+    thread_ids = {}
+    events = []
+    for name, category, thread, start, duration, attributes in list(__spans):
+        if thread not in thread_ids:
+            thread_ids[thread] = len(thread_ids) + 1
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_ids[thread],
+                           'args': {'name': 'main' if thread == threading.main_thread().ident
+                                    else 'worker-' + str(thread_ids[thread])}})
+        events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': thread_ids[thread],
+                       'ts': round((start - __start_time) * 1000000, 3), 'dur': round(duration * 1000000, 3),
+                       'args': {key: str(value) for key, value in attributes.items()}})
+
+    with open(file_name, 'w') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'counters': get_counters()}}, file)
+
+
+def write_metrics(file_name, command):
+    """
+    Writes the span totals and the counters in the Prometheus text format, e.g. for the node exporter's textfile
+    collector. The file is replaced atomically, so the collector never reads a partial file.
+    :param file_name: The file to write, which should end in ".prom" for the textfile collector.
+    :param command: The autocompose command which ran, added as a label to every metric.
+    :return: None
+    """
+    from .util import write_file_atomically
+
+    command_label = 'command="' + __escape_label_value(command) + '"'
+    lines = ['# HELP autocompose_span_seconds Seconds spent in a span during the last run.',
+             '# TYPE autocompose_span_seconds gauge']
+    totals = get_span_totals()
+    for name in sorted(totals):
+        lines.append('autocompose_span_seconds{' + command_label + ',span="' + __escape_label_value(name) + '"} ' +
+                     repr(totals[name]['total']))
+    lines += ['# HELP autocompose_span_calls Number of spans recorded during the last run.',
+              '# TYPE autocompose_span_calls gauge']
+    for name in sorted(totals):
+        lines.append('autocompose_span_calls{' + command_label + ',span="' + __escape_label_value(name) + '"} ' +
+                     str(totals[name]['calls']))
+    lines += ['# HELP autocompose_counter Value of a counter during the last run.',
+              '# TYPE autocompose_counter gauge']
+    counters = get_counters()
+    for name in sorted(counters):
+        lines.append('autocompose_counter{' + command_label + ',counter="' + __escape_label_value(name) + '"} ' +
+                     str(counters[name]))
+    lines += ['# HELP autocompose_last_run_timestamp_seconds Time the last run started.',
+              '# TYPE autocompose_last_run_timestamp_seconds gauge',
+              'autocompose_last_run_timestamp_seconds{' + command_label + '} ' + repr(__start_time)]
+
+    write_file_atomically(file_name, '\n'.join(lines) + '\n')
+
+
+def __escape_label_value(value):
+    """
+    Escapes a Prometheus label value.
+    :param value: The value.
+    :return: The escaped value, without the surrounding quotes.
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
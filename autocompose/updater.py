@@ -1,21 +1,212 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from docker import errors
+
 from .authenticator import get_authorization_data
-from .util import print_docker_output
+from .composer import build_compose_file
+from .constants import *
+from .engine import run_on_engine
+from .progress import ProgressAggregator
+from .util import parse_size, unique
+
+# The maximum number of image ids ECR accepts in a single batch_get_image request.
+__ecr_batch_size = 100
 
 
-def update_images(aws_session, docker_client, **kwargs):
+def update_images(aws_session, docker_client, jobs=DEFAULT_JOBS, **kwargs):
     """
     Updates any Docker images from ECR.
-    :param aws_session:
-    :param docker_client:
+    Only tags whose digest in ECR differs from the local image's digest are pulled.
+    :param aws_session: The AWS session.
+    :param docker_client: The Docker client.
+    :param jobs: The number of ECR requests and pulls to run concurrently.
     :param kwargs:
     :return:
     """
     print('Updating ECR Docker images...')
     authorization_data = get_authorization_data(aws_session)
-    repo_tag = authorization_data['proxyEndpoint'].replace('https://', '')
-    for image in docker_client.images(all=True):
-        if image['RepoTags'] is not None:
-            for tag in image['RepoTags']:
-                if tag.startswith(repo_tag):
-                    print_docker_output(docker_client.pull(tag, stream=True))
+    registry = authorization_data['proxyEndpoint'].replace('https://', '')
+
+    local_digests = get_local_digests(docker_client, registry)
+    if len(local_digests) == 0:
+        print('There are no ECR images to update.')
+        return
+
+    print('Comparing ' + str(len(local_digests)) + ' ECR images with their digests in ECR...')
+    remote_digests = get_remote_digests(aws_session, registry, list(local_digests), jobs)
+
+    stale_tags = []
+    for tag in sorted(local_digests):
+        if tag not in remote_digests:
+            print(' - "' + tag + '" no longer exists in ECR.')
+        elif remote_digests[tag] not in local_digests[tag]:
+            stale_tags.append(tag)
+
+    if len(stale_tags) == 0:
+        print('All ECR images are up to date.')
+        return
+
+    pull_images(stale_tags, jobs)
+    print('Done.')
+
+
+def prefetch_images(aws_session, docker_client, scenarios, jobs=DEFAULT_JOBS, limit_rate=None, **kwargs):
+    """
+    Pulls the images of the services of some scenarios concurrently, so that docker-compose does not have to pull them
+    one by one when it starts them.
+    ECR images are only pulled if their digest in ECR differs from the local image's, and other images are only
+    pulled if they do not exist locally. Layers shared between images are only downloaded once by Docker.
+    :param aws_session: The AWS session.
+    :param docker_client: The Docker client.
+    :param scenarios: The scenarios and/or services.
+    :param jobs: The number of ECR requests and pulls to run concurrently.
+    :param limit_rate: If given, new pulls are only started while the images download slower than this, e.g. '20MB'
+                       (per second).
+    :return: None
+    """
+    docker_compose_config = build_compose_file(aws_session, scenarios, use_cache=True, jobs=jobs)
+    images = list(unique(__get_image_tag(service['image'])
+                         for service in (docker_compose_config.get('services') or {}).values()
+                         if isinstance(service, dict) and 'image' in service))
+    print('The scenarios use ' + str(len(images)) + ' images.')
+
+    registry = get_authorization_data(aws_session)['proxyEndpoint'].replace('https://', '')
+    ecr_tags = [image for image in images if image.startswith(registry + '/') and '@' not in image]
+    local_digests = get_local_digests(docker_client, registry)
+    remote_digests = get_remote_digests(aws_session, registry, ecr_tags, jobs) if ecr_tags else {}
+
+    stale_tags = []
+    for image in images:
+        if image in ecr_tags:
+            if image not in remote_digests:
+                print(' - "' + image + '" does not exist in ECR.')
+            elif remote_digests[image] not in local_digests.get(image, set()):
+                stale_tags.append(image)
+        elif not __exists_locally(docker_client, image):
+            stale_tags.append(image)
+
+    if len(stale_tags) == 0:
+        print('All images are up to date.')
+        return
+
+    pull_images(stale_tags, jobs, limit_rate=None if limit_rate is None else parse_size(limit_rate))
     print('Done.')
+
+
+def __get_image_tag(image):
+    """
+    Gets the tag to pull for an image of a docker-compose service, which defaults to latest like docker-compose does.
+    :param image: The image, e.g. "redis" or "redis:4".
+    :return: The tag, e.g. "redis:latest" or "redis:4".
+    """
+    if '@' in image or ':' in image.rpartition('/')[2]:
+        return image
+    return image + ':latest'
+
+
+def __exists_locally(docker_client, image):
+    """
+    Checks whether an image exists locally.
+    :param docker_client: The Docker client.
+    :param image: The image.
+    :return: True if it exists.
+    """
+    try:
+        docker_client.inspect_image(image)
+        return True
+    except errors.NotFound:
+        return False
+
+
+def get_local_digests(docker_client, registry):
+    """
+    Gets the digests of the local images which are tagged with a repository of the given registry.
+    :param docker_client: The Docker client.
+    :param registry: The registry, e.g. "123456789012.dkr.ecr.us-east-1.amazonaws.com".
+    :return: A dictionary of tags ("registry/repository:tag") to the set of digests the local image is known by.
+    """
+    local_digests = {}
+    for image in docker_client.images():
+        digests = set(repo_digest.partition('@')[2] for repo_digest in image.get('RepoDigests') or [])
+        for tag in image.get('RepoTags') or []:
+            if tag.startswith(registry + '/'):
+                local_digests[tag] = digests
+    return local_digests
+
+
+def get_remote_digests(aws_session, registry, tags, jobs=DEFAULT_JOBS):
+    """
+    Gets the digests of tags in ECR, with one batch request per repository.
+    :param aws_session: The AWS session.
+    :param registry: The registry, e.g. "123456789012.dkr.ecr.us-east-1.amazonaws.com".
+    :param tags: A list of tags, as "registry/repository:tag".
+    :param jobs: The number of requests to run concurrently.
+    :return: A dictionary of tags to digests. Tags which do not exist in ECR are left out.
+    """
+    from botocore.exceptions import ClientError
+
+    repositories = {}
+    for tag in tags:
+        repository, _, image_tag = tag[len(registry) + 1:].rpartition(':')
+        repositories.setdefault(repository, []).append(image_tag)
+
+    ecr_client = aws_session.client('ecr')
+    registry_id = registry.split('.')[0]
+
+    def get_repository_digests(repository):
+        image_tags = repositories[repository]
+        digests = {}
+        for start in range(0, len(image_tags), __ecr_batch_size):
+            try:
+                response = ecr_client.batch_get_image(
+                    registryId=registry_id,
+                    repositoryName=repository,
+                    imageIds=[{'imageTag': image_tag} for image_tag in image_tags[start:start + __ecr_batch_size]])
+            except ClientError as e:
+                # A repository deleted from ECR, whose images are still tagged locally: its tags do not exist.
+                if e.response.get('Error', {}).get('Code') == 'RepositoryNotFoundException':
+                    return {}
+                raise
+            for image in response.get('images', []):
+                image_id = image['imageId']
+                digests[registry + '/' + repository + ':' + image_id['imageTag']] = image_id['imageDigest']
+        return digests
+
+    remote_digests = {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for digests in executor.map(get_repository_digests, sorted(repositories)):
+            remote_digests.update(digests)
+    return remote_digests
+
+
+def pull_images(tags, jobs=DEFAULT_JOBS, progress=None, limit_rate=None):
+    """
+    Pulls Docker images concurrently on the asyncio Docker Engine client, showing their aggregated progress and a
+    summary.
+    :param tags: A list of tags to pull, as "repository:tag".
+    :param jobs: The number of images to pull concurrently.
+    :param progress: The ProgressAggregator to report to. A new one is used by default.
+    :param limit_rate: If given, new pulls are only started while the images download slower than this many bytes
+                       per second. Docker cannot slow down pulls which already started, so this is a soft limit.
+    :return: None
+    """
+    if progress is None:
+        progress = ProgressAggregator('Pulling')
+    for tag in tags:
+        progress.add(tag)
+
+    async def pull(engine, tag):
+        while limit_rate is not None and progress.get_transfer_rate() > limit_rate:
+            await asyncio.sleep(0.2)
+        progress.start(tag)
+        await engine.pull(tag, on_event=lambda event: progress.update(tag, event))
+        progress.finish(tag)
+
+    print('Pulling ' + str(len(tags)) + ' images...')
+    for tag, error in run_on_engine(pull, tags, jobs):
+        progress.fail(tag, error)
+
+    failures = progress.print_summary()
+    if failures > 0:
+        raise Exception(str(failures) + ' of ' + str(len(tags)) + ' images could not be pulled.')
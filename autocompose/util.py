@@ -1,12 +1,42 @@
+import contextlib
+import filecmp
+import hashlib
 import os
 import re
 import sys
+import threading
 
 import yaml
-from compose import progress_stream
+
+from .tracing import count, span, traced
+
+# Prefer the libyaml parser, which is much faster than the pure-Python one.
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 
 __autocompose_service_name = None
 
+# Index of the directories in the AUTOCOMPOSE_PATH, keyed by directory.
+# Each entry is a tuple of (modification time, file names in listing order, set of file names).
+# Directories which do not exist are indexed as (None, (), frozenset()).
+__path_index = {}
+
+# Characters which make a file pattern a regular expression rather than a file name.
+# '.' is not included, since file patterns such as 'service.yml' are meant literally.
+__regex_characters = set('^$*+?{}[]\\|()')
+
+# Parsed YAML documents, keyed by file name.
+# Each entry is a tuple of (modification time, size, SHA-256 of the content, document).
+__yaml_cache = {}
+
+# Active input recorders, see record_inputs.
+__input_recorders = []
+
+# Active input recorders of the current thread only, see record_inputs.
+__thread_input_recorders = threading.local()
+
 
 class ExplicitYamlDumper(yaml.SafeDumper):
     """
@@ -17,79 +47,326 @@ class ExplicitYamlDumper(yaml.SafeDumper):
         return True
 
 
+# Prefer the libyaml emitter, which is much faster than the pure-Python one.
+try:
+    class YamlDumper(yaml.CSafeDumper):
+        """
+        A libyaml dumper that will never emit aliases.
+        """
+
+        def ignore_aliases(self, data):
+            return True
+except AttributeError:
+    YamlDumper = ExplicitYamlDumper
+
+
+class HashingWriter(object):
+    """
+    A writable file object which hashes everything written to it, before passing it on to another file object.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.fileobj.write(data)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class TemplateSubstituter(object):
+    """
+    Substitutes template variables in an object, recursively.
+    All terms are compiled into a single regular expression, so each string is rewritten in one pass,
+    however many terms there are. Every occurrence of every term is replaced, and where terms overlap the
+    longest one wins. Replacement values are never substituted again.
+    A string, or any other value, which is exactly equal to a term is replaced by the term's value as is,
+    so non-string values (e.g. a port number) keep their type.
+    """
+
+    def __init__(self, exact_terms, pattern, replace, marker=None):
+        """
+        :param exact_terms: A dictionary of values which are replaced when a value is exactly equal to them.
+        :param pattern: A compiled regular expression which matches terms within strings. None if there are none.
+        :param replace: A function which returns the replacement string for a match of the pattern.
+        :param marker: A substring every match of the pattern contains, used to skip strings quickly.
+        """
+        self.exact_terms = exact_terms
+        self.pattern = pattern
+        self.replace = replace
+        self.marker = marker
+
+    def substitute(self, obj):
+        """
+        Substitutes the terms in obj. Dictionaries and lists are modified in place.
+        :param obj: Any object.
+        :return: the given obj, with any terms replaced.
+        """
+        if isinstance(obj, dict):
+            items = [(self.__substitute_string(key) if isinstance(key, str) else key, self.substitute(value))
+                     for key, value in obj.items()]
+            obj.clear()
+            obj.update(items)
+            return obj
+        elif isinstance(obj, list):
+            obj[:] = [self.substitute(element) for element in obj]
+            return obj
+        elif isinstance(obj, str):
+            if obj in self.exact_terms:
+                return self.exact_terms[obj]
+            return self.__substitute_string(obj)
+        elif obj.__hash__ is not None and obj in self.exact_terms:
+            return self.exact_terms[obj]
+        return obj
+
+    def __substitute_string(self, string):
+        """
+        Replaces every term within a string.
+        :param string: The string.
+        :return: The string with any terms replaced.
+        """
+        if self.pattern is None or (self.marker is not None and self.marker not in string):
+            return string
+        return self.pattern.sub(self.replace, string)
+
+
+def compile_template_variables(variables, resolve_defaults=False):
+    """
+    Compiles template variables into a TemplateSubstituter.
+    Variables are referenced as $NAME or ${NAME}. ${NAME:-default} is replaced by the variable's value if it is
+    defined. A reference to an undefined variable is left for docker-compose to interpolate, unless
+    resolve_defaults is True and the reference has a default. $$ is docker-compose's escaped $, and is left as is.
+    :param variables: A dictionary of variable names to values.
+    :param resolve_defaults: If True, replace ${NAME:-default} by the default when NAME is not a template variable.
+    :return: A TemplateSubstituter.
+    """
+    exact_terms = {}
+    for name, value in variables.items():
+        exact_terms['$' + name] = value
+        exact_terms['${' + name + '}'] = value
+
+    if len(variables) == 0 and not resolve_defaults:
+        return TemplateSubstituter(exact_terms, None, None)
+
+    names = '|'.join(re.escape(name) for name in sorted(variables, key=len, reverse=True))
+    braced_names = '[A-Za-z_][A-Za-z0-9_]*' if resolve_defaults else names
+    alternatives = [r'\$\$', r'\$\{(?P<braced>' + braced_names + r')(?::-(?P<default>[^}]*))?\}']
+    if len(variables) > 0:
+        alternatives.append(r'\$(?P<bare>' + names + r')(?![A-Za-z0-9_])')
+    pattern = re.compile('|'.join(alternatives))
+
+    def replace(match):
+        name = match.group('braced') or match.group('bare')
+        if name is None:
+            return match.group(0)
+        if name in variables:
+            return str(variables[name])
+        if match.group('default') is not None:
+            return match.group('default')
+        return match.group(0)
+
+    return TemplateSubstituter(exact_terms, pattern, replace, marker='$')
+
+
+@traced('replace_template_variables', 'template')
 def replace_template_variables(obj, terms):
     """
     Recursively replaces the values of any keys in obj which are defined in the terms dictionary.
-    Terms must be a dictionary.
+    Terms must be a dictionary. Terms are replaced literally, see TemplateSubstituter.
+    Use compile_template_variables to substitute $NAME style variables.
     :param obj: Any object.
     :param terms: A dictionary of values to replace.
     :return: the given obj, with any terms replaced.
     """
     if not isinstance(terms, dict):
         raise TypeError('Terms must be of type dictionary')
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            new_key = replace_template_variables(key, terms)
-            new_value = replace_template_variables(value, terms)
-            if new_key != key:
-                obj.pop(key)
-            obj[new_key] = new_value
-        return obj
-    elif isinstance(obj, list):
-        return [replace_template_variables(element, terms) for element in obj]
-    else:
-        for key, value in terms.items():
-            if key in obj:
-                return obj.replace(key, value)
-    return obj
 
+    string_terms = sorted((term for term in terms if isinstance(term, str) and len(term) > 0), key=len, reverse=True)
+    if len(string_terms) == 0:
+        return TemplateSubstituter(terms, None, None).substitute(obj)
 
+    pattern = re.compile('|'.join(re.escape(term) for term in string_terms))
+    return TemplateSubstituter(terms, pattern, lambda match: str(terms[match.group(0)])).substitute(obj)
+
+
+# Strategies for merging two lists, see DeepMerger.
+# 'replace' keeps only the list being merged in, 'append' keeps every element of both lists,
+# and 'union' keeps every distinct element, in the order they were first seen.
+MERGE_REPLACE = 'replace'
+MERGE_APPEND = 'append'
+MERGE_UNION = 'union'
+
+
+class UnionByKey(object):
+    """
+    A list merge strategy which keeps every distinct element, like 'union',
+    except that dictionary elements with the same value for a given key (e.g. the 'target' of a volume)
+    are considered the same element. The element merged in last replaces the earlier one, in place.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+
+class DeepMerger(object):
+    """
+    Merges objects recursively, see deep_merge.
+    Lists are merged according to a strategy chosen by the dictionary key they are stored under (MERGE_UNION by
+    default). The merger keeps an index of the elements of every list it has merged into, so merging into the same
+    list again only costs the length of the list being merged in. Use a single merger for all merges into one config.
+    """
+
+    def __init__(self, strategies=None):
+        """
+        :param strategies: A dictionary of dictionary keys to list merge strategies.
+        """
+        self.strategies = {} if strategies is None else strategies
+
+        # Indexes of the lists merged into, keyed by the id of the list.
+        # Each entry is a tuple of (list, length of the list when it was last indexed, strategy, index).
+        # The list is kept in the entry so that its id cannot be reused while the merger exists.
+        self.__indexes = {}
+
+    def merge(self, a, b, key=None):
+        """
+        Merges b into a, recursively.
+        :param a: Any object.
+        :param b: Any object.
+        :param key: The dictionary key a and b are stored under, if any.
+        :return: b merged into a.
+        """
+        if isinstance(a, dict) and isinstance(b, dict):
+            for b_key in b:
+                if b_key in a:
+                    a[b_key] = self.merge(a[b_key], b[b_key], b_key)
+                else:
+                    a[b_key] = b[b_key]
+            return a
+        elif isinstance(a, list) and isinstance(b, list):
+            return self.__merge_lists(a, b, self.strategies.get(key, MERGE_UNION))
+        elif b is None:
+            return a
+        else:
+            # Copy b's value into a.
+            return b
+
+    def __merge_lists(self, a, b, strategy):
+        """
+        Merges list b into list a.
+        :param a: A list.
+        :param b: A list.
+        :param strategy: The list merge strategy.
+        :return: b merged into a.
+        """
+        if strategy == MERGE_REPLACE:
+            return b
+        if strategy == MERGE_APPEND:
+            a.extend(b)
+            return a
+
+        index = self.__get_index(a, strategy)
+        for element in b:
+            element_key = self.__get_element_key(element, strategy)
+            position = index.get(element_key)
+            if position is None:
+                index[element_key] = len(a)
+                a.append(element)
+            elif isinstance(strategy, UnionByKey):
+                a[position] = element
+        self.__indexes[id(a)] = (a, len(a), strategy, index)
+        return a
+
+    def __get_index(self, a, strategy):
+        """
+        Gets the index of a list's elements, removing any duplicate elements from the list when it is first indexed.
+        :param a: A list.
+        :param strategy: The list merge strategy.
+        :return: A dictionary of element keys to positions in the list.
+        """
+        entry = self.__indexes.get(id(a))
+        if entry is not None and entry[0] is a and entry[1] == len(a) and entry[2] is strategy:
+            return entry[3]
+
+        index = {}
+        elements = []
+        for element in a:
+            element_key = self.__get_element_key(element, strategy)
+            position = index.get(element_key)
+            if position is None:
+                index[element_key] = len(elements)
+                elements.append(element)
+            elif isinstance(strategy, UnionByKey):
+                elements[position] = element
+        a[:] = elements
+        return index
+
+    def __get_element_key(self, element, strategy):
+        """
+        Gets the key by which a list element is de-duplicated.
+        :param element: The list element.
+        :param strategy: The list merge strategy.
+        :return: A hashable key.
+        """
+        if isinstance(strategy, UnionByKey) and isinstance(element, dict) and strategy.key in element:
+            return UnionByKey, self.__get_canonical_key(element[strategy.key])
+        return self.__get_canonical_key(element)
+
+    def __get_canonical_key(self, element):
+        """
+        Gets a hashable key for any parsed YAML value. Equal values have equal keys.
+        :param element: Any parsed YAML value.
+        :return: The element itself if it is hashable, otherwise a hashable equivalent.
+        """
+        if isinstance(element, dict):
+            return dict, frozenset((key, self.__get_canonical_key(value)) for key, value in element.items())
+        elif isinstance(element, list):
+            return list, tuple(self.__get_canonical_key(value) for value in element)
+        return element
+
+
+@traced('deep_merge', 'merge')
 def deep_merge(a, b):
     """
     Merges b into a, recursively.
     This is a special recursive dictionary merge, made specifically for docker compose files.
     If a and b are both dictionaries, their keys are recursively merged. Keys in b write over keys in a.
-    If a and b are both lists, the elements of b are added to a. Duplicate values are removed.
+    If a and b are both lists, the elements of b which are not already in a are appended to a, in order.
     If a and b are any other types, b is returned.
+    Use a DeepMerger to merge many times into the same object, or to merge lists with other strategies.
     :param a: Any object.
     :param b: Any object.
     :return: b merged into a.
     """
-
-    if isinstance(a, dict) and isinstance(b, dict):
-        for key in b:
-            if key in a:
-                a[key] = deep_merge(a[key], b[key])
-            else:
-                a[key] = b[key]
-        return a
-    elif isinstance(a, list) and isinstance(b, list):
-        # Add all elements of b to a
-        return list(set(a + b))
-    elif b is None:
-        return a
-    else:
-        # Copy b's value into a.
-        return b
+    return DeepMerger().merge(a, b)
 
 
+@traced('get_from_paths', 'paths')
 def get_from_paths(sub_path, file_pattern):
     """
     Search through the AUTOCOMPOSE_PATHs for files in the sub-path which match the given file_pattern
+    Directory listings are answered from the path index, so each directory is only listed once.
     :param sub_path: The sub-path to look for files in each autocompose path directory.
     :param file_pattern: A pattern to match files.
     :return: A list of files.
     """
-    paths = os.environ['AUTOCOMPOSE_PATH'].split(":")
+    literal = __regex_characters.isdisjoint(file_pattern)
     results = []
-    for path in paths:
-        try:
-            files = os.listdir(path=os.path.join(path, sub_path))
+    for path in get_autocompose_paths():
+        directory = os.path.join(path, sub_path)
+        _, files, file_set, _ = __get_directory_index(directory)
+        if literal:
+            if file_pattern in file_set:
+                results.append(os.path.join(directory, file_pattern))
+        else:
             for file in files:
                 if re.fullmatch(file_pattern, file):
-                    results.append(os.path.join(path, sub_path, file_pattern))
-        except FileNotFoundError:
-            pass
+                    results.append(os.path.join(directory, file))
     return results
 
 
@@ -107,25 +384,100 @@ def get_all_from_paths(sub_path):
     :param sub_path: The sub-path to look for files in each autocompose path directory.
     :return: A list of files.
     """
-    paths = os.environ['AUTOCOMPOSE_PATH'].split(":")
     results = []
-    for path in paths:
-        try:
-            files = os.listdir(path=os.path.join(path, sub_path))
-            files = [os.path.join(path, sub_path, file) for file in files]
-            results.extend(files)
-        except FileNotFoundError:
-            pass
+    for path in get_autocompose_paths():
+        directory = os.path.join(path, sub_path)
+        _, files, _, _ = __get_directory_index(directory)
+        results.extend([os.path.join(directory, file) for file in files])
     return results
 
 
+def get_autocompose_paths():
+    """
+    Gets the directories of the AUTOCOMPOSE_PATH, in order of precedence.
+    :return: A list of directories.
+    """
+    return os.environ['AUTOCOMPOSE_PATH'].split(":")
+
+
+def __get_directory_index(directory):
+    """
+    Gets the index entry of a directory, listing the directory if it has not been indexed yet.
+    :param directory: The directory.
+    :return: A tuple of (modification time, file names, set of file names, state), see __index_directory.
+    """
+    entry = __path_index.get(directory)
+    if entry is None:
+        count('paths.directories_listed')
+        entry = __index_directory(directory)
+        __path_index[directory] = entry
+    else:
+        count('paths.index_hits')
+    for inputs in __get_input_recorders():
+        inputs['directories'].add(directory)
+        inputs['states'].setdefault(directory, entry[3])
+    return entry
+
+
+def __index_directory(directory):
+    """
+    Lists a directory for the path index.
+    :param directory: The directory.
+    :return: A tuple of (modification time, file names, set of file names, state), where the state is the
+             directory's state before it was listed, see get_path_state.
+    """
+    try:
+        stat = os.stat(directory)
+        files = tuple(os.listdir(directory))
+    except (FileNotFoundError, NotADirectoryError):
+        return None, (), frozenset(), None
+    return stat.st_mtime_ns, files, frozenset(files), __get_stat_state(stat)
+
+
+def get_path_state(path):
+    """
+    Gets the state of a file or directory, which changes whenever it is written, replaced, created or removed.
+    :param path: The file or directory.
+    :return: A tuple of (inode, modification time, size), or None if the path does not exist.
+    """
+    try:
+        return __get_stat_state(os.stat(path))
+    except OSError:
+        return None
+
+
+def __get_stat_state(stat):
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def invalidate_path_index():
+    """
+    Drops every directory from the path index which has changed since it was listed.
+    The index is otherwise kept for the lifetime of the process; long-running callers should call this
+    before reusing it.
+    :return: A list of the directories which were dropped.
+    """
+    stale = [directory for directory, entry in list(__path_index.items())
+             if get_path_state(directory) != entry[3]]
+    for directory in stale:
+        __path_index.pop(directory, None)
+    return stale
+
+
+def clear_path_index():
+    """
+    Drops every directory from the path index.
+    :return: None
+    """
+    __path_index.clear()
+
+
 def print_paths(**kwargs):
     """
     Prints the AUTOCOMPOSE_PATH directories to stdout.
     :return:
     """
-    paths = os.environ['AUTOCOMPOSE_PATH'].split(":")
-    for path in paths:
+    for path in get_autocompose_paths():
         print(path)
 
 
@@ -144,6 +496,7 @@ def set_service_name(autocompose_service_name):
     __autocompose_service_name = autocompose_service_name
 
 
+@traced('get_config', 'yaml')
 def get_config(directory, sub_directory, file_pattern):
     """
     Loads a YAML config from the AUTOCOMPOSE_PATH.
@@ -154,7 +507,7 @@ def get_config(directory, sub_directory, file_pattern):
     """
     configs = get_from_paths(os.path.join(directory, sub_directory), file_pattern)
     if len(configs) > 0:
-        config = yaml.load(open(configs[0]))
+        config = load_yaml_file(configs[0])
     else:
         config = {}
     if config is None:
@@ -166,8 +519,7 @@ def get_user_config():
     user_config_directory = os.path.join(os.environ['HOME'], '.autocompose')
     user_config_file = os.path.join(user_config_directory, 'config.yml')
     try:
-        with open(user_config_file, 'r') as file:
-            user_config = yaml.load(file)
+        user_config = load_yaml_file(user_config_file)
     except:
         user_config = {}
     if user_config is None:
@@ -175,5 +527,236 @@ def get_user_config():
     return user_config
 
 
+def load_yaml_file(file_name, verify_content=False):
+    """
+    Loads a YAML file.
+    Parsed documents are cached until the file's modification time or size changes.
+    The cached document itself is never returned, so callers are free to modify (e.g. deep_merge) the result.
+    :param file_name: The YAML file.
+    :param verify_content: If True, a cached document is only used if the file's content hash is unchanged too.
+    :return: The parsed document.
+    """
+    # The file's state is recorded before it is read, so that any later change is seen, see record_inputs.
+    state = get_path_state(file_name)
+    for inputs in __get_input_recorders():
+        inputs['files'].add(file_name)
+        inputs['states'].setdefault(file_name, state)
+
+    stat = os.stat(file_name)
+    entry = __yaml_cache.get(file_name)
+    if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+        if not verify_content or entry[2] == get_file_hash(file_name):
+            count('yaml.cache_hits')
+            return copy_document(entry[3])
+
+    with open(file_name, 'rb') as file:
+        content = file.read()
+    count('yaml.files_read')
+    count('yaml.bytes_parsed', len(content))
+    with span('yaml.parse', 'yaml', file=file_name):
+        document = yaml.load(content, Loader=YamlLoader)
+    __yaml_cache[file_name] = (stat.st_mtime_ns, stat.st_size, hashlib.sha256(content).hexdigest(), document)
+    return copy_document(document)
+
+
+def clear_yaml_cache():
+    """
+    Drops every parsed document from the YAML cache.
+    :return: None
+    """
+    __yaml_cache.clear()
+
+
+def get_file_hash(file_name):
+    """
+    Gets the SHA-256 hash of a file's content.
+    :param file_name: The file.
+    :return: The hex digest of the file's content.
+    """
+    with open(file_name, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def get_file_fingerprint(file_name):
+    """
+    Gets a fingerprint of a file, used to tell whether the file has changed.
+    :param file_name: The file.
+    :return: A dictionary with the file's modification time, size and content hash. None if the file does not exist.
+    """
+    try:
+        stat = os.stat(file_name)
+        content_hash = get_file_hash(file_name)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': content_hash}
+
+
+def get_directory_fingerprint(directory):
+    """
+    Gets a fingerprint of a directory listing, used to tell whether files were added to or removed from a directory.
+    :param directory: The directory.
+    :return: A dictionary with the directory's modification time and a hash of its file names.
+             None if the directory does not exist.
+    """
+    modification_time, files, _, _ = __index_directory(directory)
+    if modification_time is None:
+        return None
+    listing_hash = hashlib.sha256('\n'.join(sorted(files)).encode('utf-8')).hexdigest()
+    return {'mtime': modification_time, 'sha256': listing_hash}
+
+
+@contextlib.contextmanager
+def record_inputs(current_thread_only=False):
+    """
+    Records every AUTOCOMPOSE_PATH directory looked up and every YAML file loaded while the context is active.
+    Values such as a registry url can be added with record_input.
+    :param current_thread_only: If True, only record the inputs used by the current thread.
+    :return: A dictionary with a set of 'files', a set of 'directories', a dictionary of 'values', and a dictionary of
+             'states' of the files and directories when they were first read, see get_path_state.
+    """
+    inputs = {'files': set(), 'directories': set(), 'values': {}, 'states': {}}
+    if current_thread_only:
+        if not hasattr(__thread_input_recorders, 'recorders'):
+            __thread_input_recorders.recorders = []
+        recorders = __thread_input_recorders.recorders
+    else:
+        recorders = __input_recorders
+    recorders.append(inputs)
+    try:
+        yield inputs
+    finally:
+        recorders.remove(inputs)
+
+
+def __get_input_recorders():
+    """
+    Gets the input recorders which record the inputs used by the current thread.
+    :return: A list of input recorders.
+    """
+    return __input_recorders + getattr(__thread_input_recorders, 'recorders', [])
+
+
+def record_input(name, value):
+    """
+    Records a named input value in every active input recorder.
+    :param name: The name of the input.
+    :param value: The value of the input.
+    :return: None
+    """
+    for inputs in __get_input_recorders():
+        inputs['values'][name] = value
+
+
+def write_file_atomically(file_name, content, mode=0o644, only_if_changed=False):
+    """
+    Writes a file by writing a temporary file next to it and renaming it over the file,
+    so readers never see a partially written file.
+    :param file_name: The file to write.
+    :param content: The content, as a string, or a function which writes the content to a given file object.
+    :param mode: The permissions of the file.
+    :param only_if_changed: If True, the file is left untouched if it already has the content.
+    :return: True if the file was written.
+    """
+    temporary_file = file_name + '.' + str(os.getpid()) + '.tmp'
+    try:
+        fd = os.open(temporary_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, 'w') as file:
+            if callable(content):
+                content(file)
+            else:
+                file.write(content)
+        if only_if_changed and os.path.isfile(file_name) and filecmp.cmp(temporary_file, file_name, shallow=False):
+            os.remove(temporary_file)
+            return False
+        os.replace(temporary_file, file_name)
+        return True
+    except BaseException:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+        raise
+
+
+def copy_document(document):
+    """
+    Copies a parsed YAML document. Only dictionaries and lists are copied, since every other
+    value a YAML parser produces is immutable. This is much cheaper than copy.deepcopy.
+    :param document: A parsed YAML document.
+    :return: A copy of the document.
+    """
+    if isinstance(document, dict):
+        return {key: copy_document(value) for key, value in document.items()}
+    elif isinstance(document, list):
+        return [copy_document(element) for element in document]
+    return document
+
+
+def unique(elements):
+    """
+    Yields the distinct elements of an iterable, in the order they are first seen.
+    :param elements: An iterable of hashable elements.
+    :return: A generator of the distinct elements.
+    """
+    seen = set()
+    for element in elements:
+        if element not in seen:
+            seen.add(element)
+            yield element
+
+
+def format_bytes(size):
+    """
+    Formats a number of bytes for humans, e.g. '12.3 MB'.
+    :param size: The number of bytes.
+    :return: The formatted size.
+    """
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(size) < 1000:
+            return ('%d ' if unit == 'B' else '%.1f ') % size + unit
+        size /= 1000.0
+    return '%.1f TB' % size
+
+
+def parse_size(size):
+    """
+    Parses a human readable number of bytes, e.g. '20GB', '512M' or '1000'.
+    :param size: The size.
+    :return: The number of bytes.
+    """
+    match = re.fullmatch(r'\s*([0-9]+(?:\.[0-9]+)?)\s*([KMGT]?)B?\s*', size, re.IGNORECASE)
+    if match is None:
+        raise ValueError('Not a size: "' + size + '". Use e.g. "500MB" or "20GB".')
+    return int(float(match.group(1)) * 1000 ** ' KMGT'.index(match.group(2).upper() or ' '))
+
+
+def parse_duration(duration):
+    """
+    Parses a human readable duration, e.g. '7d', '12h', '30m' or '90s'.
+    :param duration: The duration.
+    :return: The number of seconds.
+    """
+    match = re.fullmatch(r'\s*([0-9]+(?:\.[0-9]+)?)\s*([smhdw]?)\s*', duration, re.IGNORECASE)
+    if match is None:
+        raise ValueError('Not a duration: "' + duration + '". Use e.g. "12h" or "7d".')
+    units = {'': 1, 's': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+    return float(match.group(1)) * units[match.group(2).lower()]
+
+
+def print_table(rows, output=None):
+    """
+    Prints rows as a table with aligned columns. The last column is not padded.
+    :param rows: A list of tuples of strings. The first row is the header.
+    :param output: The stream to print to. Default is stdout.
+    :return: None
+    """
+    output = sys.stdout if output is None else output
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]) - 1)]
+    for row in rows:
+        cells = [cell.ljust(width) for cell, width in zip(row, widths)] + [row[-1]]
+        output.write('  '.join(cells) + '\n')
+    output.flush()
+
+
 def print_docker_output(stream):
+    # compose is only imported by the commands which talk to Docker.
+    from compose import progress_stream
     progress_stream.stream_output(stream, sys.stdout)
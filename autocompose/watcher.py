@@ -0,0 +1,124 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+
+# inotify events which mean a file or directory was written, replaced, created or removed.
+__inotify_mask = (0x00000002 |  # IN_MODIFY
+                  0x00000004 |  # IN_ATTRIB
+                  0x00000008 |  # IN_CLOSE_WRITE
+                  0x00000040 |  # IN_MOVED_FROM
+                  0x00000080 |  # IN_MOVED_TO
+                  0x00000100 |  # IN_CREATE
+                  0x00000200 |  # IN_DELETE
+                  0x00000400 |  # IN_DELETE_SELF
+                  0x00000800)  # IN_MOVE_SELF
+
+# Editors often write a file in several steps. Wait this long after an event for the next one, before looking.
+__settle_seconds = 0.05
+
+
+def wait_for_changes(states, poll_interval=1.0):
+    """
+    Waits until any of the given files or directories differs from the state it had when it was read.
+    The directories containing the paths are watched with inotify where it is available. Otherwise, or as a safety
+    net for file systems inotify does not see changes on, the paths are checked every poll interval.
+    Changes made before this is called, e.g. while the files were being processed, are returned at once.
+    :param states: A dictionary of the files and directories to watch to their state when they were read, as returned
+                   by get_snapshot or recorded by util.record_inputs. They do not need to exist.
+    :param poll_interval: The number of seconds between two checks of the paths.
+    :return: A dictionary of the paths which changed to their new state.
+    """
+    paths = set(states)
+    # Watch before looking at the paths, so that no change is missed between the two.
+    inotify = __open_inotify(__get_watched_directories(paths))
+    try:
+        while True:
+            changed = {path: state for path, state in get_snapshot(paths).items() if state != states[path]}
+            if len(changed) > 0:
+                return changed
+            if inotify is None:
+                time.sleep(poll_interval)
+            elif __read_inotify_events(inotify, poll_interval):
+                # Let a burst of events settle before looking at the paths.
+                while __read_inotify_events(inotify, __settle_seconds):
+                    pass
+    finally:
+        if inotify is not None:
+            os.close(inotify)
+
+
+def get_snapshot(paths):
+    """
+    Gets the state of files and directories, which changes whenever they are written, replaced, created or removed.
+    :param paths: The files and directories.
+    :return: A dictionary of paths to (inode, modification time, size) tuples, or to None if they do not exist.
+    """
+    snapshot = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            snapshot[path] = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            snapshot[path] = None
+    return snapshot
+
+
+def __get_watched_directories(paths):
+    """
+    Gets the directories to watch for changes of some paths: the directory of every path, and every existing
+    directory among the paths. Paths which do not exist are watched through their closest existing ancestor.
+    :param paths: The files and directories.
+    :return: A set of directories.
+    """
+    directories = set()
+    for path in paths:
+        if os.path.isdir(path):
+            directories.add(path)
+        directory = os.path.dirname(os.path.abspath(path))
+        while not os.path.isdir(directory) and os.path.dirname(directory) != directory:
+            directory = os.path.dirname(directory)
+        directories.add(directory)
+    return directories
+
+
+def __open_inotify(directories):
+    """
+    Creates an inotify instance watching some directories.
+    :param directories: The directories.
+    :return: The inotify file descriptor. None if inotify is not available.
+    """
+    library_name = ctypes.util.find_library('c')
+    if library_name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(library_name, use_errno=True)
+        inotify = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if inotify < 0:
+        return None
+
+    for directory in directories:
+        # Directories which cannot be watched (e.g. removed meanwhile) are still checked every poll interval.
+        libc.inotify_add_watch(inotify, os.fsencode(directory), __inotify_mask)
+    return inotify
+
+
+def __read_inotify_events(inotify, timeout):
+    """
+    Waits for inotify events, and discards them. The paths are looked at afterwards instead.
+    :param inotify: The inotify file descriptor.
+    :param timeout: The number of seconds to wait.
+    :return: True if there were any events.
+    """
+    readable, _, _ = select.select([inotify], [], [], timeout)
+    if len(readable) == 0:
+        return False
+    try:
+        while os.read(inotify, 64 * 1024):
+            pass
+    except BlockingIOError:
+        pass
+    return True
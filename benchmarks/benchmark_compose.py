@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Benchmarks docker-compose generation over a synthetic AUTOCOMPOSE_PATH.
+
+The tree has N roots, M services spread over the roots, T templates per service and V template variables. Each stage
+is timed, then run once more under tracemalloc to measure the memory it allocates. The results are printed, and can be
+saved as JSON and compared with the results of another commit:
+
+    python benchmarks/benchmark_compose.py --services 500 -o before.json
+    python benchmarks/benchmark_compose.py --services 500 -o after.json --compare before.json
+
+ECR is stubbed, so no AWS credentials are needed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# The modules of autocompose read HOME when they are imported, so it is pointed at the synthetic tree first.
+__directory = tempfile.mkdtemp(prefix='autocompose-benchmark-')
+os.environ['HOME'] = os.path.join(__directory, 'home')
+os.makedirs(os.path.join(os.environ['HOME'], '.autocompose'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yaml
+
+from autocompose.composer import build_compose_file
+from autocompose.util import clear_path_index, clear_yaml_cache, deep_merge, get_config, get_from_paths, \
+    replace_template_variables
+
+# The name of the scenario containing every service of the synthetic tree.
+SCENARIO = 'benchmark'
+
+
+class StubAwsSession(object):
+    """
+    An AWS session whose ECR client hands out an authorization token without calling AWS.
+    """
+
+    profile_name = 'benchmark'
+    region_name = 'us-east-1'
+
+    def get_credentials(self):
+        return None
+
+    def client(self, service_name):
+        return self
+
+    def get_authorization_token(self):
+        return {'authorizationData': [{'authorizationToken': 'QVdTOnBhc3N3b3Jk',
+                                       'proxyEndpoint': 'https://123456789012.dkr.ecr.us-east-1.amazonaws.com',
+                                       'expiresAt': time.time() + 12 * 60 * 60}]}
+
+
+def create_tree(directory, roots, services, templates, variables):
+    """
+    Creates a synthetic AUTOCOMPOSE_PATH.
+    Services are spread over the roots, and every root overrides the service.yml of a few services, so lookups have to
+    search every root. Every service uses templates, and every docker-compose file refers to template variables.
+    :param directory: The directory to create the roots in.
+    :param roots: The number of roots.
+    :param services: The number of services.
+    :param templates: The number of templates per service.
+    :param variables: The number of template variables.
+    :return: The AUTOCOMPOSE_PATH.
+    """
+    paths = [os.path.join(directory, 'root' + str(root)) for root in range(roots)]
+    template_names = ['template' + str(template) for template in range(max(templates * 2, 1))]
+    variable_names = ['VARIABLE' + str(variable) for variable in range(variables)]
+
+    def variable(index):
+        return '${' + variable_names[index % len(variable_names)] + '}' if variable_names else 'value'
+
+    def write(path, document):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            yaml.safe_dump(document, file, default_flow_style=False)
+
+    service_names = ['service' + str(service) for service in range(services)]
+    for index, service_name in enumerate(service_names):
+        root = paths[index % roots]
+        service_templates = [template_names[(index + offset) % len(template_names)] for offset in range(templates)]
+        write(os.path.join(root, 'services', service_name, 'service.yml'),
+              {'autocompose-image': 'base', 'autocompose-templates': service_templates})
+        write(os.path.join(root, 'services', service_name, 'docker-compose.yml'), {'services': {service_name: {
+            'environment': ['NAME=' + service_name, 'HOST=' + variable(index), 'PORT=' + variable(index + 1)],
+            'ports': [str(8000 + index) + ':80'],
+            'volumes': [{'type': 'volume', 'source': service_name, 'target': '/data'}],
+            'command': ['run', '--name', service_name]
+        }}})
+        if index % 10 == 0 and roots > 1:
+            write(os.path.join(paths[(index + 1) % roots], 'services', service_name, 'service.yml'),
+                  {'autocompose-image': 'override', 'autocompose-templates': service_templates})
+
+    for index, template_name in enumerate(template_names):
+        root = paths[-1]
+        write(os.path.join(root, 'templates', template_name, 'docker-compose.yml'),
+              {'networks': {template_name: {'driver': 'bridge'}}})
+        write(os.path.join(root, 'templates', template_name, 'docker-compose-service.yml'), {
+            'environment': [template_name.upper() + '=' + variable(index)],
+            'networks': [template_name],
+            'labels': {'template': template_name}
+        })
+
+    write(os.path.join(paths[0], 'scenarios', SCENARIO, 'scenario.yml'), {
+        'services': service_names,
+        'template-variables': {name: 'value-of-' + name.lower() for name in variable_names}
+    })
+    return ':'.join(paths)
+
+
+def get_stages(service_names, variables):
+    """
+    Gets the stages to benchmark.
+    :param service_names: The names of the services in the synthetic tree.
+    :param variables: The number of template variables.
+    :return: A list of (name, setup, function) tuples. setup prepares the caches, and returns the argument of function.
+    """
+    aws_session = StubAwsSession()
+    terms = {'${VARIABLE' + str(variable) + '}': 'value' + str(variable) for variable in range(variables)}
+
+    def cold():
+        clear_path_index()
+        clear_yaml_cache()
+
+    def warm():
+        build_compose_file(aws_session, [SCENARIO])
+
+    def configs():
+        return [get_config('services', service_name, 'docker-compose.yml') for service_name in service_names]
+
+    def merged():
+        merged_config = {}
+        for config in configs():
+            deep_merge(merged_config, config)
+        return merged_config
+
+    def find_services(_):
+        for service_name in service_names:
+            get_from_paths(os.path.join('services', service_name), 'service.yml')
+
+    def load_configs(_):
+        configs()
+
+    def merge_configs(loaded_configs):
+        merged_config = {}
+        for config in loaded_configs:
+            deep_merge(merged_config, config)
+
+    def replace_variables(merged_config):
+        replace_template_variables(merged_config, terms)
+
+    def compose(_):
+        build_compose_file(aws_session, [SCENARIO])
+
+    return [
+        ('get_from_paths (cold)', cold, find_services),
+        ('get_from_paths (warm)', warm, find_services),
+        ('get_config (cold)', cold, load_configs),
+        ('get_config (warm)', warm, load_configs),
+        ('deep_merge', configs, merge_configs),
+        ('replace_template_variables', merged, replace_variables),
+        ('build_compose_file (cold)', cold, compose),
+        ('build_compose_file (warm)', warm, compose),
+    ]
+
+
+def run_stage(setup, function, repeat):
+    """
+    Runs a stage several times.
+    :param setup: Prepares a run, and returns the argument of function.
+    :param function: The stage.
+    :param repeat: The number of timed runs.
+    :return: A dictionary of results.
+    """
+    times = []
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        function(argument)
+        times.append(time.perf_counter() - start)
+
+    argument = setup()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    function(argument)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    differences = after.compare_to(before, 'filename')
+
+    return {
+        'best_seconds': min(times),
+        'mean_seconds': sum(times) / len(times),
+        'allocated_blocks': sum(difference.count_diff for difference in differences if difference.count_diff > 0),
+        'allocated_bytes': sum(difference.size_diff for difference in differences if difference.size_diff > 0),
+        'peak_bytes': peak
+    }
+
+
+def print_results(results, baseline=None):
+    """
+    Prints the results of every stage, compared with a baseline if given.
+    :param results: The results.
+    :param baseline: The results of an earlier run, or None.
+    :return: None
+    """
+    rows = [('STAGE', 'BEST', 'MEAN', 'ALLOCATED', 'PEAK', 'CHANGE')]
+    for stage, result in results['stages'].items():
+        change = ''
+        if baseline is not None and stage in baseline['stages']:
+            change = '%+.1f%%' % ((result['best_seconds'] / baseline['stages'][stage]['best_seconds'] - 1) * 100)
+        rows.append((stage, '%.2fms' % (result['best_seconds'] * 1000), '%.2fms' % (result['mean_seconds'] * 1000),
+                     '%.1fKB' % (result['allocated_bytes'] / 1024), '%.1fKB' % (result['peak_bytes'] / 1024), change))
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+
+def get_commit():
+    """
+    Gets the commit being benchmarked.
+    :return: The commit hash. None if it cannot be found.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark docker-compose generation over a synthetic '
+                                                 'AUTOCOMPOSE_PATH.')
+    parser.add_argument('--roots', type=int, default=3, help='The number of AUTOCOMPOSE_PATH roots.')
+    parser.add_argument('--services', type=int, default=200, help='The number of services.')
+    parser.add_argument('--templates', type=int, default=3, help='The number of templates per service.')
+    parser.add_argument('--variables', type=int, default=20, help='The number of template variables.')
+    parser.add_argument('--repeat', type=int, default=5, help='The number of timed runs of every stage.')
+    parser.add_argument('-o', '--output', default=None, help='Save the results to this JSON file.')
+    parser.add_argument('--compare', default=None, help='Compare the results with those saved in this JSON file.')
+    args = parser.parse_args()
+
+    try:
+        os.environ['AUTOCOMPOSE_PATH'] = create_tree(__directory, args.roots, args.services, args.templates,
+                                                     args.variables)
+        service_names = ['service' + str(service) for service in range(args.services)]
+        results = {
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'parameters': {'roots': args.roots, 'services': args.services, 'templates': args.templates,
+                           'variables': args.variables, 'repeat': args.repeat},
+            'stages': {}
+        }
+        for stage, setup, function in get_stages(service_names, args.variables):
+            results['stages'][stage] = run_stage(setup, function, args.repeat)
+    finally:
+        shutil.rmtree(__directory, ignore_errors=True)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get('parameters') != results['parameters']:
+            print('Warning: the baseline was run with different parameters: ' + json.dumps(baseline.get('parameters')))
+    print_results(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
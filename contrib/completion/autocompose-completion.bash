@@ -1,43 +1,23 @@
 #!/usr/bin/env bash
 # Adds bash completion to autocompose
 
-RED='\033[0;31m'
-YELLOW='\033[0;33m'
-NC='\033[0m'
-
-# Get directories from a given path.
-_autocompose_get_dirs_from_paths() {
-    SUB_PATH=$1
-    COLOR=$2
-    RESULTS=""
-
-    for DIRECTORY in $(echo ${AUTOCOMPOSE_PATH} | sed 's/:/ /'); do
-        CURRENT_PATH=${DIRECTORY}/${SUB_PATH}
-        if [ -e ${CURRENT_PATH} ] && [ -d ${CURRENT_PATH} ]; then
-            cd ${CURRENT_PATH} &>/dev/null
-            RESULTS="${RESULTS} $(ls -d */ | sed 's:/::g')"
-
-            for RESULT in ${RESULTS}; do
-                echo "${RESULT}"
-            done
-
-            cd - &>/dev/null
-        fi
-    done
-    # echo ${RESULTS}
-}
-
 # Bash Autocompletion function.
+# autocompose completes the command line up to the cursor itself, from a cached index of the AUTOCOMPOSE_PATH.
 _autocompose() {
     COMPREPLY=()
-    local cur=${COMP_WORDS[COMP_CWORD]}
-
-    # Root command
-    if [ $COMP_CWORD -eq 1 ]; then
-        COMPREPLY=( $(compgen -W "init login push build clean-containers clean-images update-images clean-networks compose up path" -- "$cur") )
-    elif [ $COMP_CWORD -ge 2 ]; then
-
-        COMPREPLY=( $(compgen -W "$(_autocompose_get_dirs_from_paths services ${RED})" -- "$cur") $(compgen -W "$(_autocompose_get_dirs_from_paths scenarios ${YELLOW})" -- "$cur") )
+    local line=${COMP_LINE:0:${COMP_POINT}}
+    local IFS=$'\n'
+
+    COMPREPLY=( $(autocompose complete -- "${line}" 2>/dev/null) )
+
+    # Bash splits "service:tag" into several words, so only complete the part after the last colon.
+    if [[ "${line##*[[:space:]]}" == *:* && "${COMP_WORDBREAKS}" == *:* ]]; then
+        local colon_prefix=${line##*[[:space:]]}
+        colon_prefix=${colon_prefix%"${colon_prefix##*:}"}
+        local i
+        for i in "${!COMPREPLY[@]}"; do
+            COMPREPLY[$i]=${COMPREPLY[$i]#"${colon_prefix}"}
+        done
     fi
 }
 
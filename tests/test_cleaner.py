@@ -0,0 +1,135 @@
+import contextlib
+import io
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+from autocompose import cleaner
+
+DiskUsage = namedtuple('DiskUsage', ['total', 'used', 'free'])
+
+
+def image(image_id, tags=None, parent=None, created=0, size=0):
+    return {'Id': image_id, 'RepoTags': tags or ['<none>:<none>'], 'ParentId': parent or '', 'Created': created,
+            'Size': size}
+
+
+def private(name):
+    return getattr(cleaner, name)
+
+
+class FakeDockerClient(object):
+
+    def __init__(self, images, containers=None):
+        self.all_images = images
+        self.all_containers = containers or []
+
+    def images(self, all=False):
+        return self.all_images
+
+    def containers(self, all=False):
+        return self.all_containers
+
+    def info(self):
+        return {'DockerRootDir': '/var/lib/docker'}
+
+
+class TestSplitRemovals(unittest.TestCase):
+
+    def test_registry_prefix(self):
+        shared = image('shared', ['registry/web:1', 'other/web:1'])
+        only_registry = image('only-registry', ['registry/web:0', 'registry/web:old'])
+        untagged = image('untagged')
+        untags, removals = private('__split_removals')([shared, only_registry, untagged],
+                                                       [shared, only_registry, untagged], ['registry/'], None)
+        # The shared image is kept for its other tag, and only untagged.
+        self.assertEqual(['registry/web:1'], untags)
+        self.assertEqual([only_registry, untagged], removals)
+
+    def test_all_tags(self):
+        tagged = image('tagged', ['web:1', 'web:latest'])
+        self.assertEqual(([], [tagged]), private('__split_removals')([tagged], [tagged], None, None))
+
+    def test_keep_recent(self):
+        # "both" is the most recent image of web, but the oldest of api.
+        both = image('both', ['web:3', 'web:latest', 'api:1'], created=30)
+        web = image('web', ['web:2'], created=20)
+        api = [image('api-' + str(i), ['api:' + str(i)], created=40 + i) for i in range(2, 4)]
+        all_images = [both, web] + api
+        untags, removals = private('__split_removals')(all_images, all_images, None, 1)
+        self.assertEqual(['api:1'], untags)
+        self.assertEqual([web, api[0]], removals)
+
+    def test_keep_recent_with_prefix(self):
+        both = image('both', ['registry/web:2', 'web:2'], created=20)
+        old = image('old', ['registry/web:1', 'web:1'], created=10)
+        untags, removals = private('__split_removals')([both, old], [both, old], ['registry/'], 1)
+        # Only the registry tags of old images are removed. The other tags keep the images.
+        self.assertEqual(['registry/web:1'], untags)
+        self.assertEqual([], removals)
+
+
+class TestSelectUntilFree(unittest.TestCase):
+
+    def setUp(self):
+        self.images = [image('base', size=100, created=1), image('child', parent='base', size=150, created=3),
+                       image('other', size=60, created=2), image('orphan-parent', size=500, created=0),
+                       image('kept-child', parent='orphan-parent', size=510, created=4)]
+        self.graph = private('__get_image_graph')(self.images)
+        self.candidates = [candidate for candidate in self.images if candidate['Id'] != 'kept-child']
+
+    def select(self, target, free=0):
+        with mock.patch.object(cleaner.shutil, 'disk_usage', return_value=DiskUsage(0, 0, free)):
+            selected = private('__select_until_free')(FakeDockerClient(self.images), self.candidates, self.graph,
+                                                      target)
+        return [candidate['Id'] for candidate in selected]
+
+    def test_enough_space(self):
+        self.assertEqual([], self.select(100, free=100))
+
+    def test_parent_counts_once_its_children_are_removable(self):
+        # The parent of a kept image frees nothing. The base image frees 100 bytes only once its child is selected.
+        self.assertEqual(['orphan-parent', 'base', 'other'], self.select(60))
+        self.assertEqual(['orphan-parent', 'base', 'other', 'child'], self.select(61))
+        self.assertEqual(['orphan-parent', 'base', 'other', 'child'], self.select(310))
+
+    def test_not_enough_removable(self):
+        self.assertEqual(['orphan-parent', 'base', 'other', 'child'], self.select(311))
+
+
+class TestRemoveImages(unittest.TestCase):
+
+    def test_waves(self):
+        images = [image('base'), image('child', parent='base'), image('grandchild', parent='child'),
+                  image('kept-child', parent='base')]
+        graph = private('__get_image_graph')(images)
+        removed, failed, skipped = private('__remove_images')(None, graph, {'base', 'child', 'grandchild'}, 1,
+                                                              dry_run=True)
+        self.assertEqual(['grandchild', 'child'], removed)
+        self.assertEqual([], failed)
+        self.assertEqual(['base'], skipped)
+
+
+class TestCleanImages(unittest.TestCase):
+
+    def clean_images(self, images, containers=None, **kwargs):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            cleaner.clean_images(FakeDockerClient(images, containers), dry_run=True, **kwargs)
+        return output.getvalue()
+
+    def test_dry_run(self):
+        images = [image('sha256:base', ['registry/base:1'], size=100),
+                  image('sha256:app', ['registry/app:1', 'other/app:1'], parent='sha256:base', size=150),
+                  image('sha256:old', ['registry/old:1'], size=70)]
+        output = self.clean_images(images, registry_prefix=['registry/'])
+        self.assertIn('untag registry/app:1', output)
+        self.assertIn('skip sha256:base registry/base:1', output)
+        self.assertIn('Would remove 1 images, reclaiming 70 B.', output)
+        self.assertIn('Would untag 1 tags of images which keep other tags.', output)
+        self.assertIn('Would skip 1 images which kept images are built on.', output)
+
+    def test_in_use(self):
+        images = [image('sha256:base', ['web:1'], size=100), image('sha256:app', ['web:2'], parent='sha256:base')]
+        containers = [{'State': 'running', 'ImageID': 'sha256:app'}]
+        self.assertIn('Would remove 0 images', self.clean_images(images, containers))
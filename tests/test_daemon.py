@@ -0,0 +1,66 @@
+import os
+import socket
+import sys
+import tempfile
+import unittest
+
+from autocompose import daemon
+
+
+class TestExecuteInDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket_file = os.path.join(self.directory.name, 'daemon.sock')
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_file)
+        self.server.listen(1)
+        self.server.setblocking(False)
+        self.original_socket_file = getattr(daemon, '__socket_file')
+        setattr(daemon, '__socket_file', self.socket_file)
+
+    def tearDown(self):
+        setattr(daemon, '__socket_file', self.original_socket_file)
+        self.server.close()
+        self.directory.cleanup()
+
+    def assert_not_connected(self):
+        self.assertRaises(BlockingIOError, self.server.accept)
+
+    def test_watch_runs_in_process(self):
+        for arguments in [['my-scenario', '--watch', '-o', 'docker-compose.yml'], ['my-scenario', '--wat']]:
+            self.assertIsNone(daemon.execute_in_daemon('compose', arguments, None, {}))
+            self.assert_not_connected()
+
+    def test_other_commands_run_in_process(self):
+        self.assertIsNone(daemon.execute_in_daemon('build', [], None, {}))
+        self.assert_not_connected()
+
+
+class TestRunRequest(unittest.TestCase):
+
+    def run_request(self, execute):
+        request = {'command': 'compose', 'arguments': ['my-scenario'], 'cwd': tempfile.gettempdir()}
+        return getattr(daemon, '__run_request')(request, execute, None, None)
+
+    def test_output(self):
+        def execute(command, arguments, aws_session, docker_client):
+            print(command + ' ' + ' '.join(arguments))
+
+        self.assertEqual({'stdout': 'compose my-scenario\n', 'stderr': '', 'status': 0}, self.run_request(execute))
+
+    def test_error(self):
+        def execute(command, arguments, aws_session, docker_client):
+            print('Loading...')
+            raise Exception('No service named "unknown" was found.')
+
+        working_directory = os.getcwd()
+        self.assertEqual({'stdout': 'Loading...\n', 'stderr': 'No service named "unknown" was found.\n', 'status': 1},
+                         self.run_request(execute))
+        self.assertEqual(working_directory, os.getcwd())
+
+    def test_exit(self):
+        def execute(command, arguments, aws_session, docker_client):
+            sys.exit(2)
+
+        self.assertEqual(2, self.run_request(execute)['status'])
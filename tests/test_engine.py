@@ -0,0 +1,141 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from docker import errors
+
+from autocompose.engine import JsonStreamDecoder, run_on_engine
+
+
+class TestJsonStreamDecoder(unittest.TestCase):
+
+    def test_byte_by_byte(self):
+        documents = [{'status': 'Downloading', 'id': 'a'}, {'status': 'Pull complete ✓ \U0001f433'}, [1, 2], 3]
+        text = '\r\n'.join(json.dumps(document, ensure_ascii=False) for document in documents) + '\r\n'
+        data = text.encode('utf-8')
+        decoder = JsonStreamDecoder()
+        decoded = []
+        for i in range(len(data)):
+            decoded.extend(decoder.feed(data[i:i + 1]))
+        decoder.close()
+        self.assertEqual(documents, decoded)
+
+    def test_documents_across_chunks(self):
+        decoder = JsonStreamDecoder()
+        self.assertEqual([], decoder.feed(b'{"status": "caf\xc3'))
+        self.assertEqual([{'status': 'café'}, {}], decoder.feed(b'\xa9"}{}{"id"'))
+        self.assertEqual([{'id': 1}], decoder.feed(b': 1}  '))
+        decoder.close()
+
+    def test_incomplete_document(self):
+        decoder = JsonStreamDecoder()
+        decoder.feed(b'{"status": ')
+        self.assertRaises(Exception, decoder.close)
+
+
+class FakeEngine(object):
+    """
+    A Docker Engine which serves a few canned responses on a Unix socket, from its own thread and event loop.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.connections = 0
+        self.requests = []
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.server = None
+
+    def start(self):
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_unix_server(self.handle, self.socket_path), self.loop).result()
+
+    def stop(self):
+        async def close():
+            self.server.close()
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            request_line = await reader.readline()
+            if request_line == b'':
+                break
+            while (await reader.readline()).strip() != b'':
+                pass
+            method, path, _ = request_line.decode('latin-1').split(' ')
+            self.requests.append(method + ' ' + path)
+            writer.write(self.respond(method, path))
+            await writer.drain()
+        writer.close()
+
+    @staticmethod
+    def respond(method, path):
+        if method == 'POST' and path.startswith('/v1.26/images/create?'):
+            events = ''.join(json.dumps(event) for event in [
+                {'status': 'Pulling from library/redis', 'id': '4'},
+                {'status': 'Downloading', 'id': 'layer', 'progressDetail': {'current': 512, 'total': 1024}},
+                {'status': 'Status: Downloaded newer image for redis:4 ✓'}]).encode('utf-8')
+            # Split the events inside a document and inside the UTF-8 check mark.
+            chunks = [events[:20], events[20:-4], events[-4:]]
+            body = b''.join(format(len(chunk), 'x').encode('ascii') + b'\r\n' + chunk + b'\r\n' for chunk in chunks)
+            return (b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n\r\n' +
+                    body + b'0\r\n\r\n')
+        if method == 'DELETE' and path.startswith('/v1.26/images/missing?'):
+            body = b'{"message": "No such image: missing"}'
+            return (b'HTTP/1.1 404 Not Found\r\nContent-Type: application/json\r\nContent-Length: ' +
+                    str(len(body)).encode('ascii') + b'\r\n\r\n' + body)
+        if method == 'DELETE' and path.startswith('/v1.26/images/'):
+            body = b'[{"Untagged": "image"}]'
+            return (b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: ' +
+                    str(len(body)).encode('ascii') + b'\r\n\r\n' + body)
+        return b'HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\n\r\n'
+
+
+class TestRunOnEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = FakeEngine(os.path.join(self.directory.name, 'docker.sock'))
+        self.engine.start()
+
+    def tearDown(self):
+        self.engine.stop()
+        self.directory.cleanup()
+
+    def test_pull(self):
+        events = []
+
+        async def pull(engine, image):
+            await engine.pull(image, on_event=events.append)
+
+        self.assertEqual([], run_on_engine(pull, ['redis:4'], socket_path=self.engine.socket_path))
+        self.assertEqual(['POST /v1.26/images/create?fromImage=redis&tag=4'], self.engine.requests)
+        self.assertEqual(['Pulling from library/redis', 'Downloading',
+                          'Status: Downloaded newer image for redis:4 ✓'], [event['status'] for event in events])
+        self.assertEqual({'current': 512, 'total': 1024}, events[1]['progressDetail'])
+
+    def test_not_found(self):
+        failures = run_on_engine(lambda engine, image: engine.remove_image(image), ['missing'],
+                                 socket_path=self.engine.socket_path)
+        self.assertEqual(1, len(failures))
+        self.assertEqual('missing', failures[0][0])
+        self.assertIsInstance(failures[0][1], errors.NotFound)
+        self.assertIn('No such image: missing', str(failures[0][1]))
+
+    def test_reuses_connections(self):
+        images = ['image-' + str(i) for i in range(20)]
+        self.assertEqual([], run_on_engine(lambda engine, image: engine.remove_image(image, force=True), images,
+                                           jobs=3, socket_path=self.engine.socket_path))
+        self.assertEqual(sorted('DELETE /v1.26/images/' + image + '?force=1&noprune=0' for image in images),
+                         sorted(self.engine.requests))
+        self.assertLessEqual(self.engine.connections, 3)
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+import unittest
+
+# The most time importing the CLI and a light command may take, in microseconds, as reported by python -X importtime.
+STARTUP_BUDGET = 100000
+
+
+def get_import_times(command):
+    """
+    Imports the CLI and the module of a command with python -X importtime.
+    :param command: The name of the command.
+    :return: A tuple of (the names of every imported module, the cumulative time of the top-level autocompose
+             imports in microseconds).
+    """
+    code = 'from autocompose.command_line.command_line import get_command; get_command("' + command + '")'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    names = []
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        names.append(name.strip())
+        # Nested imports are indented, and already included in the cumulative time of their top-level import.
+        if name.startswith(' autocompose'):
+            total += int(cumulative)
+    return names, total
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_light_commands(self):
+        for command in ['complete', 'compose', 'path']:
+            names, total = get_import_times(command)
+            heavy_modules = [name for name in names
+                             if name.split('.')[0] in ('boto3', 'botocore', 'compose', 'docker')]
+            self.assertEqual([], heavy_modules, command)
+            self.assertLess(total, STARTUP_BUDGET, command)
+
+
+if __name__ == '__main__':
+    unittest.main()
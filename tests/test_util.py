@@ -1,14 +1,38 @@
 import unittest
-from autocompose.util import Util
+from autocompose.util import DeepMerger, MERGE_APPEND, MERGE_REPLACE, UnionByKey, compile_template_variables, \
+    deep_merge, parse_duration, parse_size, replace_template_variables
 
 
 class TestReplaceTemplateVariables(unittest.TestCase):
 
     def test_replace(self):
-        self.assertEqual(4, Util.replace_template_variables(3, {3: 4}))
-        self.assertEqual([1, 2, 4], Util.replace_template_variables([1, 2, 3], {3: 4}))
-        self.assertEqual({1: 2, 3: 5}, Util.replace_template_variables({1: 2, 3: '4'}, {'4': 5}))
-        self.assertRaises(TypeError, Util.replace_template_variables, [3, 'not a dictionary'])
+        self.assertEqual(4, replace_template_variables(3, {3: 4}))
+        self.assertEqual([1, 2, 4], replace_template_variables([1, 2, 3], {3: 4}))
+        self.assertEqual({1: 2, 3: 5}, replace_template_variables({1: 2, 3: '4'}, {'4': 5}))
+        self.assertRaises(TypeError, replace_template_variables, [3, 'not a dictionary'])
+
+    def test_replace_all_terms(self):
+        self.assertEqual('a-b a', replace_template_variables('x-y x', {'x': 'a', 'y': 'b'}))
+        self.assertEqual('long', replace_template_variables('xy', {'x': 'short', 'xy': 'long'}))
+
+
+class TestCompileTemplateVariables(unittest.TestCase):
+
+    def test_substitute(self):
+        substituter = compile_template_variables({'HOST': 'db', 'HOSTNAME': 'web', 'PORT': 5432})
+        self.assertEqual({'db:5432': ['web', 'db-db', 'db']},
+                         substituter.substitute({'${HOST}:$PORT': ['$HOSTNAME', '$HOST-${HOST}', '${HOST:-x}']}))
+        self.assertEqual(5432, substituter.substitute('${PORT}'))
+        self.assertEqual('$$HOST ${OTHER} ${OTHER:-x}', substituter.substitute('$$HOST ${OTHER} ${OTHER:-x}'))
+
+    def test_longer_undefined_variable(self):
+        substituter = compile_template_variables({'HOST': 'db'})
+        self.assertEqual('$HOSTNAME db-db', substituter.substitute('$HOSTNAME $HOST-$HOST'))
+        self.assertEqual('$HOST_2 db', substituter.substitute('$HOST_2 ${HOST}'))
+
+    def test_resolve_defaults(self):
+        substituter = compile_template_variables({'HOST': 'db'}, resolve_defaults=True)
+        self.assertEqual('db:5432 ${PORT}', substituter.substitute('${HOST:-x}:${PORT:-5432} ${PORT}'))
 
 
 class TestDeepMerge(unittest.TestCase):
@@ -18,20 +42,73 @@ class TestDeepMerge(unittest.TestCase):
         a = {'a': '1'}
         b = {'b': '2'}
 
-        self.assertEqual({'a': '1', 'b': '2'}, Util.deep_merge(a, b))
+        self.assertEqual({'a': '1', 'b': '2'}, deep_merge(a, b))
 
         a = {'a': '1'}
         c = {'a': '2'}
 
-        self.assertEqual(c, Util.deep_merge(a, c))
+        self.assertEqual(c, deep_merge(a, c))
 
-        self.assertEqual([1, 2, 3, 4, 5], Util.deep_merge([1, 2, 3], [3, 4, 5]))
-        self.assertEqual(4, Util.deep_merge(5, 4))
+        self.assertEqual([1, 2, 3, 4, 5], deep_merge([1, 2, 3], [3, 4, 5]))
+        self.assertEqual(4, deep_merge(5, 4))
 
         d = {'a': 1, 'b': [1, 2, 3, 4, 5], 'c': {'a': 1, 'b': [1, 2, 3, 4, 5]}}
         e = {'d': 2, 'b': [6, 7], 'c': {'c': 1, 'd': [1, 2]}}
         merged = {'a': 1, 'd': 2, 'b': [1, 2, 3, 4, 5, 6, 7], 'c': {'a': 1, 'b': [1, 2, 3, 4, 5], 'c': 1, 'd': [1, 2]}}
-        self.assertEqual(merged, Util.deep_merge(d, e))
+        self.assertEqual(merged, deep_merge(d, e))
+
+    def test_list_order(self):
+        self.assertEqual(['b', 'a', 'c'], deep_merge(['b', 'a', 'b'], ['c', 'a']))
+
+    def test_unhashable_elements(self):
+        a = [{'source': 'logs', 'target': '/var/log'}, ['x']]
+        b = [{'target': '/var/log', 'source': 'logs'}, ['x'], {'source': 'data', 'target': '/data'}]
+        self.assertEqual([{'source': 'logs', 'target': '/var/log'}, ['x'], {'source': 'data', 'target': '/data'}],
+                         deep_merge(a, b))
+
+    def test_repeated_merges(self):
+        merger = DeepMerger()
+        config = {'ports': ['80:80']}
+        for port in range(3):
+            merger.merge(config, {'ports': ['80:80', str(port)]})
+        self.assertEqual(['80:80', '0', '1', '2'], config['ports'])
+
+    def test_strategies(self):
+        merger = DeepMerger({'command': MERGE_REPLACE, 'dns': MERGE_APPEND, 'volumes': UnionByKey('target')})
+        config = {'command': ['a', 'b'], 'dns': ['1.1.1.1'], 'volumes': [{'source': 'a', 'target': '/a'}, 'x:/x']}
+        merger.merge(config, {'command': ['c'], 'dns': ['1.1.1.1'], 'volumes': [{'source': 'b', 'target': '/a'}]})
+        self.assertEqual({'command': ['c'], 'dns': ['1.1.1.1', '1.1.1.1'],
+                          'volumes': [{'source': 'b', 'target': '/a'}, 'x:/x']}, config)
+
+
+class TestParseSize(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(1000, parse_size('1000'))
+        self.assertEqual(512 * 1000 ** 2, parse_size('512M'))
+        self.assertEqual(20 * 1000 ** 3, parse_size(' 20 gb '))
+        self.assertEqual(1500, parse_size('1.5KB'))
+        self.assertEqual(2 * 1000 ** 4, parse_size('2T'))
+
+    def test_invalid(self):
+        for size in ['', 'GB', '-1GB', '1.2.3', '.5G', '20 PB', '20 GiB', '1e3']:
+            self.assertRaises(ValueError, parse_size, size)
+
+
+class TestParseDuration(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(90, parse_duration('90'))
+        self.assertEqual(90, parse_duration('90s'))
+        self.assertEqual(30 * 60, parse_duration('30m'))
+        self.assertEqual(12 * 60 * 60, parse_duration(' 12 H '))
+        self.assertEqual(7 * 24 * 60 * 60, parse_duration('7d'))
+        self.assertEqual(14 * 24 * 60 * 60, parse_duration('2w'))
+        self.assertEqual(36 * 60 * 60, parse_duration('1.5d'))
+
+    def test_invalid(self):
+        for duration in ['', 'd', '-7d', '1.2.3d', '7 days', '1y', '7dd']:
+            self.assertRaises(ValueError, parse_duration, duration)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from autocompose.util import clear_path_index, get_from_paths, load_yaml_file, record_inputs
+from autocompose.watcher import get_snapshot, wait_for_changes
+
+
+class TestWaitForChanges(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.services_directory = os.path.join(self.directory.name, 'services', 'web')
+        os.makedirs(self.services_directory)
+        self.service_file = os.path.join(self.services_directory, 'docker-compose.yml')
+        self.write(self.service_file, 'image: web\n')
+        clear_path_index()
+
+    def tearDown(self):
+        clear_path_index()
+        self.directory.cleanup()
+
+    @staticmethod
+    def write(file_name, content):
+        with open(file_name, 'w') as file:
+            file.write(content)
+
+    def compose(self):
+        with mock.patch.dict(os.environ, {'AUTOCOMPOSE_PATH': self.directory.name}):
+            with record_inputs() as inputs:
+                for file_name in get_from_paths(os.path.join('services', 'web'), 'docker-compose.yml'):
+                    load_yaml_file(file_name)
+        return inputs
+
+    def test_change_while_composing(self):
+        inputs = self.compose()
+        self.assertEqual({self.service_file, self.services_directory}, set(inputs['states']))
+
+        # Written after the file was read, but before the wait started.
+        self.write(self.service_file, 'image: web:2\n')
+        changed = wait_for_changes(inputs['states'], poll_interval=60)
+        self.assertEqual({self.service_file: get_snapshot([self.service_file])[self.service_file]}, changed)
+
+    def test_file_created_while_composing(self):
+        inputs = self.compose()
+        self.write(os.path.join(self.services_directory, 'Dockerfile'), 'FROM scratch\n')
+        self.assertEqual({self.services_directory}, set(wait_for_changes(inputs['states'], poll_interval=60)))
+
+    def test_change_while_waiting(self):
+        inputs = self.compose()
+        writer = threading.Timer(0.1, self.write, [self.service_file, 'image: web:3\n'])
+        writer.start()
+        start = time.time()
+        try:
+            self.assertEqual({self.service_file}, set(wait_for_changes(inputs['states'], poll_interval=0.05)))
+        finally:
+            writer.join()
+        self.assertGreaterEqual(time.time() - start, 0.05)